@@ -1 +1,7 @@
-from .choroshape import *
\ No newline at end of file
+from .choroshape import *
+from .animation import *
+from .cache import *
+from .shapeindex import *
+from .smoothing import *
+from .insets import *
+from .tiles import *
\ No newline at end of file
@@ -0,0 +1,59 @@
+'''Deferred imports, so "import choroshape" stays fast for short-lived jobs
+that never draw a map or read a shapefile'''
+
+from __future__ import unicode_literals
+
+import importlib
+import os
+import sys
+
+
+class LazyModule(object):
+
+    def __init__(self, name, before_import=None):
+        '''Stands in for a module and imports it on first attribute access
+        Attributes:
+            name(str): dotted module name
+            before_import(callable): called once right before the import
+            '''
+        self.__dict__['_name'] = name
+        self.__dict__['_before_import'] = before_import
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            if self._before_import is not None:
+                self._before_import()
+            module = importlib.import_module(self._name)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return '<lazy module %r>' % self._name
+
+
+def select_backend():
+    '''Switches matplotlib to the non-GUI Agg backend for headless runs,
+    unless pyplot is already in use or a backend was chosen through
+    MPLBACKEND or a matplotlibrc file'''
+    if 'matplotlib.pyplot' in sys.modules or os.environ.get('MPLBACKEND'):
+        return
+    if os.name == 'nt' or sys.platform == 'darwin':
+        return  # these always have a display
+    if os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'):
+        return
+    import matplotlib
+    import matplotlib.rcsetup
+    sentinel = getattr(matplotlib.rcsetup, '_auto_backend_sentinel', None)
+    if dict.__getitem__(matplotlib.rcParams, 'backend') is sentinel:
+        matplotlib.use('Agg')
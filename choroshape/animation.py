@@ -0,0 +1,196 @@
+'''Animated maps of a time series, e.g. population change year by year.
+
+The map is drawn once, for the frame with the most legend entries. Each
+frame then only recolors the shapes from its group codes and swaps the
+title and legend text before the canvas is drawn again, and the frames go
+straight from the canvas buffer to the encoder.
+
+    years = MultiIndicatorDataset(df, geodf, 'FIPS', 'FIPS',
+                                  ['2011', '2012', '2013', '2014', '2015'],
+                                  titles=[...], bins=[-5, 0, 5])
+    ChoroplethAnimation(years, cat_name='pop_change').save(
+        formats=['gif', 'mp4'])
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'ChoroplethAnimation'
+]
+
+import os
+import subprocess
+from six import string_types
+
+from ._lazy import LazyModule
+from .choroshape import Choropleth, ChoroplethStyle, MultiIndicatorDataset
+
+np = LazyModule('numpy')
+matplotlib = LazyModule('matplotlib')
+Image = LazyModule('PIL.Image')
+
+# Animation formats and their file extensions
+ANIMATION_FORMATS = {'gif': '.gif', 'apng': '.png', 'mp4': '.mp4'}
+
+
+class ChoroplethAnimation(object):
+
+    def __init__(self, frames, ch_style=None, city_info=None, out_path='',
+                 cat_name=None, fps=1):
+        '''An animated choropleth with one frame per dataset
+        Attributes:
+            frames(MultiIndicatorDataset or list): the datasets to show, in
+                order: the indicators of a MultiIndicatorDataset, or
+                AreaPopDatasets and IndicatorViews on the same geometry.
+                Give them the same bins for a legend that stays put.
+            ch_style(ChoroplethStyle object or str): style of every frame
+            city_info(CityInfo object)
+            out_path(str): directory to save the animation in
+            cat_name(str): file name, default is the first frame's cat_name
+            fps(float): frames per second
+            '''
+        if isinstance(frames, MultiIndicatorDataset):
+            frames = list(frames.indicators())
+        self.frames = list(frames)
+        if not self.frames:
+            raise ValueError('An animation needs at least one frame.')
+        fingerprint = self.frames[0].geometry_fingerprint()
+        for frame in self.frames[1:]:
+            if frame.geometry_fingerprint() != fingerprint:
+                raise ValueError('Every frame must use the same geometry.')
+        if isinstance(ch_style, string_types) or ch_style is None:
+            ch_style = ChoroplethStyle(ch_style)
+        self.ch_style = ch_style
+        self.city_info = city_info
+        self.out_path = os.path.normpath(out_path)
+        if cat_name is None:
+            cat_name = self.frames[0].cat_name
+        self.cat_name = cat_name
+        self.fps = fps
+
+    def _rgbs(self, frame):
+        return (self.ch_style.get_colors(frame.num_cats, frame.bins) +
+                self.ch_style.get_exception_colors(
+                    frame.classification.exceptions))
+
+    def images(self):
+        '''Draws each frame on one figure
+        Returns:
+            generator of numpy.ndarray[uint8]: height x width x 3 RGB image
+                of each frame, cropped like a saved map'''
+        base = max(self.frames, key=lambda f: f.classification.num_groups)
+        chor = Choropleth(base, self.ch_style, self.city_info, savepdf=False)
+        chor.draw(every_shape=True)
+        fig = chor.ax.figure
+        fig.set_dpi(self.ch_style.resolution)
+        canvas = fig.canvas
+        # Every frame is cut to the extent of the fullest one
+        bbox = chor._tight_bbox(fig)
+        shapes = chor.ax.collections[0]
+        legend = chor.ax.get_legend()
+        # legendHandles before matplotlib 3.7
+        handles = getattr(legend, 'legend_handles', None) or \
+            legend.legendHandles
+        entries = list(zip(handles, legend.texts))
+
+        for frame in self.frames:
+            rgbs = self._rgbs(frame)
+            shapes.set_facecolor(frame.classification.colors(rgbs))
+            shapes.set_edgecolor(chor.edge_colors(frame.classification))
+            chor.ax.title.set_text(chor.layout.wrap_title(frame.title))
+            labels = frame.group_names
+            for i, (handle, text) in enumerate(entries):
+                handle.set_visible(i < len(labels))
+                text.set_visible(i < len(labels))
+                if i < len(labels):
+                    handle.set_facecolor(rgbs[i])
+                    text.set_text(labels[i])
+            canvas.draw()
+            image = np.asarray(canvas.buffer_rgba())
+            dpi = fig.dpi
+            height = image.shape[0]
+            top = max(0, int(round(height - bbox.y1 * dpi)))
+            bottom = min(height, int(round(height - bbox.y0 * dpi)))
+            left = max(0, int(round(bbox.x0 * dpi)))
+            right = min(image.shape[1], int(round(bbox.x1 * dpi)))
+            yield image[top:bottom, left:right, :3].copy()
+
+    def save(self, target=None, formats='gif'):
+        '''Renders the frames once and writes them in each format
+        Args:
+            target(str or file-like object or dict): as for
+                Choropleth.save_plot. The default is a file named after
+                cat_name in out_path.
+            formats(str or list[str]): 'gif', 'apng' or 'mp4'. MP4 needs
+                ffmpeg, found like matplotlib's animation writers find it.
+        Returns:
+            the path or stream written to, or a dict of them by format when
+            there are several'''
+        outputs = self._outputs(target, formats)
+        for fmt, _ in outputs:
+            if fmt not in ANIMATION_FORMATS:
+                raise ValueError('Animation format must be one of %s, not '
+                                 '%r.' % (', '.join(sorted(ANIMATION_FORMATS)),
+                                          fmt))
+        frames = list(self.images())
+        results = {}
+        for fmt, dest in outputs:
+            if fmt == 'mp4':
+                self._write_mp4(frames, dest)
+            else:
+                images = [Image.fromarray(frame) for frame in frames]
+                images[0].save(dest, format='GIF' if fmt == 'gif' else 'PNG',
+                               save_all=True, append_images=images[1:],
+                               duration=int(round(1000.0 / self.fps)),
+                               loop=0)
+            results[fmt] = dest
+        if len(results) == 1:
+            return list(results.values())[0]
+        return results
+
+    def _outputs(self, target, formats):
+        if isinstance(target, dict):
+            return list(target.items())
+        if isinstance(formats, string_types):
+            formats = [formats]
+        if target is None:
+            target = os.path.join(self.out_path, self.cat_name)
+        if not isinstance(target, string_types):  # a file-like object
+            if len(formats) != 1:
+                raise ValueError('A file-like target takes one format. ' +
+                                 'Use a dict of targets for several formats.')
+            return [(formats[0], target)]
+        base, ext = os.path.splitext(target)
+        if ext.lower() not in ANIMATION_FORMATS.values():
+            base = target
+        return [(fmt, base + ANIMATION_FORMATS.get(fmt, '.' + fmt))
+                for fmt in formats]
+
+    def _write_mp4(self, frames, dest):
+        '''Pipes the raw frames to ffmpeg. Its H.264 output needs even
+        dimensions, so the frames are padded with white.'''
+        height, width = frames[0].shape[:2]
+        to_file = isinstance(dest, string_types)
+        cmd = [matplotlib.rcParams['animation.ffmpeg_path'], '-y',
+               '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '%dx%d' % (width, height), '-r', str(self.fps),
+               '-i', '-', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white',
+               '-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+        # MP4 needs a seekable output, so streams get a fragmented file
+        cmd += [dest] if to_file else ['-movflags', 'frag_keyframe+empty_moov',
+                                       '-f', 'mp4', '-']
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError:
+            raise RuntimeError('Writing MP4 animations requires ffmpeg; set '
+                               "matplotlib.rcParams['animation.ffmpeg_path'] "
+                               'if it is not on the PATH.')
+        video, err = proc.communicate(b''.join(
+            np.ascontiguousarray(frame).tobytes() for frame in frames))
+        if proc.returncode != 0:
+            raise RuntimeError('ffmpeg failed: %s' % err.decode('utf-8',
+                                                                'replace'))
+        if not to_file:
+            dest.write(video)
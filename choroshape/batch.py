@@ -0,0 +1,216 @@
+'''Memory accounting and spilling for long batches of maps.
+
+A batch holds every distinct input in memory until its last map is drawn,
+and worker processes grow a little with each map. A MemoryBudget follows
+the resident memory of each stage of the batch. When the batch goes over
+its budget, inputs are spilled to classification files (see classfile.py)
+and mapped back from disk by the maps that need them. run_batch also drops
+inputs after their last map and replaces worker processes after a number
+of maps or once they grow past a size.
+
+    choroshape maps.json --memory-mb 2000 --max-tasks-per-child 50
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'MemoryBudget',
+    'SpilledFrame',
+    'rss_mb'
+]
+
+import collections
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+
+from ._lazy import LazyModule
+from .classfile import read_arrays, write_arrays
+
+gpd = LazyModule('geopandas')
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+shapely = LazyModule('shapely')
+
+
+def rss_mb():
+    '''Resident memory of this process in MB. Without /proc (outside
+    Linux) it is the peak resident memory, which only grows.'''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+    except (IOError, OSError, ValueError, AttributeError):
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB elsewhere
+        return peak / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def _blob(strings):
+    '''Packs byte strings into one uint8 array and their offsets'''
+    sizes = np.array([len(s) for s in strings], dtype=np.int64)
+    return (np.frombuffer(b''.join(strings), dtype=np.uint8),
+            np.concatenate([[0], np.cumsum(sizes)]))
+
+
+def _unblob(blob, offsets):
+    return [blob[offsets[i]:offsets[i + 1]].tobytes()
+            for i in range(len(offsets) - 1)]
+
+
+class SpilledFrame(object):
+
+    def __init__(self, path):
+        '''A DataFrame or GeoDataFrame written to disk by MemoryBudget.spill
+        Attributes:
+            path(str): the classification file holding it
+            '''
+        self.path = path
+
+    @staticmethod
+    def write(frame, path):
+        '''Writes the columns of a frame as arrays: numbers as they are,
+        text as UTF-8 and shapes as WKB, each in one array with offsets.
+        The index is not kept.
+        Returns:
+            SpilledFrame'''
+        arrays = []
+        columns = []
+        geometry = getattr(frame, '_geometry_column_name', None)
+        for i, col in enumerate(frame.columns):
+            values = frame[col]
+            if col == geometry:
+                kind = 'geometry'
+                blob, offsets = _blob(shapely.to_wkb(
+                    np.asarray(values.values)))
+            elif values.dtype.kind in 'biufcmM':
+                kind = 'array'
+                arrays.append(('%d' % i, values.to_numpy()))
+            else:
+                kind = 'text'
+                missing = values.isnull().to_numpy()
+                arrays.append(('%d:missing' % i, missing))
+                blob, offsets = _blob([
+                    b'' if m else ('%s' % v).encode('utf-8')
+                    for v, m in zip(values, missing)])
+            if kind != 'array':
+                arrays += [('%d:blob' % i, blob), ('%d:offsets' % i, offsets)]
+            columns.append([('%s' % col), kind])
+        crs = getattr(frame, 'crs', None)
+        write_arrays(path, arrays, {
+            'columns': columns, 'geometry': geometry,
+            'crs': crs.to_wkt() if crs is not None else None})
+        return SpilledFrame(path)
+
+    def load(self):
+        '''Reads the frame back; numbers come straight from the mapped file
+        Returns:
+            pandas.DataFrame or geopandas.GeoDataFrame'''
+        arrays, meta = read_arrays(self.path)
+        data = collections.OrderedDict()
+        for i, (col, kind) in enumerate(meta['columns']):
+            if kind == 'array':
+                data[col] = arrays['%d' % i]
+                continue
+            items = _unblob(arrays['%d:blob' % i], arrays['%d:offsets' % i])
+            if kind == 'geometry':
+                data[col] = shapely.from_wkb(np.array(items, dtype=object))
+            else:
+                data[col] = np.array(
+                    [None if m else s.decode('utf-8')
+                     for s, m in zip(items, arrays['%d:missing' % i])],
+                    dtype=object)
+        if meta['geometry'] is None:
+            return pd.DataFrame(data)
+        return gpd.GeoDataFrame(data, geometry=meta['geometry'],
+                                crs=meta['crs'])
+
+
+class MemoryBudget(object):
+
+    def __init__(self, limit_mb=None, spill_dir=None):
+        '''Follows the memory of a batch and spills inputs to disk when it
+        is over its limit
+        Attributes:
+            limit_mb(float): resident memory to stay under, None for no
+                limit
+            spill_dir(str): directory for spilled inputs, a temporary one by
+                default, made on the first spill
+            stages(dict{str: list}): for each stage, the times it ran, the
+                resident memory it added in MB in total, and the most
+                resident memory seen at its end
+            spilled(list[str]): files written by spill
+            '''
+        self.limit_mb = limit_mb
+        self.spill_dir = spill_dir
+        self.stages = collections.OrderedDict()
+        self.spilled = []
+        self._own_dir = False
+        self._lock = threading.Lock()
+
+    def over(self):
+        '''Whether this process is over the limit'''
+        return self.limit_mb is not None and rss_mb() > self.limit_mb
+
+    def record(self, name, added_mb, rss):
+        '''Adds one run of a stage, e.g. measured in a worker'''
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += added_mb
+            stage[2] = max(stage[2], rss)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''Measures the resident memory a block adds'''
+        before = rss_mb()
+        try:
+            yield
+        finally:
+            after = rss_mb()
+            self.record(name, after - before, after)
+
+    def spill(self, frame, name):
+        '''Writes a frame to the spill directory
+        Args:
+            frame(pandas.DataFrame or geopandas.GeoDataFrame)
+            name(str): used in the file name
+        Returns:
+            SpilledFrame'''
+        with self._lock:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix='choroshape-')
+                self._own_dir = True
+            elif not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+            path = os.path.join(self.spill_dir, '%d-%s.cls' % (
+                len(self.spilled), ''.join(c if c.isalnum() else '_'
+                                           for c in name)[:40]))
+            self.spilled.append(path)
+        with self.stage('spill'):
+            return SpilledFrame.write(frame, path)
+
+    def release(self, spilled):
+        '''Deletes the file of a SpilledFrame that is no longer needed'''
+        if os.path.exists(spilled.path):
+            os.remove(spilled.path)
+
+    def cleanup(self):
+        '''Deletes every spilled file, and the spill directory if it was
+        made here'''
+        for path in self.spilled:
+            if os.path.exists(path):
+                os.remove(path)
+        if self._own_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self.spilled = []
+
+    def report(self):
+        '''One line per stage: runs, memory added and peak'''
+        return ['%-8s %5d run(s), %+9.1f MB in total, peak %.1f MB' % (
+            name, runs, added, peak)
+            for name, (runs, added, peak) in self.stages.items()]
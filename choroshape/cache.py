@@ -0,0 +1,188 @@
+'''Content-addressed cache for rendered choropleth maps'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'RenderCache',
+    'geometry_fingerprint',
+    'frame_fingerprint',
+    'style_fingerprint'
+]
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Bump this when a change to the drawing code alters the rendered output
+CACHE_VERSION = 2
+
+
+def geometry_fingerprint(geometry):
+    '''Hashes a sequence of shapely geometries by their WKB representation
+    Args:
+        geometry(geopandas.GeoSeries or array of shapely geometries)
+    Returns:
+        fingerprint(str): hex digest'''
+    import shapely
+    h = hashlib.sha1()
+    for wkb in shapely.to_wkb(getattr(geometry, 'values', geometry)):
+        h.update(wkb if wkb is not None else b'')
+    return h.hexdigest()
+
+
+def frame_fingerprint(data, columns):
+    '''Hashes the values of some DataFrame columns in row order
+    Args:
+        data(pandas.DataFrame): frame to hash
+        columns(list[str]): columns to include
+    Returns:
+        fingerprint(str): hex digest'''
+    import pandas as pd
+    h = hashlib.sha1()
+    for c in columns:
+        h.update(str(c).encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(
+            data[c].astype(str), index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def style_fingerprint(obj):
+    '''Hashes the plain (str, number, bool, list, dict, None) attributes of an
+    object, e.g. a ChoroplethStyle. Objects like colormaps are skipped, so
+    anything they affect has to be hashed separately.'''
+    plain = {}
+    for k, v in sorted(vars(obj).items()):
+        try:
+            plain[k] = json.loads(json.dumps(v, sort_keys=True))
+        except (TypeError, ValueError):
+            continue
+    return hashlib.sha1(
+        json.dumps(plain, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RenderCache(object):
+
+    def __init__(self, cache_dir, max_bytes=512 * 2 ** 20):
+        '''A directory of rendered map files keyed by content hash, with
+        least-recently-used eviction once the directory grows past a size
+        limit. File modification times record the last use.
+        Attributes:
+            cache_dir(str): directory to keep artifacts in, created if needed
+            max_bytes(int): size limit for the directory, None for no limit
+            hits(int): number of lookups that found an artifact
+            misses(int): number of lookups that did not
+            '''
+        self.cache_dir = os.path.normpath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def path_for(self, key, ext):
+        '''Location of the artifact for key with a file extension'''
+        return os.path.join(self.cache_dir, key + '.' + ext.lstrip('.'))
+
+    def get(self, key, ext):
+        '''Returns the path of a cached artifact or None. A hit marks the
+        artifact as recently used.'''
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path, None)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def contains(self, key, ext):
+        '''Checks for an artifact without counting a hit or a miss'''
+        return os.path.exists(self.path_for(key, ext))
+
+    def read(self, key, ext):
+        '''Returns the bytes of a cached artifact or None'''
+        path = self.get(key, ext)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except (IOError, OSError):  # evicted in the meantime
+            return None
+
+    def fetch(self, key, ext, dest):
+        '''Copies a cached artifact to dest. Returns True on a hit.'''
+        path = self.get(key, ext)
+        if path is None:
+            return False
+        shutil.copyfile(path, dest)
+        return True
+
+    def put(self, key, ext, src):
+        '''Stores a file or a bytes object under key, then evicts old
+        artifacts if the directory is over its size limit.
+        Args:
+            key(str): content hash
+            ext(str): file extension of the artifact
+            src(str or bytes): path of a rendered file or its content
+        Returns:
+            path(str): location of the cached artifact'''
+        path = self.path_for(key, ext)
+        # Write to a temporary name first so readers never see partial files
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(src, bytes):
+                    f.write(src)
+                else:
+                    with open(src, 'rb') as s:
+                        shutil.copyfileobj(s, f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict(keep=path)
+        return path
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def size(self):
+        '''Total size of the cached artifacts in bytes'''
+        return sum(e[1] for e in self._entries())
+
+    def evict(self, keep=None):
+        '''Removes least recently used artifacts until the cache fits in
+        max_bytes. The artifact at keep is never removed.'''
+        if self.max_bytes is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        '''Removes every artifact'''
+        for e in self._entries():
+            os.remove(e[2])
@@ -6,26 +6,56 @@ __all__ = [
     'clean_FIPS',
     'fix_FIPS',
     'get_custom_bins',
+    'get_custom_bins_batch',
+    'bin_labels_batch',
+    'score_bins',
+    'best_custom_bins',
+    'load_data',
+    'load_geodata',
     'make_choropleth',
+    'Classification',
     'AreaPopDataset',
+    'MultiIndicatorDataset',
+    'IndicatorView',
+    'BivariateClassification',
+    'BivariateDataset',
     'CityInfo',
     'CityLabel',
     'ChoroplethStyle',
     'Choropleth'
 ]
 
-import geopandas as gpd
-import numpy as np
-import pandas as pd
-import matplotlib
 import os
-import textwrap
+import io
 import re
 import math
+import hashlib
 from six import string_types
 
-from matplotlib import pyplot as plt, patches as mpatches
-from matplotlib.colors import LinearSegmentedColormap, ListedColormap, hex2color
+from ._lazy import LazyModule, select_backend
+
+# The heavy dependencies are imported on first use
+gpd = LazyModule('geopandas')
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+matplotlib = LazyModule('matplotlib')
+mcolors = LazyModule('matplotlib.colors')
+mfigure = LazyModule('matplotlib.figure')
+mpatches = LazyModule('matplotlib.patches')
+backend_bases = LazyModule('matplotlib.backend_bases')
+backend_agg = LazyModule('matplotlib.backends.backend_agg')
+plt = LazyModule('matplotlib.pyplot', before_import=select_backend)
+
+from .cache import CACHE_VERSION, frame_fingerprint, style_fingerprint
+from .classfile import read_arrays, write_arrays
+from .columnar import is_columnar, read_geodata, read_table, table_columns, \
+    write_table
+from .geometry import GeometryStore
+from .layout import LayoutTemplate
+from .partitioned import ingest_partitioned, merge_sketches
+from .profiling import MapProfile
+from .shapeindex import StateIndex
+from .smoothing import ratio_cv, smooth_rates
 
 
 def clean_FIPS(FIPS_code):
@@ -38,6 +68,14 @@ def clean_FIPS(FIPS_code):
     return FIPS_code
 
 
+def _clean_FIPS_column(codes):
+    '''clean_FIPS for a whole column'''
+    codes = codes.astype(str).str.replace(r'[\W_]+', '', regex=True)
+    if not codes.str.fullmatch('[0-9]*').all():
+        raise ValueError('Data contains non-digit FIPS code values')
+    return codes
+
+
 def fix_FIPS(data, county_col, state_FIPS=None):
     '''Takes FIPS data and outputs a dataframe with a FIPS column containing
     5-digit, merged, state and county FIPS codes.
@@ -56,12 +94,10 @@ def fix_FIPS(data, county_col, state_FIPS=None):
     if data[county_col].isnull().values.any():
         raise ValueError('Data contains empty FIPS code values.')
 
-    # Clean the county codes
-    data[county_col] = data.loc[:, county_col].map(
-        lambda x: clean_FIPS(x))
+    # Clean the county codes, all at once as in clean_FIPS
+    data[county_col] = _clean_FIPS_column(data[county_col])
 
-    data[county_col] = data.loc[:, county_col].apply(
-        lambda x: x.zfill(3) if len(x) < 3 else x)
+    data[county_col] = data[county_col].str.zfill(3)
 
     # check if state codes need to be added
     if (data[county_col].str.len() == 3).any():
@@ -76,11 +112,10 @@ def fix_FIPS(data, county_col, state_FIPS=None):
             state_col = 'state_FIPS'
             data[state_col] = state_FIPS  # create a state FIPS column
 
-        data[state_col] = data.loc[:, state_col].map(
-            lambda x: clean_FIPS(x))  # clean the state FIPS column
+        # clean the state FIPS column
+        data[state_col] = _clean_FIPS_column(data[state_col])
 
-        data[county_col] = data.loc[:, county_col].apply(
-            lambda x: x[-3:])  # Make it all consistent
+        data[county_col] = data[county_col].str[-3:]  # Make it all consistent
         data[county_col] = data[state_col].str.cat(data[county_col], sep='')
 
     # Check that codes are the right length
@@ -103,6 +138,18 @@ def round_py2(x, d=0):
     return float(math.floor((x * p) + math.copysign(0.5, x)))/p
 
 
+def _round_array(x, d=0):
+    '''Rounds like the built-in round, which rounds the exact binary value
+    where numpy.round scales it first; the two only differ next to ties'''
+    x = np.asarray(x, dtype=float)
+    rounded = np.round(x, d)
+    scaled = np.abs(x * 10 ** d)
+    near_tie = np.abs(scaled - np.floor(scaled) - .5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(float(v), d) for v in x[near_tie]]
+    return rounded
+
+
 # TODO decide if you want this out of the object
 def get_custom_bins(level, num_cats=4, dif=.1, direction=None, precision=1):
     '''Creates percent cutoff bins a certain amount away from an index
@@ -121,38 +168,53 @@ def get_custom_bins(level, num_cats=4, dif=.1, direction=None, precision=1):
     Returns:
         bins(list[float]): list of bin cutoff points
         '''
+    return get_custom_bins_batch([level], dif, num_cats, direction,
+                                 precision)[0].tolist()
+
+
+def get_custom_bins_batch(levels, difs=.1, num_cats=4, direction=None,
+                          precision=1):
+    '''get_custom_bins for many candidate levels and difs at once
+    Args:
+        levels(float or sequence[float]): index markers, see
+            get_custom_bins
+        difs(float or sequence[float]): multipliers, broadcast against
+            levels
+        num_cats, direction, precision: see get_custom_bins
+    Returns:
+        bins(numpy.ndarray): one row of num_cats + 1 cutoffs per candidate
+        '''
+    levels, difs = np.broadcast_arrays(np.atleast_1d(levels).astype(float),
+                                       np.atleast_1d(difs).astype(float))
     # Negative levels are not allowed
-    if float(level) <= 0:
+    if (levels <= 0).any():
         raise ValueError(
             'Level is less than or equal to zero.' +
             'get_custom_bins only makes positive categories.')
 
     # Levels are assumed to be percentages
-    if float(level) < 1:
-        level = float(level) * 100.0
-    level = round(level, 1)
-    plus_mult = 1
-    minus_mult = 1
-    mid = int(round_py2(float(num_cats)/2))  # In case there's an odd number
+    levels = _round_array(np.where(levels < 1, levels * 100.0, levels), 1)
+    bins = np.zeros((len(levels), num_cats + 1))
+    bins[:, num_cats] = 100.0
+    # The multipliers grow by repeated addition, as they always have
+    plus_mult = np.ones(len(levels))
+    minus_mult = np.ones(len(levels))
 
     if direction == 'pos':
-        bins_dict = {0: 0.0, 1: level, num_cats: 100.0}
+        bins[:, 1] = levels
         for i in range(2, num_cats):
-            plus_mult += dif
-            bins_dict[i] = round(level*plus_mult, precision)
+            plus_mult = plus_mult + difs
+            bins[:, i] = _round_array(levels*plus_mult, precision)
     else:  # direction is None
-        bins_dict = {0: 0.0, mid: float(level)}
+        mid = int(round_py2(float(num_cats)/2))  # In case there's an odd number
+        bins[:, mid] = levels
         for i in range(1, mid):
-            plus_mult += dif
-            minus_mult -= dif
-            bins_dict[mid + i] = round(level*plus_mult, 1)
-            bins_dict[mid - i] = round(level*minus_mult, 1)
-        bins_dict[num_cats] = 100.0
-
-    bins = []
-    for j in sorted(bins_dict, key=bins_dict.get):
-        bins.append(bins_dict[j])
-    return bins
+            plus_mult = plus_mult + difs
+            minus_mult = minus_mult - difs
+            if mid + i < num_cats:
+                bins[:, mid + i] = _round_array(levels*plus_mult, 1)
+            bins[:, mid - i] = _round_array(levels*minus_mult, 1)
+    return np.sort(bins, axis=1)
 
 
 def axis_data_coords_sys_transform(ax_obj_in, xin, yin, inverse=False):
@@ -181,12 +243,274 @@ def axis_data_coords_sys_transform(ax_obj_in, xin, yin, inverse=False):
     return xout, yout
 
 
+def score_bins(values, bins):
+    '''Scores candidate cutoffs against the values they would map, all in
+    one pass over the sorted values. Groups are closed on the right and the
+    first one also holds its lower cutoff, as in bin_values; values outside
+    the cutoffs are not in any group.
+    Args:
+        values(numpy.ndarray): the values, on the scale of the cutoffs;
+            missing ones are ignored
+        bins(numpy.ndarray): one row of sorted cutoffs per candidate, e.g.
+            from get_custom_bins_batch
+    Returns:
+        scores(dict{str: numpy.ndarray}): one score per candidate:
+            'gvf': goodness of variance fit, 1 - (squared deviations from
+                the group means) / (squared deviations from the mean)
+            'balance': entropy of the group sizes over its largest possible
+                value, 1 for groups of equal size
+            'coverage': share of the values inside the cutoffs
+            'counts': the size of each group, one row per candidate'''
+    values = np.sort(np.asarray(values, dtype=float))
+    values = values[np.isfinite(values)]
+    bins = np.atleast_2d(np.asarray(bins, dtype=float))
+    num_cats = bins.shape[1] - 1
+    # Where each group starts and ends in the sorted values
+    ends = np.searchsorted(values, bins, side='right')
+    ends[:, 0] = np.searchsorted(values, bins[:, 0], side='left')
+    sums = np.concatenate([[0.0], np.cumsum(values)])
+    squares = np.concatenate([[0.0], np.cumsum(values ** 2)])
+    counts = np.diff(ends, axis=1)
+    group_sums = np.diff(sums[ends], axis=1)
+    group_squares = np.diff(squares[ends], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        within = np.where(counts > 0, group_squares - group_sums ** 2 /
+                          np.maximum(counts, 1), 0).sum(axis=1)
+        covered = counts.sum(axis=1)
+        # Deviations of the covered values from their own mean
+        total = (np.diff(squares[ends[:, [0, -1]]], axis=1)[:, 0] -
+                 np.diff(sums[ends[:, [0, -1]]], axis=1)[:, 0] ** 2 /
+                 np.maximum(covered, 1))
+        gvf = np.where(total > 0, 1 - within / total, 1.0)
+        shares = counts / np.maximum(covered, 1)[:, None].astype(float)
+        entropy = -np.where(shares > 0, shares * np.log(shares), 0).sum(axis=1)
+    return {'gvf': gvf,
+            'balance': entropy / np.log(num_cats) if num_cats > 1 else
+            np.ones(len(bins)),
+            'coverage': covered / float(max(len(values), 1)),
+            'counts': counts}
+
+
+def best_custom_bins(values, levels, difs=.1, num_cats=4, direction=None,
+                     precision=1, min_balance=0.0):
+    '''Tries get_custom_bins for every combination of levels and difs and
+    keeps the cutoffs that fit the values best
+    Args:
+        values(numpy.ndarray): the values to map, in percent like the
+            cutoffs, e.g. AreaPopDataset.values with percent_format
+        levels, difs(sequence[float]): candidates, every level is tried
+            with every dif
+        num_cats, direction, precision: see get_custom_bins
+        min_balance(float): leave out candidates whose groups are less
+            balanced than this, see score_bins
+    Returns:
+        bins(list[float]): the cutoffs with the highest goodness of variance
+            fit
+        scores(dict{str: float}): their scores'''
+    levels, difs = np.meshgrid(np.atleast_1d(levels), np.atleast_1d(difs),
+                               indexing='ij')
+    candidates = get_custom_bins_batch(levels.ravel(), difs.ravel(),
+                                       num_cats, direction, precision)
+    scores = score_bins(values, candidates)
+    fit = np.where(scores['balance'] >= min_balance, scores['gvf'], -np.inf)
+    if not np.isfinite(fit).any():
+        raise ValueError('No candidate bins are balanced enough.')
+    best = int(np.argmax(fit))
+    return candidates[best].tolist(), dict(
+        (k, float(v[best])) for k, v in scores.items() if k != 'counts')
+
+
+def bin_values(values, bins=None, num_cats=4, precision=1, quantiles=None):
+    '''Sorts values into numbered groups, either by quantile or by given
+    cutoffs
+    Args:
+        values(pandas.Series or numpy.ndarray): values to group
+        bins(list[float]): cutoffs; None splits the values into num_cats
+            groups of equal size
+        num_cats(int): how many groups to make when bins is None
+        precision(int): precision for bin cutoffs
+        quantiles(numpy.ndarray): cutoffs for num_cats groups of equal size
+            found beforehand, e.g. by merge_sketches, used like the ones qcut
+            finds when bins is None
+    Returns:
+        groups(pandas.Series or pandas.Categorical): group numbers starting
+            at 1, missing where the value is missing
+        bins(list[float] or numpy.ndarray): the cutoffs used'''
+    if bins is None and quantiles is not None:
+        groups = pd.cut(values, quantiles, labels=range(1, len(quantiles)),
+                        include_lowest=True)
+        return groups, quantiles
+    if bins is None:
+        # qcut divides data into equal groups
+        return pd.qcut(values, num_cats, labels=range(1, num_cats+1),
+                       retbins=True, precision=precision)
+    punit = 10 ** (-1*precision)
+    bins = np.asarray(bins, dtype=float).round(precision)
+    # The lower bound is zero here
+    if bins[0] > 0:
+        bins = np.concatenate([[0.0], bins])
+    # punit is added to include values that have been roudnded up
+    bins[-1] += punit
+    # for too many bins get rid of overlaps
+    bins = np.unique(bins).tolist()
+    groups = pd.cut(values, bins, labels=range(1, len(bins)),
+                    retbins=False, include_lowest=True)
+    return groups, bins
+
+
+def bin_labels(bins, precision=1, percent_format=False, labeled_cutoffs=None):
+    '''Takes the cutoffs and creates legend labels for each group
+    Args:
+        bins(list[float]): cutoffs
+        precision(int): precision for bin cutoffs
+        percent_format(bool): adds a percent sign to the labels
+        labeled_cutoffs(dict{category_number(int, 0-indexed),
+            special label(str)}): extra text for some of the labels
+    Returns:
+        group_names(list[str])'''
+    group_names = bin_labels_batch([bins], precision,
+                                   percent_format)[0].tolist()
+    if labeled_cutoffs is not None:
+        for i in labeled_cutoffs.keys():
+            if i < len(group_names):
+                group_names[i] = group_names[i] + ' ' + labeled_cutoffs[i]
+    return group_names
+
+
+def bin_labels_batch(bins, precision=1, percent_format=False):
+    '''bin_labels for many rows of cutoffs at once
+    Args:
+        bins(numpy.ndarray): one row of cutoffs per classification, e.g.
+            from get_custom_bins_batch
+        precision, percent_format: see bin_labels
+    Returns:
+        group_names(numpy.ndarray[str]): one row of labels per row of bins'''
+    bins = np.atleast_2d(np.asarray(bins, dtype=float))
+    punit = 10 ** (-1*precision)
+    sign = '%' if percent_format else ''
+    fmt = '%%.%df' % precision
+    cutoffs = np.char.add(np.char.mod(fmt, bins[:, 1:]), sign)
+    bottoms = np.char.add(np.char.mod(fmt, bins[:, 1:-1] + punit), sign)
+    group_names = np.empty(cutoffs.shape, dtype=object)
+    group_names[:, 1:] = np.char.add(np.char.add(bottoms, '-'),
+                                     cutoffs[:, 1:])
+    group_names[:, 0] = np.char.add(cutoffs[:, 0], ' or less')
+    if group_names.shape[1] > 1:
+        group_names[:, -1] = np.char.add(bottoms[:, -1], ' or more')
+    return group_names
+
+
+def _state_list(two_digit_state_FIPS):
+    '''One or several state FIPS codes as a list of two digit codes'''
+    if isinstance(two_digit_state_FIPS, (list, tuple)):
+        return [str(s).zfill(2) for s in two_digit_state_FIPS]
+    return [str(two_digit_state_FIPS).zfill(2)]
+
+
+def load_data(data_csv, two_digit_state_FIPS, columns=None):
+    '''Reads a data csv for make_choropleth and fixes its FIPS codes
+    Args:
+        data_csv(str or pandas.DataFrame): normed path name to csv file, or
+            the data already read; a DataFrame is copied, not modified.
+            Parquet and Feather files (by extension) are read for the
+            states only, so they need 5-digit FIPS codes.
+        two_digit_state_FIPS(str or int or list): two digit state FIPS code,
+            or a list of them; the data then needs 5-digit FIPS codes
+        columns(list[str]): columns to read from a Parquet or Feather file
+            if it has them, default is all
+    Returns:
+        data(pandas.DataFrame)'''
+    states = _state_list(two_digit_state_FIPS)
+    if isinstance(data_csv, pd.DataFrame):
+        data = data_csv.copy()
+    elif is_columnar(data_csv):
+        if columns is not None:
+            names = table_columns(data_csv)
+            columns = [c for c in columns if c in names]
+        data = read_table(data_csv, columns, states)
+        if data.empty:
+            raise ValueError('%s has no rows for state %s. Parquet and '
+                             'Feather data needs 5-digit FIPS codes.' % (
+                                 data_csv, ', '.join(states)))
+    else:
+        data = pd.read_csv(os.path.normpath(data_csv))
+    if len(states) > 1 and (data['FIPS'].astype(str).str.len() < 4).any():
+        raise ValueError('Data for several states needs 5-digit FIPS codes.')
+    data = fix_FIPS(data, 'FIPS', states[0])
+    return data.dropna()
+
+
+def load_geodata(shpfile, two_digit_state_FIPS, geoFIPS_col=None,
+                 geometry_col=None, geostate_col=None):
+    '''Reads a county shapefile for make_choropleth and keeps one state
+    Args:
+        shpfile(str or geopandas.GeoDataFrame or StateIndex or
+            GeometryStore): normed path name to shapefile, or the shapefile
+            already read; a GeoDataFrame is copied, not modified. A
+            GeometryStore is taken to be cut to the states already and is
+            returned as it is, so maps drawn from it share it. A StateIndex reads only the one state,
+            with the columns it was built with. A GeoParquet or Feather
+            file is read for its needed columns only, and with geostate_col
+            for the states' rows only.
+        two_digit_state_FIPS(str or int or list): two digit state FIPS
+            code, or a list of them to keep several states
+        geoFIPS_col(str): name of the FIPS column, default is 'COUNTYFP'
+        geometry_col(str): name of the geometry column, default is "geometry"
+        geostate_col(str): name of a state FIPS column, e.g. 'STATEFP'. Needed
+            to pick one state out of a national shapefile with 3-digit county
+            codes.
+    Returns:
+        geodata(geopandas.GeoDataFrame or GeometryStore): with 'FIPS' and
+            'geometry' columns'''
+    if isinstance(shpfile, GeometryStore):
+        return shpfile
+    states = _state_list(two_digit_state_FIPS)
+    if isinstance(shpfile, StateIndex):
+        if len(states) == 1:
+            return shpfile.load(states[0])
+        return pd.concat([shpfile.load(s) for s in states],
+                         ignore_index=True)
+    if geometry_col is None:
+        geometry_col = 'geometry'
+    # TODO find what contains countyfp
+    if geoFIPS_col is None:
+        geoFIPS_col = 'COUNTYFP'
+    if isinstance(shpfile, gpd.GeoDataFrame):
+        geodata = shpfile
+    elif is_columnar(shpfile):
+        geodata = read_geodata(
+            shpfile, [c for c in [geoFIPS_col, geostate_col, geometry_col]
+                      if c is not None],
+            states if geostate_col is not None else None,
+            state_col=geostate_col)
+    else:
+        geodata = gpd.GeoDataFrame.from_file(os.path.normpath(shpfile))
+    state_FIPS = states[0]
+    if geostate_col is None:
+        geodata = geodata[[geoFIPS_col, geometry_col]].copy()
+        geodata.columns = ['FIPS', 'geometry']
+    else:
+        geodata = geodata[[geoFIPS_col, geostate_col, geometry_col]].copy()
+        geodata.columns = ['FIPS', 'state_FIPS', 'geometry']
+        state_FIPS = 'state_FIPS'
+    geodata = fix_FIPS(geodata, 'FIPS', state_FIPS)
+    geodata = (geodata[geodata['FIPS'].str.startswith(tuple(states))])
+    geodata = geodata[['FIPS', 'geometry']].dropna()
+    return geodata
+
+
 def make_choropleth(data_csv, shpfile, two_digit_state_FIPS,
                     title='', footnote='', cat_name=None,
                     geoFIPS_col=None, geometry_col=None,
-                    legx=.07, legy=0.18):
+                    legx=.07, legy=0.18, geostate_col=None, bins=None,
+                    num_cats=4, precision=1, county_colors=None, size=None,
+                    out_path='', formats=None, cache=None, profile=None,
+                    insets=None):
     '''Args:
-        data_csv(str): normed path name to csv file containing data.
+        data_csv(str or pandas.DataFrame): normed path name to csv file
+            containing data, or the data already read. A Parquet or Feather
+            file with 5-digit FIPS codes and the same columns can be given
+            instead of a csv.
             1)Extension is ".csf"
             2)No lading rows or columns
             3)No footnotes, annotations, or comments
@@ -194,8 +518,12 @@ def make_choropleth(data_csv, shpfile, two_digit_state_FIPS,
               "category" for the population that fulfills the category
               requirment, "total" or None, any additonal columns]
             5)The data set should have at least one cateogry column or total column
-        shpfile(str): normed path name to shapefile
-        two_digit_state_FIPS(str or int): two digit state FIPS code,
+        shpfile(str or geopandas.GeoDataFrame or StateIndex): normed path
+            name to shapefile or GeoParquet or Feather file, the shapefile
+            already read, or an index of a national shapefile to read just
+            the state from
+        two_digit_state_FIPS(str or int or list): two digit state FIPS code,
+            or a list of them for a map of several states
         title(str): title for map
         footnote(str): footnote to put under the legend
         geoFIPS_col(str): name of the FIPS column in the GeoDataFrame,
@@ -203,25 +531,31 @@ def make_choropleth(data_csv, shpfile, two_digit_state_FIPS,
         geometry_col(str) : name of the geometry_col, default is "geometry",
         legx(float): axis position for x of legend bounding box point
         legy(float): axis position for y of legend bounding box point
+        geostate_col(str): name of the state FIPS column in the GeoDataFrame
+        bins, num_cats, precision: passed on to AreaPopDataset
+        county_colors, size: passed on to ChoroplethStyle
+        out_path(str): directory to save the map in
+        formats(str or list[str]): output formats, see Choropleth.save_plot
+        cache(RenderCache object): cache of already rendered maps
+        profile(str): 'deterministic' or 'sampling' to profile everything
+            from reading the data to saving the map, see MapProfile. The
+            profile is named after cat_name and written to out_path.
+        insets(InsetLayout object): where to draw each group of states,
+            e.g. US_INSETS, see Choropleth
+    Returns:
+        the result of Choropleth.plot
          '''
-    two_digit_state_FIPS = str(two_digit_state_FIPS).zfill(2)
-    data_csv = os.path.normpath(data_csv)
-    shpfile = os.path.normpath(shpfile)
-    data = pd.read_csv(data_csv)
-    data = fix_FIPS(data, 'FIPS', two_digit_state_FIPS)
-    data = data.dropna()
-
-    geodata = gpd.GeoDataFrame.from_file(shpfile)
-    if geometry_col is None:
-        geometry_col = 'geometry'
-    # TODO find what contains countyfp
-    if geoFIPS_col is None:
-        geoFIPS_col = 'COUNTYFP'
-    geodata = geodata[[geoFIPS_col, geometry_col]]
-    geodata.columns = ['FIPS', 'geometry']
-    geodata = fix_FIPS(geodata, 'FIPS', two_digit_state_FIPS)
-    geodata = (geodata[geodata['FIPS'].str.startswith(two_digit_state_FIPS)])
-    geodata=geodata.dropna()
+    if profile is not None:
+        with MapProfile(cat_name, profile, out_path):
+            return make_choropleth(
+                data_csv, shpfile, two_digit_state_FIPS, title, footnote,
+                cat_name, geoFIPS_col, geometry_col, legx, legy, geostate_col,
+                bins, num_cats, precision, county_colors, size, out_path,
+                formats, cache, insets=insets)
+    data = load_data(data_csv, two_digit_state_FIPS,
+                     ['FIPS', 'category', 'total'])
+    geodata = load_geodata(shpfile, two_digit_state_FIPS, geoFIPS_col,
+                           geometry_col, geostate_col)
 
     cat_col = None
     total_col = None
@@ -231,11 +565,13 @@ def make_choropleth(data_csv, shpfile, two_digit_state_FIPS,
         total_col = 'total'
 
     apd = AreaPopDataset(data, geodata, 'FIPS', 'FIPS', cat_col,
-                         total_col, footnote, cat_name, title,
+                         total_col, footnote, cat_name, title, bins=bins,
+                         num_cats=num_cats, precision=precision,
                          percent_format=True)
-    ch_style = ChoroplethStyle(legx=legx, legy=legy)
-    chor = Choropleth(apd, ch_style)
-    chor.plot()
+    ch_style = ChoroplethStyle(county_colors, size=size, legx=legx, legy=legy)
+    chor = Choropleth(apd, ch_style, out_path=out_path, cache=cache,
+                      insets=insets)
+    return chor.plot(formats=formats)
 
 
 # TODO make category for NANs
@@ -420,21 +756,109 @@ class AreaPopDataset_old(object):
                              right_on=self.FIPS_col)
 
 
-# TODO make category for NANs
+class Classification(object):
+    def __init__(self, codes, bins, precision=1, percent_format=False,
+                 labeled_cutoffs=None, exceptions=None):
+        '''The result of binning a map's values: one small group code per
+        shape plus a lookup table of bins, labels and colors by group.
+        Labels are only formatted when asked for, and the object pickles to
+        little more than the code array.
+        Attributes:
+            codes(numpy.ndarray[int8]): group number of each shape starting
+                at 1, 0 where there is no data. Exception groups are
+                numbered after the binned ones.
+            bins(list[float]): cutoffs of the groups
+            precision(int): precision for bin cutoffs
+            percent_format(bool): indicates whether cutoffs are percentages
+            labeled_cutoffs(dict{category_number(int, 0-indexed),
+                special label(str)}): specified labels for the categories.
+            exceptions(list[list[label(str), color]]): groups for shapes
+                left out of the binning, e.g. suppressed data. color is None
+                for the style's default.
+            '''
+        self.codes = np.asarray(codes, dtype=np.int8)
+        self.bins = bins
+        self.precision = precision
+        self.percent_format = percent_format
+        self.labeled_cutoffs = labeled_cutoffs
+        self.exceptions = [] if exceptions is None else exceptions
+        self._labels = None
+
+    @classmethod
+    def from_values(cls, values, bins=None, num_cats=4, precision=1,
+                    percent_format=False, labeled_cutoffs=None):
+        '''Bins values, see bin_values'''
+        groups, bins = bin_values(values, bins, num_cats, precision)
+        codes = (np.asarray(groups.codes) + 1).astype(np.int8)
+        return cls(codes, bins, precision, percent_format, labeled_cutoffs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_labels'] = None
+        return state
+
+    @property
+    def num_cats(self):
+        return len(self.bins)-1
+
+    @property
+    def num_groups(self):
+        '''Number of binned and exception groups'''
+        return self.num_cats + len(self.exceptions)
+
+    @property
+    def labels(self):
+        '''Legend label of each group, formatted on first use'''
+        if self._labels is None:
+            self._labels = bin_labels(self.bins, self.precision,
+                                      self.percent_format,
+                                      self.labeled_cutoffs)
+            self._labels += [e[0] for e in self.exceptions]
+        return self._labels
+
+    def color_table(self, rgbs, missing_color=(0.0, 0.0, 0.0, 0.0)):
+        '''Lookup table of colors by group code
+        Args:
+            rgbs(list[tuple]): one rgba color per group, exception groups
+                included
+            missing_color(tuple): rgba color for code 0
+        Returns:
+            table(numpy.ndarray): (num_groups + 1) x 4 array'''
+        return np.vstack([np.asarray(missing_color, dtype=float),
+                          np.asarray(rgbs, dtype=float)[:self.num_groups]])
+
+    def colors(self, rgbs, missing_color=(0.0, 0.0, 0.0, 0.0)):
+        '''The rgba color of each shape, looked up from its group code'''
+        return self.color_table(rgbs, missing_color)[self.codes]
+
+    def categorical(self, labels=False):
+        '''The groups as a pandas Categorical of group numbers, or of
+        labels, missing where there is no data'''
+        groups = pd.Categorical.from_codes(
+            self.codes.astype(int) - 1,
+            categories=range(1, self.num_groups+1))
+        if labels:
+            return groups.rename_categories(self.labels)
+        return groups
+
+
 class AreaPopDataset(object):
     def __init__(self, data, geodata, FIPS_col, geoFIPS_col, cat_col=None,
                  total_col=None, footnote='', cat_name=None, title='',
                  bins=None, num_cats=4, precision=1,
                  labeled_cutoffs=None, percent_format=False,
-                 exceptions={'nan': ['Insufficient data'],
-                             'S': ['Data supressed']}):
+                 exceptions=None, partitioned=False, n_jobs=None,
+                 smoothing=None, moe_cols=None, max_cv=.3):
         '''An object that holds data elements for the choropleth map.
         Attributes:
-            data(pandas.DataFrame): dataframe with population data by county
-                and Texas county codes or FIPS codes
-            geodata(geopandas.Dataframe or str): Dataframe with shapefile
-                information or the name of county shapefile with the
-                extension '.shp'
+            data(pandas.DataFrame or str): dataframe with population data by
+                county and Texas county codes or FIPS codes, or a Parquet or
+                Feather file of it; only the columns used are read
+            geodata(geopandas.Dataframe or str or GeometryStore): Dataframe
+                with shapefile information, the name of county shapefile
+                with the extension '.shp' or of a GeoParquet or Feather
+                file, or the GeometryStore of either.
+                Datasets made from the same geodata share its shapes.
             FIPS_col(str): name of the pandas df column with complete
                 FIPS codes
             geoFIPS_col(str): name of the geodf column with complete
@@ -459,14 +883,45 @@ class AreaPopDataset(object):
                 special label(str)}): specified labels for the categories.
             percent_format(bool): indicates whether cutoffs are percentages
             exceptions(dict): indicates string value for supression, nulls,
-                etc. in keys category label in valuelist[0].
+                etc. in keys category label in valuelist[0], and optionally
+                its color in valuelist[1]. The key 'nan' stands for values
+                that are missing or can't be calculated. Shapes with an
+                exception are not binned but get a group of their own.
+                Default is {'nan': ['Insufficient data'],
+                'S': ['Data supressed']}.
+            partitioned(bool): process the data state by state in parallel,
+                for nationwide maps of small areas. data can then also be a
+                dict of state FIPS codes to each state's table or csv file;
+                a whole Parquet file is read by each worker for its state.
+                Quantile bins are found from sketches of each state's values
+                and can differ very slightly from the ones of pandas.qcut.
+            n_jobs(int): worker processes for partitioned, default is the
+                number of CPUs
+            smoothing(str): 'eb', 'spatial' or 'spatial_eb' to stabilize
+                the ratios of small populations before binning, see
+                smoothing.py. Needs cat_col and total_col.
+            moe_cols(list[str]): ACS margin of error columns for cat_col and
+                total_col (None for a total without one). Estimates whose
+                coefficient of variation is over max_cv get the exception
+                'cv', labeled 'Unreliable estimate' unless exceptions has
+                it. Not available with partitioned.
+            max_cv(float): the largest coefficient of variation mapped
+            cv(numpy.ndarray[float32]): coefficient of variation of each
+                shape's estimate, only with moe_cols
+            geometry(GeometryStore): the shared county shapes
+            values(numpy.ndarray[float32]): the mapped value of each shape,
+                NaN where there is no data
+            groups(numpy.ndarray[int8]): group number of each shape, 0 where
+                there is no data
+            data(geopandas.GeoDataFrame): all of the above as a frame, put
+                together on access
+            exception_masks(dict{str: numpy.ndarray[bool]}): shapes whose
+                data holds each exception value
+            true_exceptions(list[str]): the exceptions found in the data, in
+                the order of their groups
                 '''
-        self.data = data
         # Reads in a geodtaframe or a filename and converts it
-        if isinstance(geodata, gpd.GeoDataFrame):
-            self.geodata = geodata
-        else:
-            self.geodata = gpd.GeoDataFrame.from_file(geodata)
+        self.geometry = GeometryStore.get(geodata, geoFIPS_col)
 
         self.FIPS_col = FIPS_col
         self.geoFIPS_col = geoFIPS_col
@@ -474,20 +929,22 @@ class AreaPopDataset(object):
         self.total_col = total_col
         self.footnote = footnote
         self.title = title
-        self.bins = bins
-        self.num_cats = num_cats
         self.prec = precision
         self.punit = 10 ** (-1*self.prec)
         self.labels_col = 'labels'  # column for int
         self.labeled_cutoffs = labeled_cutoffs
         self.percent_format = percent_format
         self.grouped_col = 'group'
+        if exceptions is None:
+            exceptions = {'nan': ['Insufficient data'],
+                          'S': ['Data supressed']}
+        if moe_cols is not None and 'cv' not in exceptions:
+            exceptions = dict(exceptions, cv=['Unreliable estimate'])
         self.exceptions = exceptions
-
-        # These guys will be used to map the colors and labels
-        self.group_nums = []
-        self.group_names = []
-        self.colordict = {}
+        if partitioned and moe_cols is not None:
+            raise ValueError('moe_cols can not be used with partitioned.')
+        self.true_exceptions = []
+        self.exception_masks = {}
 
         # Set defaults for cat_name
         if cat_name is None:
@@ -499,136 +956,583 @@ class AreaPopDataset(object):
         self.valid_cols = [
             x for x in [
                 self.FIPS_col, self.cat_col, self.total_col] if x is not None]
-        self.data = self.data.loc[:, self.valid_cols]
-        self._merge_geodataframe()
-        # this cycles through the valid columns to make float format
-        self._totals_to_float()
+        quantiles = None
+        if partitioned:
+            # The same steps, one state per worker; see partitioned.py
+            sketches = ingest_partitioned(self, data, n_jobs)
+        else:
+            if is_columnar(data):
+                data = read_table(data, self.valid_cols + [
+                    c for c in (moe_cols or []) if c is not None])
+            self._merge_geodataframe(data)
+            # Suppression codes etc. are found before the counts become floats
+            self._find_exceptions()
+            # this cycles through the valid columns to make float format
+            self._totals_to_float()
+            if moe_cols is not None:
+                self._find_unreliable(data, moe_cols, max_cv)
 
         # Find which columns are being used and if needed, calculate the ratio
         self._calculate_cat()
-        self.true_exceptions = []
-        for key in self.exceptions:
-            if any(self.data[self.calculated_cat]) == key:
-                self.true_exceptions.append(key)
-                self.exceptions[key].append(self.data[
-                    self.data[self.calculated_cat] == key])
-                self.data = self.data[self.data[self.calculated_cat] != key]
-
-        # TODO takeout supressd data
-
+        if smoothing is not None:
+            self._smooth(smoothing)
         self._format_calculated_cat()
-        self._make_binned_cats()
+        self._find_missing()
+        # Sketches hold the raw values, so smoothed ones are binned here
+        if partitioned and bins is None and smoothing is None:
+            quantiles = merge_sketches(
+                sketches, num_cats,
+                lambda v: (v * self._scale).round(self.prec))
+        self._make_binned_cats(bins, num_cats, quantiles)
+
+        # Only compact copies are kept
+        self.values = self.values.astype(np.float32)
+        self.counts = self.counts.astype(np.float32)
+
+    def _merge_geodataframe(self, data):
+        '''Lines the population data up with the shapes. Nothing is merged
+        into the geometry, the rows are only matched by FIPS code.'''
+        self.rows = self.geometry.align(data[self.FIPS_col])
+        self.matched = self.rows >= 0
+        self.raw = data.loc[:, self.valid_cols[1:]]
+
+    def _to_shapes(self, row_mask):
+        '''Turns a mask over the data rows into one over the shapes'''
+        mask = np.zeros(len(self.rows), dtype=bool)
+        mask[self.matched] = row_mask[self.rows[self.matched]]
+        return mask
+
+    def _find_exceptions(self):
+        '''Makes a mask of the shapes holding each exception value, with one
+        comparison per column and key. Only text columns can hold them.'''
+        text = [self.raw[c].astype(str).str.strip()
+                for c in self.valid_cols[1:]
+                if not pd.api.types.is_numeric_dtype(self.raw[c])]
+        for key in self.exceptions:
+            if key in ('nan', 'cv') or not text:
+                continue
+            hit = np.zeros(len(self.raw), dtype=bool)
+            for col in text:
+                hit |= (col == key).to_numpy(dtype=bool, na_value=False)
+            if hit.any():
+                self.exception_masks[key] = self._to_shapes(hit)
+
+    def _find_unreliable(self, data, moe_cols, max_cv):
+        '''Shapes whose estimate has a coefficient of variation over max_cv,
+        among those with margins of error, fall under the 'cv' exception'''
+        moe_cols = list(moe_cols)
+        cols = [c for c in moe_cols if c is not None]
+        moe = np.full((len(self.rows), len(cols)), np.nan)
+        moe[self.matched] = _to_float_array(data, cols)[
+            self.rows[self.matched]]
+        moe = dict(zip(cols, moe.T))
+        estimate = self.counts[:, 0]
+        if self.cat_col is not None and self.total_col is not None:
+            total_moe = moe.get(moe_cols[1]) if len(moe_cols) > 1 else None
+            cv = ratio_cv(estimate, moe[moe_cols[0]], self.counts[:, 1],
+                          total_moe)
+        else:
+            cv = ratio_cv(estimate, moe[moe_cols[0]])
+        self.cv = cv.astype(np.float32)
+        has_moe = np.isfinite(moe[moe_cols[0]]) & np.isfinite(estimate)
+        unreliable = has_moe & ~(cv <= max_cv)
+        for mask in self.exception_masks.values():
+            unreliable &= ~mask
+        if unreliable.any():
+            self.exception_masks['cv'] = unreliable
+
+    def _smooth(self, method):
+        '''Replaces the ratios with stabilized ones, pooling only shapes
+        whose counts can be used'''
+        if self.cat_col is None or self.total_col is None:
+            raise ValueError('Smoothing needs a category and a total column.')
+        usable = self.matched & np.isfinite(self.values) & \
+            (self.counts[:, 1] > 0)
+        for key, mask in self.exception_masks.items():
+            if key != 'cv':  # unreliable estimates still add their counts
+                usable &= ~mask
+        events = np.where(usable, self.counts[:, 0], 0.0)
+        population = np.where(usable, self.counts[:, 1], 0.0)
+        smoothed = smooth_rates(events, population, method, self.geometry)
+        self.values = np.where(usable, smoothed, self.values)
+
+    def _find_missing(self):
+        '''Shapes with data that still have no usable value fall under the
+        'nan' exception'''
+        if 'nan' not in self.exceptions:
+            return
+        missing = self.matched & ~np.isfinite(self.values)
+        for mask in self.exception_masks.values():
+            missing &= ~mask
+        if missing.any():
+            self.exception_masks['nan'] = missing
 
-        # Map the cutoff labels to the groups
-        self._map_labels()
+    def _totals_to_float(self):
+        '''Makes sure population counts are float and not string
+        self.raw[c] could contain strings or floats
+        '''
+        counts = _to_float_array(self.raw, self.valid_cols[1:])
+        del self.raw
+        # One row per shape, NaN for shapes without data
+        self.counts = np.full((len(self.rows), counts.shape[1]), np.nan)
+        self.counts[self.matched] = counts[self.rows[self.matched]]
 
     def _calculate_cat(self):
         # Could have totals only
         if self.cat_col is None:
             self.calculated_cat = self.total_col
+            self.values = self.counts[:, 0].copy()
         # Or category only
         elif self.total_col is None:
             self.calculated_cat = self.cat_col
+            self.values = self.counts[:, 0].copy()
         # but if there's both it's a ratio
         else:
             self.calculated_cat = 'ratio'
-            self.data[self.calculated_cat] = np.nan
-            # How to do this more efficiently?
-            for idx, row in self.data.iterrows():
-                if self.data.ix[idx, self.cat_col] in list(
-                    self.exceptions.keys()):
-                    self.data.ix[idx, self.calculated_cat]  = self.data.ix[idx, self.cat_col]
-                elif row[self.total_col] in list(self.exceptions.keys()):
-                    self.data.ix[idx, self.calculated_cat]  = row[self.total_col]
-                else:
-                    self.data.ix[idx, self.calculated_cat] = float(
-                        self.data.ix[idx, self.cat_col]) / float(
-                        self.data.ix[idx, self.total_col])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.values = self.counts[:, 0] / self.counts[:, 1]
 
     def _format_calculated_cat(self):
         # Reformat percentages
-        if self.percent_format and (self.data[self.calculated_cat] < 1).all():
-            self.data[self.calculated_cat] = self.data[
-                self.calculated_cat]*100.0
+        present = np.isfinite(self.values)
+        self._scale = 1.0
+        if self.percent_format and (self.values[present] < 1).all():
+            self._scale = 100.0
+            self.values = self.values*self._scale
         # Round
-        self.data[self.calculated_cat] = self.data[
-            self.calculated_cat].round(self.prec)
-
-    def _make_binned_cats(self):
-        '''Makes the group column. The group column names categories according
-        to the cutoff bins. Then maps the group to a column called, color,
-        which codes the groups with integers
+        self.values = self.values.round(self.prec)
+
+    def _make_binned_cats(self, bins, num_cats, quantiles=None):
+        '''Makes the classification. The groups number categories according
+        to the cutoff bins, starting at 1; 0 means no data. Shapes with an
+        exception are left out of the binning and numbered after the bins,
+        in the order of self.exceptions. Labels are made from the cutoffs
+        when they are first needed.
         '''
-        # take the supressed data out
+        self.true_exceptions = [k for k in self.exceptions
+                                if k in self.exception_masks]
+        excluded = np.zeros(len(self.values), dtype=bool)
+        for key in self.true_exceptions:
+            excluded |= self.exception_masks[key]
+        groups, bins = bin_values(np.where(excluded, np.nan, self.values),
+                                  bins, num_cats, self.prec, quantiles)
+        codes = (np.asarray(groups.codes) + 1).astype(np.int8)
+        # The first exception listed wins where several apply
+        for k in range(len(self.true_exceptions)-1, -1, -1):
+            codes[self.exception_masks[self.true_exceptions[k]]] = len(bins)+k
+        exceptions = [[self.exceptions[k][0],
+                       self.exceptions[k][1]
+                       if len(self.exceptions[k]) > 1 else None]
+                      for k in self.true_exceptions]
+        self.classification = Classification(
+            codes, bins, self.prec, self.percent_format,
+            self.labeled_cutoffs, exceptions)
+
+    @property
+    def bins(self):
+        return self.classification.bins
+
+    @property
+    def num_cats(self):
+        return self.classification.num_cats
+
+    @property
+    def group_nums(self):
+        return range(1, self.num_cats+1)
+
+    @property
+    def groups(self):
+        return self.classification.codes
+
+    @property
+    def group_names(self):
+        return self.classification.labels
+
+    @property
+    def geodata(self):
+        '''The shapes with their FIPS codes'''
+        return self.geometry.to_geodataframe()
+
+    @property
+    def adjacency(self):
+        '''Which shapes touch, see GeometryStore.adjacency. It is found once
+        per geometry and shared by every dataset on it.'''
+        return self.geometry.adjacency()
+
+    @property
+    def data(self):
+        '''The data, groups and labels with the shapes attached'''
+        columns = {self.geoFIPS_col: self.geometry.FIPS}
+        if self.FIPS_col != self.geoFIPS_col:
+            columns[self.FIPS_col] = np.where(
+                self.matched, self.geometry.FIPS, None)
+        for j, c in enumerate(self.valid_cols[1:]):
+            columns[c] = self.counts[:, j]
+        columns[self.calculated_cat] = self.values
+        columns[self.grouped_col] = self.classification.categorical()
+        columns[self.labels_col] = self.classification.categorical(True)
+        return self.geometry.to_geodataframe(columns)
+
+    def geometry_fingerprint(self):
+        '''Hash of the map geometry, computed once'''
+        return self.geometry.fingerprint()
+
+    def save_table(self, path, row_group_size=50000):
+        '''Writes the data, groups and labels with the shapes (see data) to
+        a GeoParquet or Feather file, sorted by FIPS code so states can be
+        read back alone, see read_geodata
+        Args:
+            path(str): file to write, ending in .parquet or .feather
+            row_group_size(int): rows per Parquet row group
+        Returns:
+            path(str)'''
+        return write_table(self.data, path, self.geoFIPS_col, row_group_size)
 
-        if self.bins is None:
-            self.group_nums = range(1, self.num_cats+1)
-            # qcut divides data into equal groups
-            self.data[self.grouped_col], self.bins = pd.qcut(
-                self.data[self.calculated_cat],
-                self.num_cats,
-                labels=self.group_nums,
-                retbins=True,
-                precision=self.prec)
+    def save_classification(self, path):
+        '''Writes the classified data to a compact binary file, see
+        from_classification. The shapes themselves are not saved.
+        Args:
+            path(str): file to write'''
+        cl = self.classification
+        arrays = [('FIPS', self.geometry.FIPS.astype(str).astype(np.bytes_)),
+                  ('matched', self.matched),
+                  ('codes', cl.codes),
+                  ('values', self.values),
+                  ('counts', self.counts)]
+        for key, mask in sorted(self.exception_masks.items()):
+            arrays.append(('mask:' + key, mask))
+        labeled_cutoffs = cl.labeled_cutoffs
+        if labeled_cutoffs is not None:
+            labeled_cutoffs = sorted(labeled_cutoffs.items())
+        meta = {'FIPS_col': self.FIPS_col,
+                'geoFIPS_col': self.geoFIPS_col,
+                'cat_col': self.cat_col,
+                'total_col': self.total_col,
+                'calculated_cat': self.calculated_cat,
+                'valid_cols': self.valid_cols,
+                'cat_name': self.cat_name,
+                'title': self.title,
+                'footnote': self.footnote,
+                'precision': self.prec,
+                'percent_format': self.percent_format,
+                'exceptions': self.exceptions,
+                'true_exceptions': self.true_exceptions,
+                'exception_groups': cl.exceptions,
+                'bins': [float(b) for b in cl.bins],
+                'labels': cl.labels,
+                'labeled_cutoffs': labeled_cutoffs}
+        write_arrays(path, arrays, meta)
+
+    @classmethod
+    def from_classification(cls, path, geodata, mmap=True):
+        '''Loads a dataset written by save_classification without merging,
+        calculating or binning anything again. The arrays are memory-mapped
+        from the file, so many processes can share one copy.
+        Args:
+            path(str): file written by save_classification
+            geodata(geopandas.Dataframe or str or GeometryStore): the
+                county shapes, see AreaPopDataset. If their order differs
+                from the saved one the data are lined up again, in memory.
+            mmap(bool): map the arrays instead of reading them
+        Returns:
+            AreaPopDataset'''
+        arrays, meta = read_arrays(path, mmap)
+        self = cls.__new__(cls)
+        self.geometry = GeometryStore.get(geodata, meta['geoFIPS_col'])
+        for key in ['FIPS_col', 'geoFIPS_col', 'cat_col', 'total_col',
+                    'calculated_cat', 'valid_cols', 'cat_name', 'title',
+                    'footnote', 'percent_format', 'exceptions']:
+            setattr(self, key, meta[key])
+        self.prec = meta['precision']
+        self.punit = 10 ** (-1*self.prec)
+        self.labels_col = 'labels'
+        self.grouped_col = 'group'
+        self.true_exceptions = meta['true_exceptions']
+        labeled_cutoffs = meta['labeled_cutoffs']
+        if labeled_cutoffs is not None:
+            labeled_cutoffs = dict((int(k), v) for k, v in labeled_cutoffs)
+        self.labeled_cutoffs = labeled_cutoffs
+
+        FIPS = arrays.pop('FIPS').astype(str)
+        if not np.array_equal(FIPS, self.geometry.FIPS.astype(str)):
+            rows = self.geometry.align(FIPS)
+            missing = rows < 0
+            for name, a in list(arrays.items()):
+                fill = np.nan if a.dtype.kind == 'f' else 0
+                arrays[name] = np.where(
+                    missing.reshape((-1,) + (1,) * (a.ndim - 1)),
+                    np.array(fill, dtype=a.dtype), a[rows])
+        self.matched = arrays.pop('matched')
+        self.values = arrays.pop('values')
+        self.counts = arrays.pop('counts')
+        self.classification = Classification(
+            arrays.pop('codes'), meta['bins'], self.prec,
+            self.percent_format, labeled_cutoffs, meta['exception_groups'])
+        self.classification._labels = meta['labels']
+        self.exception_masks = dict((name[len('mask:'):], a)
+                                    for name, a in arrays.items())
+        return self
+
+
+class MultiIndicatorDataset(object):
+    def __init__(self, data, geodata, FIPS_col, geoFIPS_col, cat_cols,
+                 total_col=None, footnote='', cat_names=None, titles=None,
+                 bins=None, num_cats=4, precision=1, labeled_cutoffs=None,
+                 percent_format=False):
+        '''Holds many indicators from one wide table, e.g. an ACS data
+        profile, for the same counties. The table is aligned to the geometry
+        once, the ratios for every indicator are computed in one array
+        operation, and each indicator is binned on its own. indicator()
+        returns views that Choropleth can draw like an AreaPopDataset.
+        Attributes:
+            data(pandas.DataFrame): wide table with one row per county
+            geodata(geopandas.Dataframe or str or GeometryStore): the
+                county shapes, see AreaPopDataset
+            FIPS_col(str): name of the pandas df column with complete
+                FIPS codes
+            geoFIPS_col(str): name of the geodf column with complete
+                FIPS codes
+            cat_cols(list[str]): names of the indicator columns
+            total_col(str or list[str]): name of the column with the total
+                populations, or one total column per indicator. None maps
+                the indicator values themselves.
+            footnote(str): Provenance info to add to the final maps
+            cat_names(list[str]): names for the indicators, default is
+                cat_cols
+            titles(list[str]): titles for the maps, default is cat_names
+            bins(list[float] or dict{cat_col: list[float]}): cutoffs used
+                for every indicator, or per indicator. Indicators without
+                bins are split into num_cats equal groups.
+            num_cats(int): how many categories to have for each map
+            precision(int): precision for bin cutoffs
+            labeled_cutoffs(dict{category_number(int, 0-indexed),
+                special label(str)}): specified labels for the categories.
+            percent_format(bool): indicates whether cutoffs are percentages
+            values(numpy.ndarray[float32]): counties x indicators array of
+                the values that are binned
+            groups(numpy.ndarray[int8]): counties x indicators array of
+                group numbers, 0 where a value is missing
+            geometry(GeometryStore): the shared county shapes
+                '''
+        # Reads in a geodtaframe or a filename and converts it
+        self.geometry = GeometryStore.get(geodata, geoFIPS_col)
+        self.cat_cols = list(cat_cols)
+        self.footnote = footnote
+        self.prec = precision
+        self.percent_format = percent_format
+        self.labeled_cutoffs = labeled_cutoffs
+        if cat_names is None:
+            cat_names = self.cat_cols
+        self.cat_names = list(cat_names)
+        if titles is None:
+            titles = self.cat_names
+        self.titles = list(titles)
+
+        # Line the table up with the geometry instead of merging it in
+        rows = self.geometry.align(data[FIPS_col])
+
+        cats = _to_float_array(data, self.cat_cols)
+        if total_col is None:
+            values = cats
         else:
-            self.bins = np.asarray(self.bins).round(self.prec)
-            # The lower bound is zero here
-            if self.bins[0] != 0:
-                self.bins = [0] + self.bins
-            # punit is added to include values that have been roudnded up
-            self.bins[-1] += self.punit
-            # for too many bins get rid of overlaps
-            self.bins = np.unique(self.bins).tolist()
-            self.num_cats = len(self.bins)-1
-            self.group_nums = range(1, self.num_cats+1)
-            self.data[self.grouped_col] = pd.cut(
-                self.data[self.calculated_cat],
-                self.bins,
-                labels=self.group_nums,
-                retbins=False,
-                include_lowest=True)
+            if isinstance(total_col, string_types):
+                total_col = [total_col]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = cats / _to_float_array(data, total_col)
+        values = np.where(rows[:, None] >= 0, values[rows], np.nan)
 
-    def _map_labels(self):
-        '''Takes the cutoffs and creates labels)
-        '''
-        sign = ''
-        bottom = '0'
-        bottom_format = '{:1.%sf}' % str(self.prec)
-        if self.percent_format:
-            sign = '%'
-        for i, c in enumerate(self.bins[1:]):
-            cutoff = bottom_format.format(c)
-            if i == 0:
-                self.group_names.append(cutoff + sign + ' or less')
-            elif i == len(self.bins)-2:
-                self.group_names.append(bottom + sign + ' or more')
-            else:
-                self.group_names.append(
-                    bottom + '%' + '-' + cutoff + sign)
+        # Reformat percentages
+        if percent_format:
+            fractions = np.all((values < 1) | np.isnan(values), axis=0)
+            values[:, fractions] *= 100.0
+        values = values.round(precision)
+
+        # The groups of every indicator share one array
+        self.groups = np.zeros(values.shape, dtype=np.int8)
+        self.classifications = []
+        for j, c in enumerate(self.cat_cols):
+            col_bins = bins.get(c) if isinstance(bins, dict) else bins
+            classification = Classification.from_values(
+                values[:, j], col_bins, num_cats, precision, percent_format,
+                labeled_cutoffs)
+            self.groups[:, j] = classification.codes
+            classification.codes = self.groups[:, j]
+            self.classifications.append(classification)
+        self.values = values.astype(np.float32)
+
+    def __len__(self):
+        return len(self.cat_cols)
+
+    def indicator(self, key):
+        '''Returns an IndicatorView for a cat_col name or position'''
+        if isinstance(key, string_types):
+            key = self.cat_cols.index(key)
+        return IndicatorView(self, key)
+
+    def indicators(self):
+        '''Iterates over views of every indicator'''
+        for j in range(len(self.cat_cols)):
+            yield IndicatorView(self, j)
+
+    def geometry_fingerprint(self):
+        '''Hash of the map geometry, computed once'''
+        return self.geometry.fingerprint()
+
+    @property
+    def adjacency(self):
+        '''Which shapes touch, see GeometryStore.adjacency'''
+        return self.geometry.adjacency()
+
+
+class IndicatorView(object):
+    def __init__(self, dataset, position):
+        '''One indicator of a MultiIndicatorDataset, with the attributes
+        Choropleth reads from an AreaPopDataset. The GeoDataFrame in data is
+        put together on access and shares the dataset's geometry.
+        Attributes:
+            dataset(MultiIndicatorDataset)
+            position(int): column of the indicator in the dataset
+            '''
+        self.dataset = dataset
+        self.position = position
+        self.cat_col = dataset.cat_cols[position]
+        self.cat_name = dataset.cat_names[position]
+        self.title = dataset.titles[position]
+        self.footnote = dataset.footnote
+        self.classification = dataset.classifications[position]
+        self.bins = self.classification.bins
+        self.num_cats = self.classification.num_cats
+        self.calculated_cat = 'value'
+        self.grouped_col = 'group'
+        self.labels_col = 'labels'
+
+    @property
+    def values(self):
+        return self.dataset.values[:, self.position]
+
+    @property
+    def groups(self):
+        return self.classification.codes
+
+    @property
+    def group_names(self):
+        return self.classification.labels
+
+    @property
+    def data(self):
+        geometry = self.dataset.geometry
+        return geometry.to_geodataframe(
+            {geometry.geoFIPS_col: geometry.FIPS,
+             self.calculated_cat: self.values,
+             self.grouped_col: self.classification.categorical(),
+             self.labels_col: self.classification.categorical(True)})
+
+    @property
+    def geometry(self):
+        return self.dataset.geometry
+
+    def geometry_fingerprint(self):
+        return self.dataset.geometry_fingerprint()
+
+
+class BivariateClassification(Classification):
+    def __init__(self, x, y, exception_label='Insufficient data'):
+        '''Two Classifications of the same shapes crossed into one group for
+        each pair of their bins, numbered with x outermost: group
+        (i - 1) * y.num_cats + j for bin i of x and bin j of y. Shapes with
+        data that miss a bin in either, e.g. suppressed in one of them, share
+        one exception group.
+        Attributes:
+            x, y(Classification): the classifications crossed
+            exception_label(str): legend label of the exception group
+            '''
+        self.x = x
+        self.y = y
+        nx, ny = x.num_cats, y.num_cats
+        x_codes = x.codes.astype(int)
+        y_codes = y.codes.astype(int)
+        binned = ((x_codes > 0) & (x_codes <= nx) &
+                  (y_codes > 0) & (y_codes <= ny))
+        codes = np.where(binned, (x_codes - 1) * ny + y_codes, 0)
+        partial = ((x_codes > 0) | (y_codes > 0)) & ~binned
+        exceptions = []
+        if partial.any():
+            codes[partial] = nx * ny + 1
+            exceptions = [[exception_label, None]]
+        Classification.__init__(self, codes, list(x.bins) + list(y.bins),
+                                exceptions=exceptions)
+
+    @property
+    def num_cats(self):
+        return self.x.num_cats * self.y.num_cats
+
+    @property
+    def labels(self):
+        '''Legend label of each group, the bins of x and y side by side'''
+        if self._labels is None:
+            self._labels = [
+                '%s, %s' % (xl, yl)
+                for xl in self.x.labels[:self.x.num_cats]
+                for yl in self.y.labels[:self.y.num_cats]]
+            self._labels += [e[0] for e in self.exceptions]
+        return self._labels
+
+
+class BivariateDataset(object):
+    def __init__(self, x, y, title='', cat_name=None, footnote=None,
+                 exception_label='Insufficient data'):
+        '''Two datasets on the same geometry, e.g. a rate and a count,
+        mapped together with a bivariate ChoroplethStyle. Choropleth draws
+        it like an AreaPopDataset.
+        Attributes:
+            x, y(AreaPopDataset or IndicatorView): the two variables. They
+                need the same number of categories, e.g. 3 for a 3 x 3
+                palette.
+            title(str): title for the map
+            cat_name(str): name of the map, default joins the names of x
+                and y
+            footnote(str): default is the footnote of x
+            exception_label(str): see BivariateClassification
+            classification(BivariateClassification)
+            '''
+        if x.geometry_fingerprint() != y.geometry_fingerprint():
+            raise ValueError('Both variables must use the same geometry.')
+        if x.num_cats != y.num_cats:
+            raise ValueError('Both variables need the same number of ' +
+                             'categories.')
+        self.x = x
+        self.y = y
+        self.geometry = x.geometry
+        self.title = title
+        if cat_name is None:
+            cat_name = '%s_%s' % (x.cat_name, y.cat_name)
+        self.cat_name = cat_name
+        if footnote is None:
+            footnote = x.footnote
+        self.footnote = footnote
+        self.classification = BivariateClassification(
+            x.classification, y.classification, exception_label)
+        self.bins = self.classification.bins
+        self.num_cats = self.classification.num_cats
 
-            if self.labeled_cutoffs is not None:
-                if i in self.labeled_cutoffs.keys():
-                    self.group_names[i] = self.group_names[
-                        i] + ' ' + self.labeled_cutoffs[i]
-            bottom = bottom_format.format(c + self.punit)
+    @property
+    def groups(self):
+        return self.classification.codes
 
-        self.data[self.labels_col] = self.data[
-            self.grouped_col].cat.rename_categories(self.group_names)
+    @property
+    def group_names(self):
+        return self.classification.labels
 
-    def _totals_to_float(self):
-        '''Makes sure population counts are float and not string
-        self.data[c] could contain strings or floats
-        '''
-        for c in self.valid_cols[1:]:
-            self.data[c] = self.data[c].apply(
-                lambda x: str(x).replace(',', '')).astype(float)
+    def geometry_fingerprint(self):
+        return self.x.geometry_fingerprint()
 
-    def _merge_geodataframe(self):
-        '''Merges the population data with the geodataframe'''
-        # merge population data with Texas GeoDataFrame
-        self.data = pd.merge(left=self.geodata, right=self.data, how='left',
-                             left_on=self.geoFIPS_col,
-                             right_on=self.FIPS_col)
+
+def _to_float_array(data, cols):
+    '''Converts columns that could hold strings like '1,234' to a float
+    array; anything that is not a number becomes NaN'''
+    return np.column_stack([
+        pd.to_numeric(data[c].astype(str).str.replace(',', ''),
+                      errors='coerce').to_numpy(dtype=float) for c in cols])
 
 
 class CityInfo(object):
@@ -719,11 +1623,12 @@ class ChoroplethStyle(object):
                  border_width=.6, size=None,
                  legend_loc='upper left', legx=-.01, legy=0.32,
                  ttl_align='left', ttlx=0, ttly=0.92,
-                 ttl_char_limit=55):
+                 ttl_char_limit=55, exception_colors=None, center=None):
         '''Holds style information for the choropleth plot
         Atributes:
             county_colors(str): colors name must match dict:
-                (e.g. blues, greens, purples, oranges, reds)
+                (e.g. blues, greens, purples, oranges, reds), or a diverging
+                (e.g. red_blues) or bivariate (e.g. pink_blues) scheme
             border_color(str): hex color for county borders and legend patch
                 borders
             border_width(float): linewidth of border
@@ -736,6 +1641,11 @@ class ChoroplethStyle(object):
             ttlx(float): position of title
             ttyl(float): positino of title
             ttl_char_limit(int): this when to check to break the line
+            exception_colors(list[str]): colors for exception groups, e.g.
+                suppressed data, that don't come with their own
+            center(float): value diverging schemes are white at, e.g. the
+                level given to get_custom_bins. Default is the middle cutoff.
+            scheme(str): 'sequential', 'diverging' or 'bivariate'
             '''
         # mMps a name onto the darkest color to use in the mapping
         self.cmap_dict = {'reds': 'darkred', 'orangereds': 'orangered',
@@ -744,20 +1654,41 @@ class ChoroplethStyle(object):
                           'blues': 'darkblue', 'violets': 'indigo',
                           'purples': 'darkviolet', 'texas_reds': '#B72639',
                           'texas_blues': '#2E2D71'}
+        # Maps a name onto the darkest colors below and above the center
+        self.diverging_dict = {'red_blues': ['darkred', 'darkblue'],
+                               'orange_purples': ['darkorange', 'indigo'],
+                               'brown_teals': ['saddlebrown', 'teal'],
+                               'texas': ['#B72639', '#2E2D71']}
+        # Maps a name onto the colors for low/low, high first variable,
+        # high second variable and high/high
+        self.bivariate_dict = {
+            'pink_blues': ['#e8e8e8', '#be64ac', '#5ac8c8', '#3b4994'],
+            'red_blues': ['#e8e8e8', '#c85a5a', '#64acbe', '#574249'],
+            'green_purples': ['#e8e8e8', '#73ae80', '#6c83b5', '#2a5a5b']}
         # Sets default
         if county_colors is None:
             county_colors = 'blues'
         # Color name must match a dict key
-        try:
-            last = self.cmap_dict[county_colors]
-        except:
+        if county_colors in self.cmap_dict:
+            self.scheme = 'sequential'
+            ramp = ['white', self.cmap_dict[county_colors]]
+        elif county_colors in self.diverging_dict:
+            self.scheme = 'diverging'
+            low, high = self.diverging_dict[county_colors]
+            ramp = [low, 'white', high]
+        elif county_colors in self.bivariate_dict:
+            self.scheme = 'bivariate'
+            ramp = self.bivariate_dict[county_colors][::3]
+        else:
             raise KeyError(
                 '"%s" is not a valid colormap name.' % county_colors)
+        self.center = center
 
-        # Creates a colormap from white to darkest color
-        self.cmap = LinearSegmentedColormap.from_list('my_cmap',
-                                                      ['white', last])
+        # Creates a colormap from white to darkest color, or from the
+        # darkest low color through white to the darkest high color
+        self.cmap = mcolors.LinearSegmentedColormap.from_list('my_cmap', ramp)
         self.cmap_name = county_colors + '_cmap'
+        self.county_colors = county_colors
 
         # Specify the size of the image output
         img_size_dict = {'small': 75, 'med': 100, 'large': 150}
@@ -784,32 +1715,91 @@ class ChoroplethStyle(object):
         self.ttly = ttly
         self.ttl_char_limit = ttl_char_limit
 
-    def get_colors(self, num_bins):
-        '''Creates sequential lists of rgba colors and a
-                LinearSegmentedColormap.
+        if exception_colors is None:
+            exception_colors = ['#d9d9d9', '#a6a6a6', '#737373']
+        self.exception_colors = exception_colors
+
+    def get_exception_colors(self, exceptions):
+        '''rgba colors for the exception groups of a Classification
+        Args:
+            exceptions(list[list[label(str), color]]): color None takes the
+                next of exception_colors
+        Returns:
+            rgbs(list[tuple[float]])'''
+        rgbs = []
+        for i, (label, color) in enumerate(exceptions):
+            if color is None:
+                color = self.exception_colors[i % len(self.exception_colors)]
+            rgbs.append(mcolors.to_rgba(color))
+        return rgbs
+
+    def get_colors(self, num_bins, bins=None):
+        '''Creates sequential lists of rgba colors.
         All sequential color lists range from white to a dark color.
         If there are less than 6 categories, the final color is madeighter.
+        Diverging colors darken away from the center on both sides; a bin
+        holding the center is white. Bivariate colors are a grid with the
+        first variable's groups outermost, see BivariateClassification.
         Args:
             num_bins(int): number of categories to map
+            bins(list[float]): cutoffs of the categories, which diverging
+                schemes compare to the center. Without them the center is
+                taken to be in the middle.
         Returns:
             rgbs(list[tuple[numpy.float]]]: list of rgba values
 
             '''
-        inds = np.linspace(0, 1, num_bins)
+        if self.scheme == 'diverging':
+            inds = self._diverging_positions(num_bins, bins)
+        elif self.scheme == 'bivariate':
+            return self._bivariate_colors(num_bins)
+        else:
+            inds = np.linspace(0, 1, num_bins)
         # if num_bins < 6:  # Colors shouldn't be so
         #     inds = inds[:num_bins-1]
-        rgbs = [self.cmap(i) for i in inds]
-
-        my_cmap = ListedColormap(
-            name=self.cmap_name, colors=rgbs)
-        matplotlib.cm.register_cmap(name=self.cmap_name, cmap=my_cmap)
-        return rgbs
+        # One call looks up every color
+        return [tuple(rgb) for rgb in self.cmap(inds)]
+
+    def _diverging_positions(self, num_bins, bins=None):
+        '''Where each bin falls on the diverging colormap: the bins below
+        the center step from the middle towards 0, those above towards 1,
+        both sides in steps of the same size'''
+        if bins is None:
+            cutoffs = np.arange(num_bins + 1, dtype=float)
+            center = num_bins / 2.0
+        else:
+            cutoffs = np.asarray(bins, dtype=float)[:num_bins + 1]
+            center = self.center
+            if center is None:
+                center = cutoffs[len(cutoffs) // 2]
+        below = cutoffs[1:] <= center
+        above = cutoffs[:-1] >= center
+        # Steps away from the center, 1 for the bins next to it
+        steps = np.zeros(num_bins)
+        steps[below] = np.arange(below.sum(), 0, -1)
+        steps[above] = np.arange(1, above.sum() + 1)
+        sides = above.astype(float) - below
+        return .5 + .5 * sides * steps / max(steps.max(), 1)
+
+    def _bivariate_colors(self, num_bins):
+        '''The n x n grid of colors mixed from the four corner colors'''
+        n = int(round(math.sqrt(num_bins)))
+        if n * n != num_bins or n < 2:
+            raise ValueError('Bivariate schemes need a square number of ' +
+                             'categories, e.g. 9 for 3 x 3.')
+        corners = np.array([mcolors.to_rgba(c)
+                            for c in self.bivariate_dict[self.county_colors]])
+        x = np.linspace(0, 1, n)[:, None, None]
+        y = np.linspace(0, 1, n)[None, :, None]
+        grid = ((1 - x) * (1 - y) * corners[0] + x * (1 - y) * corners[1] +
+                (1 - x) * y * corners[2] + x * y * corners[3])
+        return [tuple(rgb) for rgb in grid.reshape(num_bins, 4)]
 
 
 class Choropleth(object):
 
     def __init__(self, area_data, ch_style=None, city_info=None, out_path='',
-                 savepdf=True, showplot=False):
+                 savepdf=True, showplot=False, cache=None, insets=None):
         '''Attributes:
             area_data(AreaPopDataSet object)
             city_info(CityInfo object)
@@ -817,16 +1807,28 @@ class Choropleth(object):
             ch_style(ChroplethStyle object)
             city_info(CityInfo object)
             outpath(str): specify an outpath if different than the current one
+            cache(RenderCache object): if given, maps already rendered with
+                the same data, bins, style and geometry are copied from the
+                cache instead of being drawn again
+            insets(InsetLayout object): draws several regions on one map,
+                e.g. US_INSETS; shapes outside its regions are left out
+            geometry(GeometryStore): the shapes as drawn, moved into their
+                regions when there are insets
             '''
         if isinstance(ch_style, string_types) or ch_style is None:
             ch_style = ChoroplethStyle(ch_style)
         self.ch_style = ch_style
         self.area_data = area_data
+        self.insets = insets
+        self.geometry = area_data.geometry
+        if insets is not None:
+            self.geometry = self.geometry.arrange(insets)
         self.city_info = city_info
         self.out_path = os.path.normpath(out_path)
         self.savepdf = savepdf
         self.showplot = showplot
-        self.num_bins = len(self.area_data.bins)
+        self.cache = cache
+        self.num_bins = self.area_data.num_cats
 
         self.legx = self.ch_style.legx
         self.legy = self.ch_style.legy
@@ -837,22 +1839,87 @@ class Choropleth(object):
         self.ttl_align = self.ch_style.ttl_align
 
         # Create the cmap for the plot
-        self.rgbs = self.ch_style.get_colors(self.num_bins)
+        self.rgbs = self.ch_style.get_colors(self.num_bins,
+                                             self.area_data.bins)
+        # Exception groups, e.g. suppressed data, come after the bins
+        self.rgbs += self.ch_style.get_exception_colors(
+            self.area_data.classification.exceptions)
 
-    def plot(self):
+    def plot(self, target=None, formats=None, profile=None):
         '''Creates a county choropleth with a certain format
+        Args:
+            target, formats: where and how to save the map, see save_plot
+            profile(str): 'deterministic' or 'sampling' to profile the
+                drawing, see MapProfile. The profile is named after cat_name
+                and written to out_path.
+        Returns:
+            the result of save_plot, or None if savepdf is False
         '''
-        self.ax = self.area_data.data.plot(column=self.area_data.grouped_col,
-                                           alpha=1,
-                                           cmap=self.ch_style.cmap_name,
-                                           categorical=True, legend=False,
-                                           linewidth=self.ch_style.border_width,
-                                           edgecolor=self.ch_style.border_color)
+        if profile is not None:
+            with MapProfile(self.area_data.cat_name, profile, self.out_path):
+                return self.plot(target, formats)
+
+        # Nothing to draw if the saved map can come straight from the cache
+        if self.savepdf and not self.showplot and self.cache is not None:
+            key = self.cache_key()
+            outputs = self._outputs(target, formats)
+            if all(self.cache.contains(key, fmt) for fmt, _ in outputs):
+                return self.save_plot(target, formats)
+
+        self.draw()
+        saved = None
+        if self.savepdf:
+            saved = self.save_plot(target, formats)
+
+        if self.showplot:
+            self.show_plot()
+            plt.close(self.ax.figure)
+        return saved
+
+    def draw(self, every_shape=False):
+        '''Draws the map on a new figure, without saving it. The figure
+        has its own Agg canvas and is not known to pyplot, so maps can be
+        drawn from several threads at once; only maps to be shown go
+        through pyplot.
+        Args:
+            every_shape(bool): also draw the shapes without data, with no
+                fill or border, so that the colors of every shape can be
+                changed afterwards (see ChoroplethAnimation)
+        '''
+        # Colors come straight from the group codes; shapes without data
+        # are left out as before
+        classification = self.area_data.classification
+        drawn = classification.codes > 0
+        if every_shape:
+            drawn = np.ones(len(drawn), dtype=bool)
+        if self.insets is not None:
+            drawn &= self.geometry.region >= 0
+        shapes = self.geometry.to_geodataframe()[drawn]
+        if self.showplot:
+            fig = plt.figure()
+        else:
+            fig = mfigure.Figure()
+            backend_agg.FigureCanvasAgg(fig)
+        self.ax = shapes.plot(ax=fig.add_subplot(111),
+                              color=classification.colors(self.rgbs)[drawn],
+                              alpha=1, legend=False,
+                              linewidth=self.ch_style.border_width,
+                              edgecolor=self.ch_style.border_color)
+        if every_shape:
+            self.ax.collections[0].set_edgecolor(self.edge_colors()[drawn])
+        if self.insets is not None:
+            for x0, y0, x1, y1 in self.geometry.frames:
+                self.ax.add_patch(mpatches.Rectangle(
+                    (x0, y0), x1 - x0, y1 - y0, fill=False,
+                    edgecolor=self.ch_style.border_color,
+                    linewidth=self.ch_style.border_width))
 
         self.ax.set_frame_on(False)
         self.ax.axes.get_xaxis().set_visible(False)
         self.ax.axes.get_yaxis().set_visible(False)
-        plt.tight_layout()
+        # Maps with the same extent, size, legend and style share a layout
+        self.layout = LayoutTemplate.get(self, self.ax.figure)
+        self.layout.apply_subplotpars(self.ax.figure)
 
         if self.city_info is not None:
             self._add_cities(self.city_info.cities_df)
@@ -860,12 +1927,15 @@ class Choropleth(object):
         self._draw_legend()
         self._add_footnote()
 
-        if self.savepdf:
-            self.save_plot()
-
-        if self.showplot:
-            self.show_plot()
-        plt.close("all")
+    def edge_colors(self, classification=None):
+        '''The rgba border color of each shape, none for shapes without
+        data'''
+        if classification is None:
+            classification = self.area_data.classification
+        edges = np.zeros((len(classification.codes), 4))
+        edges[classification.codes > 0] = mcolors.to_rgba(
+            self.ch_style.border_color)
+        return edges
 
     def _add_cities(self, df):
         '''Plots and labels Texas cities'''
@@ -902,9 +1972,7 @@ class Choropleth(object):
 
     def _add_title(self):
         '''Creates and positions the plot title'''
-        if len(self.title) > self.ch_style.ttl_char_limit:
-            self.title = "\n".join(textwrap.wrap(self.title, width=40,
-                                                 break_long_words = False))
+        self.title = self.layout.wrap_title(self.title)
         self.ax.set_title(self.title, x=self.ttlx, y=self.ttly,
                           fontsize='large', fontname='Microsoft Sans Serif',
                           weight='semibold', ha=self.ttl_align,
@@ -928,17 +1996,9 @@ class Choropleth(object):
                              loc=self.ch_style.legend_loc,
                              borderaxespad=0)
 
-        # finding the legend extents
-        fig = self.ax.figure
-        fig.canvas.draw()
-        renderer = fig.canvas.renderer
-        leg = self.ax.get_legend()
-        bb = leg.get_window_extent(renderer).transformed(
-            leg.axes.transAxes.inverted())
-        self.legx0 = bb.x0 + .005
-        self.legx1 = bb.x1 - .005
-        self.legy0 = bb.y0 - .005
-        self.legy1 = bb.y1 + .005
+        # finding the legend extents, measured once per layout
+        self.legx0, self.legx1, self.legy0, self.legy1 = \
+            self.layout.measure_legend(leg, self.ax)
 
         # Add legend title here
         self.ax.annotate('Legend',
@@ -959,11 +2019,128 @@ class Choropleth(object):
                          size=6,
                          wrap=True)
 
-    def save_plot(self):
-        '''Saves the plot to a png file and shows in the viewer'''
-        # Create the output
-        outfile = os.path.join(self.out_path, self.area_data.cat_name)
-        plt.savefig(outfile, dpi=self.ch_style.resolution, bbox_inches='tight')
-   
+    def cache_key(self):
+        '''Hashes everything that determines the rendered map: the groups,
+        bins, labels, title and footnote of the dataset, the style and
+        palette, the city labels and the geometry'''
+        ad = self.area_data
+        parts = [str(CACHE_VERSION),
+                 hashlib.sha1(np.ascontiguousarray(
+                     ad.groups).tobytes()).hexdigest(),
+                 repr([float(b) for b in ad.bins]),
+                 repr(list(ad.group_names)), ad.title, ad.footnote,
+                 style_fingerprint(self.ch_style),
+                 repr([tuple(float(c) for c in rgb) for rgb in self.rgbs]),
+                 ad.geometry_fingerprint()]
+        if self.insets is not None:
+            parts.append(repr((self.insets.key(), self.insets.frame)))
+        if self.city_info is not None:
+            parts.append(frame_fingerprint(
+                self.city_info.cities_df,
+                [c for c in self.city_info.cities_df.columns
+                 if c != 'geometry']))
+        return hashlib.sha1(
+            '\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def _outputs(self, target=None, formats=None):
+        '''Pairs each requested format with its destination. Paths without a
+        format extension get one added; several formats share one base path.
+        '''
+        if isinstance(target, dict):
+            return list(target.items())
+        if isinstance(formats, string_types):
+            formats = [formats]
+        if target is None:
+            target = os.path.join(self.out_path, self.area_data.cat_name)
+        if not isinstance(target, string_types):  # a file-like object
+            if formats is None:
+                formats = [matplotlib.rcParams['savefig.format']]
+            if len(formats) != 1:
+                raise ValueError('A file-like target takes one format. ' +
+                                 'Use a dict of targets for several formats.')
+            return [(formats[0], target)]
+        base, ext = os.path.splitext(target)
+        ext = ext[1:].lower()
+        supported = backend_bases.FigureCanvasBase.get_supported_filetypes()
+        if ext not in supported:
+            base, ext = target, matplotlib.rcParams['savefig.format']
+        if formats is None:
+            formats = [ext]
+        return [(fmt, base + '.' + fmt) for fmt in formats]
+
+    def _tight_bbox(self, fig):
+        '''Measures the tight bounding box once so every output format can
+        reuse it instead of running the tight layout in each savefig'''
+        if not hasattr(fig.canvas, 'get_renderer'):  # figure was closed
+            backend_agg.FigureCanvasAgg(fig)
+        renderer = fig.canvas.get_renderer()
+        return fig.get_tightbbox(renderer).padded(
+            matplotlib.rcParams['savefig.pad_inches'])
+
+    def _save(self, outputs, cache=None):
+        '''Renders each (format, destination) pair from the one figure.
+        Destinations can be paths, file-like objects or None for bytes.
+        Returns:
+            dict{format(str): path, file-like object or bytes}'''
+        key = self.cache_key() if cache is not None else None
+        bbox = None
+        results = {}
+        for fmt, dest in outputs:
+            image = cache.read(key, fmt) if cache is not None else None
+            if image is None:
+                if getattr(self, 'ax', None) is None:
+                    # plot found the map in the cache, but it was evicted
+                    # before it could be read
+                    self.draw()
+                fig = self.ax.figure
+                if bbox is None:
+                    bbox = self._tight_bbox(fig)
+                buf = io.BytesIO()
+                fig.savefig(buf, format=fmt, dpi=self.ch_style.resolution,
+                            bbox_inches=bbox)
+                image = buf.getvalue()
+                if cache is not None:
+                    cache.put(key, fmt, image)
+            if dest is None:
+                results[fmt] = image
+            elif isinstance(dest, string_types):
+                with open(dest, 'wb') as f:
+                    f.write(image)
+                results[fmt] = dest
+            else:
+                dest.write(image)
+                results[fmt] = dest
+        return results
+
+    def save_plot(self, target=None, formats=None, cache=None):
+        '''Saves the plot, by default to a png file named after cat_name in
+        out_path
+        Args:
+            target(str or file-like object or dict): path or open binary
+                stream to write to, or a dict mapping formats to paths or
+                streams. A path without a format extension gets one added.
+            formats(str or list[str]): output formats, e.g. ['png', 'pdf',
+                'svg']. They are all drawn from the same figure.
+            cache(RenderCache object): cache to copy the map from or store it
+                in, defaults to the cache given to the Choropleth
+        Returns:
+            the path or stream written to, or a dict of them by format when
+            there are several'''
+        if cache is None:
+            cache = self.cache
+        results = self._save(self._outputs(target, formats), cache)
+        if len(results) == 1:
+            return list(results.values())[0]
+        return results
+
+    def to_bytes(self, formats='png', cache=None):
+        '''Returns the plot as bytes in memory, or a dict of bytes by format
+        when formats is a list'''
+        if cache is None:
+            cache = self.cache
+        if isinstance(formats, string_types):
+            return self._save([(formats, None)], cache)[formats]
+        return self._save([(fmt, None) for fmt in formats], cache)
+
     def show_plot(self):
         plt.show()
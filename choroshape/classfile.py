@@ -0,0 +1,115 @@
+'''Compact binary files of classified map data.
+
+A file holds a few named arrays and a small JSON header describing them, so
+a classification can be written once and memory-mapped back by any number
+of processes without reading or unpickling the whole file. The layout is:
+
+    8 bytes     magic, b'CHOROCLS'
+    4 bytes     format version, little-endian uint32
+    8 bytes     header length, little-endian uint64
+    header      JSON: {"meta": {...}, "arrays": [{"name", "dtype",
+                "shape", "offset"}, ...]}
+    arrays      raw array data, each starting on a 64-byte boundary;
+                offsets are counted from the first array
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'read_arrays',
+    'write_arrays'
+]
+
+import json
+import os
+import struct
+import tempfile
+
+from ._lazy import LazyModule
+
+np = LazyModule('numpy')
+
+MAGIC = b'CHOROCLS'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<IQ')
+_ALIGN = 64
+
+
+def _aligned(n):
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def write_arrays(path, arrays, meta=None):
+    '''Writes named arrays and JSON-able metadata to a file. The file is
+    written under a temporary name and moved into place, so readers never
+    see a partial file.
+    Args:
+        path(str): file to write
+        arrays(list[tuple(str, numpy.ndarray)]): arrays in file order;
+            object arrays are not supported, store strings as bytes
+        meta(dict): anything json can write
+        '''
+    arrays = [(name, np.ascontiguousarray(a)) for name, a in arrays]
+    entries = []
+    offset = 0
+    for name, a in arrays:
+        if a.dtype.hasobject:
+            raise TypeError('Array "%s" holds Python objects.' % name)
+        entries.append({'name': name, 'dtype': a.dtype.str,
+                        'shape': list(a.shape), 'offset': offset})
+        offset = _aligned(offset + a.nbytes)
+    header = json.dumps({'meta': meta or {}, 'arrays': entries},
+                        sort_keys=True).encode('utf-8')
+    start = _aligned(len(MAGIC) + _PREFIX.size + len(header))
+
+    path = os.path.abspath(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + _PREFIX.pack(FORMAT_VERSION, len(header)))
+            f.write(header)
+            for entry, (name, a) in zip(entries, arrays):
+                f.seek(start + entry['offset'])
+                f.write(a.tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read_arrays(path, mmap=True):
+    '''Reads a file written by write_arrays
+    Args:
+        path(str): file to read
+        mmap(bool): map the arrays from the file instead of reading them;
+            either way they are read-only
+    Returns:
+        arrays(dict{str: numpy.ndarray})
+        meta(dict)'''
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + _PREFIX.size)
+        if prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a classification file.' % path)
+        version, header_len = _PREFIX.unpack(prefix[len(MAGIC):])
+        if version > FORMAT_VERSION:
+            raise ValueError('%s was written by a newer version (format %d).'
+                             % (path, version))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    start = _aligned(len(MAGIC) + _PREFIX.size + header_len)
+    if mmap:
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        with open(path, 'rb') as f:
+            buf = np.frombuffer(f.read(), dtype=np.uint8)
+
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        begin = start + entry['offset']
+        nbytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        arrays[entry['name']] = buf[begin:begin + nbytes].view(
+            dtype).reshape(shape)
+    return arrays, header['meta']
@@ -0,0 +1,428 @@
+'''Command-line batch renderer driven by a job manifest.
+
+A manifest lists the maps to make. It can be JSON or YAML, with a list of
+jobs or a mapping with 'defaults' and 'maps' keys, or a CSV file with one
+job per row. Each job takes the make_choropleth arguments plus:
+    data(str): data csv, with the columns described in make_choropleth
+    shapefile(str): county shapefile
+    state_FIPS(str): two digit state FIPS code
+    colors(str): ChoroplethStyle county colors
+Relative paths are taken from the manifest's directory. In CSV manifests
+bins and formats are written as lists separated by ';'.
+
+Each shapefile and data file is read once, however many jobs share it, and
+jobs are rendered in parallel worker processes, or with --threads in
+threads of this process, which start faster and share the inputs directly.
+
+    choroshape maps.json --jobs 4 --cache-dir ~/.cache/choroshape
+
+With --profile each map is profiled (see MapProfile) and its top hotspots
+are reported along with the progress; a job can also set 'profile' itself.
+
+Inputs are dropped once their last map is done. For long batches,
+--memory-mb sets a budget for this process: over it, inputs are spilled to
+disk (see batch.py) and the memory added by each stage is reported.
+--max-tasks-per-child and --max-worker-mb replace the worker processes
+after a number of maps or once one grows too large.
+'''
+
+from __future__ import unicode_literals, print_function
+
+__all__ = [
+    'read_manifest',
+    'run_batch'
+]
+
+import argparse
+import collections
+import csv
+import gc
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from .batch import MemoryBudget, SpilledFrame
+
+# Paths in a job, resolved against the manifest's directory
+_PATH_KEYS = ['data', 'shapefile', 'out_path']
+# Keys that are lists in a job, written with ';' in CSV manifests
+_LIST_KEYS = ['bins', 'formats']
+_NUMBER_KEYS = {'num_cats': int, 'precision': int, 'legx': float,
+                'legy': float}
+
+# Inputs shared by every job in a batch, keyed by file and columns
+_SHARED = {}
+
+
+def _parse_csv_row(row):
+    job = {}
+    for key, value in row.items():
+        if value is None or value.strip() == '':
+            continue
+        value = value.strip()
+        if key in _LIST_KEYS:
+            value = [v.strip() for v in value.split(';') if v.strip()]
+            if key == 'bins':
+                value = [float(v) for v in value]
+        elif key in _NUMBER_KEYS:
+            value = _NUMBER_KEYS[key](value)
+        job[key] = value
+    return job
+
+
+def read_manifest(path):
+    '''Reads a JSON, YAML or CSV manifest
+    Args:
+        path(str): manifest file, the format is taken from the extension
+    Returns:
+        jobs(list[dict]): one dict of options per map, with defaults applied
+            and paths made absolute'''
+    path = os.path.abspath(os.path.expanduser(path))
+    ext = os.path.splitext(path)[1].lower()
+    with io.open(path, encoding='utf-8') as f:
+        if ext == '.csv':
+            manifest = [_parse_csv_row(row) for row in csv.DictReader(f)]
+        elif ext in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('Reading YAML manifests requires PyYAML.')
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get('defaults', {})
+        manifest = manifest['maps']
+    base = os.path.dirname(path)
+    jobs = []
+    for i, entry in enumerate(manifest):
+        job = dict(defaults, **entry)
+        for key in ['data', 'shapefile', 'state_FIPS']:
+            if key not in job:
+                raise ValueError('Job %d in %s has no "%s".' % (i, path, key))
+        for key in _PATH_KEYS:
+            if key in job:
+                job[key] = os.path.normpath(
+                    os.path.join(base, os.path.expanduser(job[key])))
+        job['state_FIPS'] = str(job['state_FIPS']).zfill(2)
+        if job.get('cat_name') is None:
+            job['cat_name'] = os.path.splitext(
+                os.path.basename(job['data']))[0]
+        jobs.append(job)
+    return jobs
+
+
+def _shape_key(job):
+    return (job['shapefile'], job.get('geoFIPS_col'), job.get('geometry_col'),
+            job.get('geostate_col'))
+
+
+def _spill_shared(budget, keys):
+    '''Spills the inputs under keys that are still in memory'''
+    for key in keys:
+        value = _SHARED.get(key)
+        if value is not None and not isinstance(value, SpilledFrame):
+            _SHARED[key] = budget.spill(value, '_'.join(
+                os.path.basename('%s' % k) for k in key if k is not None))
+    gc.collect()
+
+
+def _load_inputs(jobs, budget=None):
+    '''Reads the states the jobs need from every distinct shapefile and data
+    file, once per state. Shapes are read with load_geodata, so GeoParquet
+    and Feather files and StateIndexes read only the state. Fills _SHARED
+    and returns the keys for each job, or the error message for jobs whose
+    inputs could not be read. Over the budget, the inputs read so far are
+    spilled.'''
+    from .choroshape import load_data, load_geodata
+
+    keys = []
+    for job in jobs:
+        state = job['state_FIPS']
+        geo_key = _shape_key(job) + (state,)
+        data_key = (job['data'], state)
+        try:
+            if geo_key not in _SHARED:
+                _SHARED[geo_key] = load_geodata(
+                    job['shapefile'], state, job.get('geoFIPS_col'),
+                    job.get('geometry_col'), job.get('geostate_col'))
+            if data_key not in _SHARED:
+                _SHARED[data_key] = load_data(job['data'], state)
+        except Exception as e:
+            keys.append('%s: %s' % (type(e).__name__, e))
+            continue
+        keys.append((geo_key, data_key))
+        if budget is not None and budget.over():
+            _spill_shared(budget, set(k for pair in keys
+                                      if isinstance(pair, tuple)
+                                      for k in pair))
+    return keys
+
+
+def _resolve(value):
+    '''A frame from a key into _SHARED, a SpilledFrame or the frame'''
+    if isinstance(value, tuple):
+        value = _SHARED[value]
+    if isinstance(value, SpilledFrame):
+        value = value.load()
+    return value
+
+
+def _render_job(job, geodata, data, cache_dir=None):
+    '''Renders one job in a worker. geodata and data are frames, spilled
+    frames or keys into _SHARED, which forked workers inherit from the
+    parent.
+    Returns:
+        (elapsed seconds(float), whether the map came from the cache,
+         stages(list[tuple(str, float, float)]): memory added by each stage
+         and resident memory after it, in MB,
+         resident memory of the worker after the map in MB(float))'''
+    from .choroshape import make_choropleth
+    from .cache import RenderCache
+    from .geometry import GeometryStore
+
+    start = time.time()
+    budget = MemoryBudget()
+    with budget.stage('inputs'):
+        # Maps of the same shapes share one store, and with it what was
+        # derived from the shapes for the first of them
+        geodata = GeometryStore.get(_resolve(geodata), 'FIPS')
+        data = _resolve(data)
+    cache = RenderCache(cache_dir) if cache_dir is not None else None
+    hits = cache.hits if cache is not None else 0
+
+    options = dict((k, v) for k, v in job.items()
+                   if k not in ('data', 'shapefile', 'state_FIPS', 'colors'))
+    options['county_colors'] = job.get('colors')
+    # The inputs were already cut to the state and given 5-digit FIPS codes
+    options.update(geoFIPS_col='FIPS', geometry_col=None, geostate_col=None)
+    with budget.stage('render'):
+        make_choropleth(data, geodata, job['state_FIPS'], cache=cache,
+                        **options)
+    cached = cache is not None and cache.hits > hits
+    # Figures and datasets hold reference cycles; free them now rather
+    # than whenever the collector gets to them
+    with budget.stage('cleanup'):
+        del geodata, data
+        gc.collect()
+    stages = [(name, added, peak)
+              for name, (_, added, peak) in budget.stages.items()]
+    return time.time() - start, cached, stages, stages[-1][2]
+
+
+def run_batch(jobs, n_jobs=None, cache_dir=None, out=sys.stderr,
+              threads=False, memory_mb=None, spill_dir=None,
+              max_tasks_per_child=None, max_worker_mb=None):
+    '''Renders a list of jobs, reporting progress and timings
+    Args:
+        jobs(list[dict]): as returned by read_manifest
+        n_jobs(int): worker processes or threads, default is the number of
+            CPUs; 1 renders in this process
+        threads(bool): render in threads instead of processes
+        cache_dir(str): RenderCache directory, None for no cache
+        out(file): where progress is written, None for silence
+        memory_mb(float): memory budget of this process in MB. Over it,
+            the inputs are spilled to disk and read back by each map.
+        spill_dir(str): directory to spill to, a temporary one by default
+        max_tasks_per_child(int): replace the worker processes after about
+            this many maps each
+        max_worker_mb(float): replace the worker processes when one of
+            them is left holding more memory than this after a map
+    Returns:
+        failures(list[tuple(dict, str)]): jobs that raised and the error'''
+    def report(msg):
+        if out is not None:
+            print(msg, file=out)
+            out.flush()
+
+    budget = MemoryBudget(memory_mb, spill_dir)
+    try:
+        return _run_batch(jobs, n_jobs, cache_dir, report, threads, budget,
+                          max_tasks_per_child, max_worker_mb)
+    finally:
+        _SHARED.clear()
+        budget.cleanup()
+
+
+def _run_batch(jobs, n_jobs, cache_dir, report, threads, budget,
+               max_tasks_per_child, max_worker_mb):
+    wall = time.time()
+    with budget.stage('load'):
+        keys = _load_inputs(jobs, budget)
+    load_time = time.time() - wall
+    loaded = [k for k in keys if isinstance(k, tuple)]
+    report('Loaded %d geometries and %d data files in %.2fs' % (
+        len(set(k[0] for k in loaded)), len(set(k[1] for k in loaded)),
+        load_time))
+    # Maps still to come for each input
+    uses = collections.Counter(k for pair in loaded for k in pair)
+
+    failures = []
+    totals = {'render': 0.0, 'cached': 0}
+    width = len(str(len(jobs)))
+
+    def finished(job, key=None, result=None, error=None):
+        finished.count += 1
+        if error is not None:
+            failures.append((job, error))
+            status = 'FAILED: %s' % error
+        else:
+            elapsed, cached, stages, _ = result
+            totals['render'] += elapsed
+            totals['cached'] += cached
+            for name, added, peak in stages:
+                budget.record(name, added, peak)
+            status = '%.2fs%s' % (elapsed, ' (cached)' if cached else '')
+        report('[%*d/%d] %s %s' % (width, finished.count, len(jobs),
+                                   job['cat_name'], status))
+        # Inputs are let go after their last map
+        for k in key or ():
+            uses[k] -= 1
+            if uses[k] == 0:
+                value = _SHARED.pop(k, None)
+                if isinstance(value, SpilledFrame):
+                    budget.release(value)
+        if budget.over():
+            _spill_shared(budget, [k for k, n in uses.items() if n > 0])
+    finished.count = 0
+
+    ready = collections.deque()
+    for job, key in zip(jobs, keys):
+        if isinstance(key, tuple):
+            ready.append((job, key))
+        else:
+            finished(job, error=key)
+
+    recycle = not threads and (max_tasks_per_child or max_worker_mb)
+    if n_jobs == 1 and not recycle:
+        for job, (geo_key, data_key) in ready:
+            try:
+                result = _render_job(job, geo_key, data_key, cache_dir)
+            except Exception as e:
+                finished(job, (geo_key, data_key),
+                         error='%s: %s' % (type(e).__name__, e))
+                continue
+            finished(job, (geo_key, data_key), result)
+    else:
+        _render_pool(ready, n_jobs, cache_dir, threads, max_tasks_per_child,
+                     max_worker_mb, finished, report)
+
+    report('%d maps (%d cached, %d failed) in %.2fs: loading %.2fs, '
+           'rendering %.2fs of worker time' % (
+               len(jobs), totals['cached'], len(failures),
+               time.time() - wall, load_time, totals['render']))
+    if budget.limit_mb is not None:
+        report('Memory by stage, %d input(s) spilled:\n%s' % (
+            len(budget.spilled), '\n'.join(budget.report())))
+    return failures
+
+
+def _render_pool(ready, n_jobs, cache_dir, threads, max_tasks_per_child,
+                 max_worker_mb, finished, report):
+    '''Renders the jobs in pools of workers, one job per worker at a
+    time. Each pool of processes is shut down and replaced once its
+    workers did max_tasks_per_child maps each or one of them grew past
+    max_worker_mb; new workers start from the inputs left by then.'''
+    # Threads and forked workers share the loaded inputs; otherwise
+    # they are sent along with each job
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+    workers = n_jobs or multiprocessing.cpu_count()
+    limit = None
+    if max_tasks_per_child and not threads:
+        limit = workers * max_tasks_per_child
+    while ready:
+        if threads:
+            pool = ThreadPoolExecutor(workers)
+        else:
+            context = multiprocessing.get_context('fork' if fork else None)
+            pool = ProcessPoolExecutor(workers, mp_context=context)
+        submitted = 0
+        grown = False
+        with pool:
+            futures = {}
+            while True:
+                while (ready and not grown and len(futures) < workers and
+                       (limit is None or submitted < limit)):
+                    job, (geo_key, data_key) = ready.popleft()
+                    if fork or threads:
+                        args = (job, geo_key, data_key, cache_dir)
+                    else:
+                        args = (job, _SHARED[geo_key], _SHARED[data_key],
+                                cache_dir)
+                    futures[pool.submit(_render_job, *args)] = (
+                        job, (geo_key, data_key))
+                    submitted += 1
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, key = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        finished(job, key,
+                                 error='%s: %s' % (type(e).__name__, e))
+                        continue
+                    finished(job, key, result)
+                    if (max_worker_mb and not threads and
+                            result[3] > max_worker_mb):
+                        grown = True
+        if ready:
+            report('Replacing worker processes (%s)' % (
+                'memory' if grown else 'maps per worker'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='choroshape',
+        description='Render the choropleth maps listed in a manifest.')
+    parser.add_argument('manifest', help='JSON, YAML or CSV job manifest')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='reuse maps rendered before from this directory')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report progress')
+    parser.add_argument('--threads', action='store_true',
+                        help='render in threads instead of processes')
+    parser.add_argument('--profile', choices=['deterministic', 'sampling'],
+                        default=None,
+                        help='write a profile of each map next to it')
+    parser.add_argument('--memory-mb', type=float, default=None,
+                        help='spill inputs to disk above this much memory')
+    parser.add_argument('--spill-dir', default=None,
+                        help='directory to spill to (default: a temporary '
+                             'one)')
+    parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                        help='replace worker processes after this many maps')
+    parser.add_argument('--max-worker-mb', type=float, default=None,
+                        help='replace worker processes that grow past this '
+                             'much memory')
+    args = parser.parse_args(argv)
+
+    jobs = read_manifest(args.manifest)
+    if args.profile is not None:
+        for job in jobs:
+            job.setdefault('profile', args.profile)
+    if not args.quiet and any(job.get('profile') for job in jobs):
+        logging.basicConfig(level=logging.INFO, format='%(message)s',
+                            stream=sys.stderr)
+    failures = run_batch(jobs, n_jobs=args.jobs, cache_dir=args.cache_dir,
+                         out=None if args.quiet else sys.stderr,
+                         threads=args.threads, memory_mb=args.memory_mb,
+                         spill_dir=args.spill_dir,
+                         max_tasks_per_child=args.max_tasks_per_child,
+                         max_worker_mb=args.max_worker_mb)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+'''Shared, read-only county geometry for datasets and renderers'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'GeometryStore'
+]
+
+import collections
+import os
+import weakref
+
+from ._lazy import LazyModule
+from .cache import geometry_fingerprint
+from .columnar import is_columnar, read_geodata
+
+gpd = LazyModule('geopandas')
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+shapely = LazyModule('shapely')
+
+# Stores already built, keyed by id of the GeoDataFrame or by file. A
+# GeoDataFrame's store is dropped when the GeoDataFrame is; stores read from
+# files are kept for the _MAX_FILE_STORES files used last.
+_STORES = {}
+_FILE_STORES = collections.OrderedDict()
+_MAX_FILE_STORES = 8
+
+
+class GeometryStore(object):
+
+    def __init__(self, geodata, geoFIPS_col):
+        '''Holds the county shapes and their FIPS codes once, so any number of
+        datasets can refer to them without copying. Things derived from the
+        geometry (its fingerprint, etc.) are computed once and kept here.
+        The store is read-only; build a new one if the geometry changes.
+        Attributes:
+            FIPS(numpy.ndarray): FIPS code of each shape
+            geometry(geopandas.array.GeometryArray): the shapes
+            crs: coordinate reference system of the shapes
+            geoFIPS_col(str): name of the FIPS column it was built from
+            '''
+        self.geoFIPS_col = geoFIPS_col
+        self.FIPS = geodata[geoFIPS_col].to_numpy()
+        self.geometry = geodata.geometry.values
+        self.crs = geodata.crs
+        self._derived = {}
+
+    @classmethod
+    def from_arrays(cls, FIPS, geometry, crs, geoFIPS_col):
+        '''Builds a store straight from its FIPS codes and shapes'''
+        return cls(gpd.GeoDataFrame({geoFIPS_col: FIPS},
+                                    geometry=gpd.array.from_shapely(
+                                        geometry, crs=crs)),
+                   geoFIPS_col)
+
+    @classmethod
+    def get(cls, geodata, geoFIPS_col):
+        '''Returns the store for a GeoDataFrame or a shapefile name, building
+        it only the first time
+        Args:
+            geodata(geopandas.GeoDataFrame or str or GeometryStore): a
+                shapefile or a GeoParquet or Feather file can be named
+            geoFIPS_col(str): name of the column with complete FIPS codes
+        '''
+        if isinstance(geodata, GeometryStore):
+            return geodata
+
+        if isinstance(geodata, gpd.GeoDataFrame):
+            key = (id(geodata), geoFIPS_col)
+            entry = _STORES.get(key)
+            if entry is not None and entry[0]() is geodata:
+                return entry[1]
+            store = cls(geodata, geoFIPS_col)
+
+            def forget(ref, key=key):
+                # Only if the key was not reused for a newer GeoDataFrame
+                if key in _STORES and _STORES[key][0] is ref:
+                    del _STORES[key]
+            _STORES[key] = (weakref.ref(geodata, forget), store)
+            return store
+
+        path = os.path.abspath(geodata)
+        key = (path, os.path.getmtime(path), geoFIPS_col)
+        if key in _FILE_STORES:
+            _FILE_STORES.move_to_end(key)
+        else:
+            if is_columnar(path):
+                geodata = read_geodata(path)
+            else:
+                geodata = gpd.GeoDataFrame.from_file(path)
+            _FILE_STORES[key] = cls(geodata, geoFIPS_col)
+            while len(_FILE_STORES) > _MAX_FILE_STORES:
+                _FILE_STORES.popitem(last=False)
+        return _FILE_STORES[key]
+
+    def __len__(self):
+        return len(self.FIPS)
+
+    def align(self, FIPS):
+        '''Finds the position of each shape's FIPS code in FIPS
+        Args:
+            FIPS(sequence[str]): FIPS codes of some data, without duplicates
+        Returns:
+            rows(numpy.ndarray): one entry per shape, -1 where the data has
+                no row for that shape'''
+        index = pd.Index(FIPS)
+        if not index.is_unique:
+            raise ValueError('Data contains duplicate FIPS code values.')
+        return index.get_indexer(self.FIPS)
+
+    def fingerprint(self):
+        '''Hash of the shapes, computed once'''
+        if 'fingerprint' not in self._derived:
+            self._derived['fingerprint'] = geometry_fingerprint(self.geometry)
+        return self._derived['fingerprint']
+
+    def bounds(self):
+        '''Total bounds of the shapes, (minx, miny, maxx, maxy), computed
+        once'''
+        if 'bounds' not in self._derived:
+            self._derived['bounds'] = tuple(
+                float(b) for b in self.geometry.total_bounds)
+        return self._derived['bounds']
+
+    def adjacency(self, kind='queen'):
+        '''Which shapes are neighbors, as a sparse symmetric n x n matrix of
+        ones. Candidate pairs come from a spatial index instead of comparing
+        every shape with every other, and each kind is found once.
+        Args:
+            kind(str): 'queen' for shapes that touch at all, 'rook' for
+                shapes that share a stretch of border, not just a corner
+        Returns:
+            adjacency(scipy.sparse.csr_matrix)'''
+        if kind not in ('queen', 'rook'):
+            raise ValueError("Adjacency must be 'queen' or 'rook', not %r."
+                             % kind)
+        key = ('adjacency', kind)
+        if key not in self._derived:
+            try:
+                from scipy import sparse
+            except ImportError:
+                raise ImportError('County adjacency requires scipy.')
+            shapes = np.asarray(self.geometry)
+            left, right = self._touching_pairs(shapes)
+            if kind == 'rook':
+                # Borders that only meet at a point have no length in common
+                borders = shapely.boundary(shapes)
+                shared = shapely.length(shapely.intersection(
+                    borders[left], borders[right]))
+                left, right = left[shared > 0], right[shared > 0]
+            n = len(shapes)
+            self._derived[key] = sparse.csr_matrix(
+                (np.ones(2 * len(left)), (np.concatenate([left, right]),
+                                          np.concatenate([right, left]))),
+                shape=(n, n))
+        return self._derived[key]
+
+    def _touching_pairs(self, shapes):
+        '''Each pair of shapes that intersect, once, found with an STRtree
+        and kept for every kind of adjacency'''
+        if 'touching_pairs' not in self._derived:
+            tree = shapely.STRtree(shapes)
+            left, right = tree.query(shapes, predicate='intersects')
+            once = left < right
+            self._derived['touching_pairs'] = (left[once], right[once])
+        return self._derived['touching_pairs']
+
+    def to_crs(self, crs):
+        '''The shapes in another coordinate reference system, projected
+        once per system and kept
+        Args:
+            crs: anything geopandas takes, e.g. 'EPSG:3857'
+        Returns:
+            projected(GeometryStore): the same shapes in the same order'''
+        key = ('crs', '%s' % crs)
+        if key not in self._derived:
+            if self.crs is None:
+                raise ValueError('The shapes have no coordinate reference '
+                                 'system to project from.')
+            projected = gpd.GeoSeries(self.geometry, crs=self.crs).to_crs(crs)
+            self._derived[key] = GeometryStore.from_arrays(
+                self.FIPS, np.asarray(projected.values), projected.crs,
+                self.geoFIPS_col)
+        return self._derived[key]
+
+    def simplified(self, tolerance):
+        '''The shapes simplified to a tolerance in the units of the
+        coordinates, each shape on its own; simplified once per tolerance
+        Returns:
+            geometry(numpy.ndarray[shapely geometry])'''
+        key = ('simplified', float(tolerance))
+        if key not in self._derived:
+            self._derived[key] = shapely.simplify(
+                np.asarray(self.geometry), tolerance, preserve_topology=True)
+        return self._derived[key]
+
+    def arrange(self, layout):
+        '''The shapes moved into the regions of an InsetLayout, moved once
+        per layout and kept
+        Args:
+            layout(InsetLayout)
+        Returns:
+            arranged(GeometryStore): the moved shapes in the same order,
+                with region, the index of each shape's region (-1 for
+                none); transforms, the affine transform of each moved
+                region; and frames, the boxes to draw around them'''
+        key = ('arranged', layout.key(), layout.frame)
+        if key not in self._derived:
+            self._derived[key] = layout.arrange(self)
+        return self._derived[key]
+
+    def to_geodataframe(self, columns=None):
+        '''Attaches the shapes to some columns for drawing
+        Args:
+            columns(dict{name(str): array}): one value per shape
+        Returns:
+            geodata(geopandas.GeoDataFrame): shares the shapes, which are
+                not copied'''
+        if columns is None:
+            columns = {self.geoFIPS_col: self.FIPS}
+        return gpd.GeoDataFrame(columns, geometry=self.geometry, crs=self.crs)
@@ -0,0 +1,208 @@
+'''Maps of several regions on one axes, e.g. the US with Alaska, Hawaii and
+Puerto Rico moved into insets.
+
+An InsetLayout says which states make up each region and where the region
+goes. Each region that moves gets one affine transform (rotation, scale and
+offset), found from its bounds and its box. GeometryStore.arrange applies
+them once and keeps the moved shapes, so every map drawn with the layout
+reuses them; nothing is transformed while drawing. The shapes stay in the
+order of the store, so one AreaPopDataset and its classification color all
+the regions at once.
+
+    data = AreaPopDataset(df, us_counties, 'FIPS', 'FIPS', 'category',
+                          'total', bins=[10, 20, 30])
+    Choropleth(data, insets=US_INSETS).plot()
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'CONTIGUOUS_STATES',
+    'InsetLayout',
+    'Region',
+    'US_INSETS'
+]
+
+import math
+
+from ._lazy import LazyModule
+
+np = LazyModule('numpy')
+shapely = LazyModule('shapely')
+
+# The 48 contiguous states and DC
+CONTIGUOUS_STATES = [
+    '01', '04', '05', '06', '08', '09', '10', '11', '12', '13', '16', '17',
+    '18', '19', '20', '21', '22', '23', '24', '25', '26', '27', '28', '29',
+    '30', '31', '32', '33', '34', '35', '36', '37', '38', '39', '40', '41',
+    '42', '44', '45', '46', '47', '48', '49', '50', '51', '53', '54', '55',
+    '56']
+
+
+class Region(object):
+
+    def __init__(self, name, states=None, box=None, rotate=0):
+        '''A group of states drawn together
+        Attributes:
+            name(str)
+            states(list[str]): two digit FIPS codes of the states in the
+                region; None for every shape no other region has
+            box(tuple(float)): x0, y0, x1, y1 of the area to fit the region
+                in, as fractions of the extent of the regions without a box;
+                None to leave the region where it is
+            rotate(float): degrees to turn a boxed region counterclockwise
+                before it is fit in its box
+            '''
+        self.name = name
+        self.states = None if states is None else \
+            [str(s).zfill(2) for s in states]
+        self.box = None if box is None else tuple(float(b) for b in box)
+        self.rotate = float(rotate)
+
+    def key(self):
+        return (self.name, None if self.states is None else
+                tuple(self.states), self.box, self.rotate)
+
+
+class InsetLayout(object):
+
+    def __init__(self, regions, frame=True):
+        '''Where each region of a map goes
+        Attributes:
+            regions(list[Region]): shapes in none of them are left out
+            frame(bool): draw a border around each boxed region
+            '''
+        self.regions = list(regions)
+        self.frame = frame
+        if all(r.box is not None for r in self.regions):
+            raise ValueError('At least one region must stay in place.')
+
+    def key(self):
+        '''Everything the arranged shapes depend on'''
+        return tuple(r.key() for r in self.regions)
+
+    def region_of(self, FIPS):
+        '''Index of the region of each shape, -1 for shapes in none
+        Args:
+            FIPS(numpy.ndarray): five digit FIPS codes
+        Returns:
+            region(numpy.ndarray[int])'''
+        states = np.asarray(FIPS).astype(str).astype('U2')
+        region = np.full(len(states), -1)
+        # Regions with states pick first, the rest goes to states=None
+        for i, r in sorted(enumerate(self.regions),
+                           key=lambda ir: ir[1].states is None):
+            unassigned = region < 0
+            if r.states is not None:
+                unassigned &= np.isin(states, r.states)
+            region[unassigned] = i
+        return region
+
+    def transforms(self, geometry, region, geographic=False):
+        '''Finds the affine transform of each boxed region
+        Args:
+            geometry(numpy.ndarray[shapely geometry]): the shapes
+            region(numpy.ndarray[int]): see region_of
+            geographic(bool): coordinates are longitude and latitude, so
+                regions across the antimeridian (the Aleutians) are first
+                moved to one side of it
+        Returns:
+            transforms(dict{int: tuple(float)}): a, b, d, e, xoff, yoff of
+                each boxed region, as for shapely.affinity.affine_transform
+            extent(tuple(float)): bounds of the regions left in place'''
+        in_place = np.isin(region, [i for i, r in enumerate(self.regions)
+                                    if r.box is None])
+        if not in_place.any():
+            raise ValueError('No shapes are in the regions left in place.')
+        minx, miny, maxx, maxy = shapely.total_bounds(geometry[in_place])
+        width, height = maxx - minx, maxy - miny
+        transforms = {}
+        for i, r in enumerate(self.regions):
+            shapes = geometry[region == i]
+            if r.box is None or not len(shapes):
+                continue
+            if geographic:
+                shapes = _unwrap(shapes)
+            x0, y0, x1, y1 = shapely.total_bounds(shapes)
+            theta = math.radians(r.rotate)
+            cos, sin = math.cos(theta), math.sin(theta)
+            cx, cy = (x0 + x1) / 2.0, (y0 + y1) / 2.0
+            rotation = np.array([[cos, -sin, cx - cos * cx + sin * cy],
+                                 [sin, cos, cy - sin * cx - cos * cy],
+                                 [0, 0, 1]])
+            if r.rotate:
+                x0, y0, x1, y1 = shapely.total_bounds(
+                    _affine(shapes, rotation))
+            bx0, by0, bx1, by1 = (minx + r.box[0] * width,
+                                  miny + r.box[1] * height,
+                                  minx + r.box[2] * width,
+                                  miny + r.box[3] * height)
+            # Keep the region's shape and center it in the box
+            scale = min((bx1 - bx0) / (x1 - x0 or 1),
+                        (by1 - by0) / (y1 - y0 or 1))
+            fit = np.array(
+                [[scale, 0, (bx0 + bx1 - scale * (x0 + x1)) / 2.0],
+                 [0, scale, (by0 + by1 - scale * (y0 + y1)) / 2.0],
+                 [0, 0, 1]])
+            m = fit.dot(rotation)
+            transforms[i] = (m[0, 0], m[0, 1], m[1, 0], m[1, 1], m[0, 2],
+                             m[1, 2])
+        return transforms, (minx, miny, maxx, maxy)
+
+    def arrange(self, store):
+        '''Moves the shapes of a GeometryStore into place. Use
+        GeometryStore.arrange, which keeps the result.
+        Returns:
+            arranged(GeometryStore): the moved shapes, in the same order,
+                with the region of each shape in region, the transforms in
+                transforms and the boxes to frame in frames'''
+        from .geometry import GeometryStore
+        geometry = np.asarray(store.geometry)
+        region = self.region_of(store.FIPS)
+        geographic = store.crs is not None and store.crs.is_geographic
+        transforms, extent = self.transforms(geometry, region, geographic)
+        moved = geometry.copy()
+        for i, m in transforms.items():
+            shapes = geometry[region == i]
+            if geographic:
+                shapes = _unwrap(shapes)
+            moved[region == i] = _affine(
+                shapes, np.array([[m[0], m[1], m[4]], [m[2], m[3], m[5]],
+                                  [0, 0, 1]]))
+        arranged = GeometryStore.from_arrays(store.FIPS, moved, store.crs,
+                                             store.geoFIPS_col)
+        arranged.region = region
+        arranged.transforms = transforms
+        minx, miny, maxx, maxy = extent
+        arranged.frames = [
+            (minx + r.box[0] * (maxx - minx), miny + r.box[1] * (maxy - miny),
+             minx + r.box[2] * (maxx - minx), miny + r.box[3] * (maxy - miny))
+            for i, r in enumerate(self.regions)
+            if self.frame and i in transforms]
+        return arranged
+
+
+def _affine(shapes, matrix):
+    '''Applies a 3 x 3 affine matrix to every coordinate at once'''
+    return shapely.transform(
+        shapes, lambda xy: xy.dot(matrix[:2, :2].T) + matrix[:2, 2])
+
+
+def _unwrap(shapes):
+    '''Moves the parts of a region east of the antimeridian to negative
+    longitudes, if the region spans it'''
+    x0, _, x1, _ = shapely.total_bounds(shapes)
+    if x1 - x0 <= 180:
+        return shapes
+    return shapely.transform(
+        shapes, lambda xy: np.column_stack(
+            [np.where(xy[:, 0] > 0, xy[:, 0] - 360, xy[:, 0]), xy[:, 1]]))
+
+
+# Alaska, Hawaii and Puerto Rico in the empty corners below the contiguous
+# states
+US_INSETS = InsetLayout([
+    Region('Contiguous states', CONTIGUOUS_STATES),
+    Region('Alaska', ['02'], box=(0, 0, .22, .26)),
+    Region('Hawaii', ['15'], box=(.23, 0, .37, .13)),
+    Region('Puerto Rico', ['72'], box=(.86, 0, .95, .06))])
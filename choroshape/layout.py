@@ -0,0 +1,107 @@
+'''Layouts measured once and reused by every map that shares them'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'LayoutTemplate'
+]
+
+import collections
+import functools
+import textwrap
+import threading
+
+# Templates already measured, keyed by LayoutTemplate.key, for the
+# _MAX_LAYOUTS keys used last
+_LAYOUTS = collections.OrderedDict()
+_MAX_LAYOUTS = 64
+_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=256)
+def _wrap(title, ttl_char_limit):
+    '''Breaks a title longer than ttl_char_limit into lines'''
+    if len(title) > ttl_char_limit:
+        return "\n".join(textwrap.wrap(title, width=40,
+                                       break_long_words=False))
+    return title
+
+
+class LayoutTemplate(object):
+
+    def __init__(self, key, ttl_char_limit=55):
+        '''Where the parts of a map go for one geometry extent, figure size,
+        number of legend entries, longest legend label, number of title
+        lines and style. The first map drawn with a template measures the
+        layout; later ones only apply it, so a batch of maps is laid out
+        once and comes out consistent.
+        Attributes:
+            key(tuple): what the layout depends on, see LayoutTemplate.key
+            ttl_char_limit(int): titles longer than this are wrapped
+            subplotpars(dict): axes position found by the tight layout, None
+                until measured
+            legend_box(tuple(float)): x0, x1, y0, y1 of the legend in axes
+                coordinates, padded for the legend title and footnote; None
+                until measured. The right edge is the first map's.
+            '''
+        self.key = key
+        self.ttl_char_limit = ttl_char_limit
+        self.subplotpars = None
+        self.legend_box = None
+
+    @staticmethod
+    def key(chor, fig):
+        '''The layout key of a Choropleth drawn on fig. Labels are counted
+        in characters, not measured, so labels of the same length but
+        different widths share a legend box.'''
+        style = chor.ch_style
+        minx, miny, maxx, maxy = chor.geometry.bounds()
+        aspect = round((maxy - miny) / float(maxx - minx or 1), 6)
+        # A title wrapped to more lines pushes the axes down
+        lines = _wrap(chor.title or '', style.ttl_char_limit).count('\n') + 1
+        # Wider labels widen the legend box
+        label = max([len('%s' % l) for l in chor.area_data.group_names] or
+                    [0])
+        return (aspect, tuple(float(s) for s in fig.get_size_inches()),
+                len(chor.rgbs), label, lines, style.legx, style.legy,
+                style.legend_loc, style.ttlx, style.ttly, style.ttl_align,
+                style.ttl_char_limit)
+
+    @classmethod
+    def get(cls, chor, fig):
+        '''Returns the template for a Choropleth, making it the first time'''
+        key = cls.key(chor, fig)
+        with _LOCK:
+            if key in _LAYOUTS:
+                _LAYOUTS.move_to_end(key)
+            else:
+                _LAYOUTS[key] = cls(key, chor.ch_style.ttl_char_limit)
+                while len(_LAYOUTS) > _MAX_LAYOUTS:
+                    _LAYOUTS.popitem(last=False)
+            return _LAYOUTS[key]
+
+    def apply_subplotpars(self, fig):
+        '''Positions the axes, running the tight layout only the first
+        time. Maps drawn at once in other threads may measure too; they
+        all find the same layout.'''
+        if self.subplotpars is None:
+            fig.tight_layout()
+            pars = fig.subplotpars
+            self.subplotpars = dict(left=pars.left, right=pars.right,
+                                    bottom=pars.bottom, top=pars.top)
+        else:
+            fig.subplots_adjust(**self.subplotpars)
+
+    def measure_legend(self, leg, ax):
+        '''Returns the legend box, measuring leg the first time'''
+        if self.legend_box is None:
+            renderer = ax.figure.canvas.get_renderer()
+            bb = leg.get_window_extent(renderer).transformed(
+                ax.transAxes.inverted())
+            self.legend_box = (bb.x0 + .005, bb.x1 - .005,
+                               bb.y0 - .005, bb.y1 + .005)
+        return self.legend_box
+
+    def wrap_title(self, title):
+        '''Breaks long titles into lines'''
+        return _wrap(title, self.ttl_char_limit)
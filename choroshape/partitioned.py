@@ -0,0 +1,182 @@
+'''Partitioned ingestion for very large datasets, e.g. every block group in
+the US.
+
+The data and the shapes are split by state, the first two digits of their
+FIPS codes. Each state is converted, checked for exceptions and turned into
+ratios on its own, in parallel worker processes, and sends back only its
+per-shape arrays plus a small quantile sketch of its values. The sketches
+are merged into the quantile cutoffs, so no process ever holds more than
+one state's table. AreaPopDataset(..., partitioned=True) uses this.
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'ingest_partitioned',
+    'merge_sketches',
+    'quantile_sketch'
+]
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from six import string_types
+
+from ._lazy import LazyModule
+from .columnar import is_columnar, read_table
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# Points kept in a state's quantile sketch. States with fewer values are
+# summarized exactly; otherwise the rank error is at most 1/SKETCH_SIZE.
+SKETCH_SIZE = 4096
+
+
+def quantile_sketch(values, size=SKETCH_SIZE):
+    '''Summarizes the finite values of a partition for merge_sketches
+    Args:
+        values(numpy.ndarray): values of the partition
+        size(int): most points to keep
+    Returns:
+        sketch(tuple(points, weights, minimum, maximum)): evenly spaced order
+            statistics and the number of values each stands for'''
+    values = np.sort(values[np.isfinite(values)])
+    n = len(values)
+    if n == 0:
+        return np.empty(0), np.empty(0), np.nan, np.nan
+    if n <= size:
+        return values, np.ones(n), values[0], values[-1]
+    picks = ((np.arange(size) + 0.5) * n / size).astype(int)
+    weights = np.full(size, float(n) / size)
+    return values[picks], weights, values[0], values[-1]
+
+
+def merge_sketches(sketches, num_cats, transform=None):
+    '''Finds the cutoffs that split the values of all partitions into
+    num_cats groups of equal size, the way pandas.qcut does
+    Args:
+        sketches(list[tuple]): made by quantile_sketch
+        num_cats(int): number of groups
+        transform(callable): applied to the values first, e.g. scaling and
+            rounding; it must not change their order
+    Returns:
+        bins(numpy.ndarray): num_cats + 1 cutoffs'''
+    sketches = [s for s in sketches if len(s[0])]
+    if not sketches:
+        raise ValueError('There are no values to bin.')
+    if transform is None:
+        transform = np.asarray
+    points = transform(np.concatenate([s[0] for s in sketches]))
+    weights = np.concatenate([s[1] for s in sketches])
+    order = np.argsort(points, kind='mergesort')
+    points = points[order]
+    weights = weights[order]
+    # Rank of each point; for exact sketches these are 0, 1, 2, ...
+    ranks = np.cumsum(weights) - weights / 2.0 - 0.5
+    total = weights.sum()
+    targets = np.linspace(0, 1, num_cats + 1) * (total - 1)
+    bins = np.interp(targets, ranks, points)
+    bins[0] = transform(np.array([s[2] for s in sketches])).min()
+    bins[-1] = transform(np.array([s[3] for s in sketches])).max()
+    return bins
+
+
+def _ingest_partition(dataset, data, FIPS, sketch_size):
+    '''Runs the ingestion steps of AreaPopDataset on one state.
+    Args:
+        dataset(AreaPopDataset): holds the options, not the data
+        data(pandas.DataFrame or str): the state's rows, a csv of them, or a
+            Parquet or Feather file to read only the state's rows from
+        FIPS(numpy.ndarray): FIPS codes of the state's shapes
+    Returns:
+        dict of the state's per-shape arrays and its sketch'''
+    if is_columnar(data):
+        data = read_table(data, dataset.valid_cols, states=[FIPS[0][:2]],
+                          FIPS_col=dataset.FIPS_col)
+    elif isinstance(data, string_types):
+        data = pd.read_csv(data, dtype={dataset.FIPS_col: str})
+    index = pd.Index(data[dataset.FIPS_col])
+    if not index.is_unique:
+        raise ValueError('Data contains duplicate FIPS code values.')
+    dataset.rows = index.get_indexer(FIPS)
+    dataset.matched = dataset.rows >= 0
+    dataset.raw = data.loc[:, dataset.valid_cols[1:]]
+    dataset.exception_masks = {}
+    dataset._find_exceptions()
+    dataset._totals_to_float()
+    dataset._calculate_cat()
+
+    excluded = np.zeros(len(FIPS), dtype=bool)
+    for mask in dataset.exception_masks.values():
+        excluded |= mask
+    sketch = quantile_sketch(dataset.values[~excluded], sketch_size)
+    return {'matched': dataset.matched,
+            'counts': dataset.counts,
+            'exception_masks': dataset.exception_masks,
+            'sketch': sketch}
+
+
+def _partitions(data, FIPS_col, states):
+    if is_columnar(data):
+        # Each worker filters the one file for its state
+        return dict((state, data) for state in states)
+    if isinstance(data, dict):
+        return dict((str(k).zfill(2), v) for k, v in data.items())
+    states = data[FIPS_col].astype(str).str[:2]
+    return dict((state, part) for state, part in data.groupby(states))
+
+
+def ingest_partitioned(dataset, data, n_jobs=None, sketch_size=SKETCH_SIZE):
+    '''Fills in the counts and exception masks of an AreaPopDataset state by
+    state. The values are left to AreaPopDataset, as only the quantile
+    sketches need them per state.
+    Args:
+        dataset(AreaPopDataset): with its options and geometry set
+        data(pandas.DataFrame or str or dict{state FIPS(str):
+            pandas.DataFrame or str}): the whole table, a Parquet or Feather
+            file of it with 5-digit FIPS codes, or each state's table or csv
+            file; files are only read by the worker for that state, and of a
+            whole Parquet file only the row groups of that state
+        n_jobs(int): worker processes, default is the number of CPUs;
+            1 does everything in this process
+        sketch_size(int): see SKETCH_SIZE
+    Returns:
+        sketches(list[tuple]): the quantile sketch of each state'''
+    geo_FIPS = dataset.geometry.FIPS.astype(str)
+    shape_states = pd.Index(geo_FIPS).str[:2].to_numpy()
+    geo_states = set(np.unique(shape_states))
+    parts = _partitions(data, dataset.FIPS_col, geo_states)
+    # Only the options travel to the workers, not the shapes
+    options = dataset.__class__.__new__(dataset.__class__)
+    options.__dict__.update(dataset.__dict__)
+    del options.geometry
+
+    jobs = []
+    for state in sorted(parts):
+        if state not in geo_states:
+            continue  # no shapes to put the data on
+        positions = np.flatnonzero(shape_states == state)
+        jobs.append((positions, (options, parts[state],
+                                 geo_FIPS[positions], sketch_size)))
+
+    if n_jobs == 1 or len(jobs) < 2:
+        results = [_ingest_partition(*args) for _, args in jobs]
+    else:
+        fork = 'fork' in multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if fork else None)
+        with ProcessPoolExecutor(n_jobs, mp_context=context) as pool:
+            results = list(pool.map(_ingest_partition,
+                                    *zip(*[args for _, args in jobs])))
+
+    n = len(geo_FIPS)
+    dataset.matched = np.zeros(n, dtype=bool)
+    dataset.counts = np.full((n, len(dataset.valid_cols) - 1), np.nan)
+    dataset.exception_masks = {}
+    for (positions, _), result in zip(jobs, results):
+        dataset.matched[positions] = result['matched']
+        dataset.counts[positions] = result['counts']
+        for key, mask in result['exception_masks'].items():
+            if key not in dataset.exception_masks:
+                dataset.exception_masks[key] = np.zeros(n, dtype=bool)
+            dataset.exception_masks[key][positions] = mask
+    return [result['sketch'] for result in results]
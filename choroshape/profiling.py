@@ -0,0 +1,148 @@
+'''Per-map profiles, for finding out why one map in a batch is slow.
+
+A MapProfile wraps the work on one map. It either runs cProfile over it
+('deterministic') and writes a pstats file, or samples the Python stack at a
+fixed interval of CPU time ('sampling') and writes collapsed stacks, one
+"frame;frame;frame count" line per distinct stack, which flamegraph.pl,
+speedscope and inferno read as they are. Both are named after the map's
+cat_name, and the top hotspots are written to the 'choroshape' log.
+
+    make_choropleth('data.csv', 'counties.shp', '48', cat_name='poverty',
+                    profile='sampling')
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'MapProfile',
+    'PROFILE_MODES'
+]
+
+import collections
+import cProfile
+import logging
+import os
+import pstats
+import re
+import signal
+import threading
+
+log = logging.getLogger('choroshape')
+
+# Profile modes and the extension of the file each one writes
+PROFILE_MODES = {'deterministic': '.pstats', 'sampling': '.folded'}
+
+
+def _frame_label(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class MapProfile(object):
+
+    def __init__(self, name, mode='deterministic', out_dir='', interval=.001,
+                 top=10):
+        '''Profiles the code run inside a with block.
+        Attributes:
+            name(str): the map's cat_name, used to name the profile file
+            mode(str): 'deterministic' for cProfile or 'sampling' for a
+                stack sampler. Sampling needs signal.setitimer, so it only
+                works in the main thread on Unix; elsewhere the map is
+                profiled deterministically.
+            out_dir(str): directory to write the profile in
+            interval(float): seconds of CPU time between samples
+            top(int): number of hotspots to log
+            path(str): the profile file, set when the block ends
+            hotspots(list[tuple(str, float)]): functions taking the most time
+                of their own, with that time in seconds, slowest first
+            '''
+        if mode not in PROFILE_MODES:
+            raise ValueError('Profile mode must be one of %s, not %r.' % (
+                ', '.join(sorted(PROFILE_MODES)), mode))
+        if mode == 'sampling' and not self._can_sample():
+            log.warning('Sampling needs the main thread and setitimer; '
+                        'profiling %s deterministically instead.', name)
+            mode = 'deterministic'
+        self.name = name or 'map'
+        self.mode = mode
+        self.out_dir = out_dir
+        self.interval = interval
+        self.top = top
+        self.path = None
+        self.hotspots = []
+        self._profiler = None
+        self._stacks = None
+        self._previous = None
+
+    @staticmethod
+    def _can_sample():
+        return (hasattr(signal, 'setitimer') and
+                threading.current_thread() is threading.main_thread())
+
+    def __enter__(self):
+        if self.mode == 'sampling':
+            self._stacks = collections.Counter()
+            self._previous = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == 'sampling':
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous)
+        else:
+            self._profiler.disable()
+        self.save()
+        self.log_hotspots()
+        return False
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        self._stacks[';'.join(reversed(stack))] += 1
+
+    def save(self):
+        '''Writes the profile and finds the hotspots
+        Returns:
+            path(str): the profile file'''
+        filename = re.sub(r'[^\w.-]+', '_', self.name)
+        self.path = os.path.join(self.out_dir,
+                                 filename + PROFILE_MODES[self.mode])
+        if self.mode == 'sampling':
+            with open(self.path, 'w') as f:
+                for stack, count in sorted(self._stacks.items()):
+                    f.write('%s %d\n' % (stack, count))
+            own = collections.Counter()
+            for stack, count in self._stacks.items():
+                own[stack.rsplit(';', 1)[-1]] += count * self.interval
+            self.hotspots = own.most_common(self.top)
+        else:
+            self._profiler.dump_stats(self.path)
+            stats = pstats.Stats(self._profiler).stats
+            own = sorted(((tt, '%s (%s:%d)' % (func, os.path.basename(path),
+                                               line))
+                          for (path, line, func), (_, _, tt, _, _)
+                          in stats.items()), reverse=True)
+            self.hotspots = [(label, tt) for tt, label in own[:self.top]]
+        return self.path
+
+    def total(self):
+        '''Seconds the profile covers; sampled profiles count CPU time'''
+        if self.mode == 'sampling':
+            return sum(self._stacks.values()) * self.interval
+        return sum(st[2] for st in pstats.Stats(self._profiler).stats
+                   .values())
+
+    def log_hotspots(self):
+        '''Writes the top hotspots to the 'choroshape' log'''
+        total = self.total() or 1.0
+        lines = ['%6.3fs %5.1f%%  %s' % (seconds, 100 * seconds / total, label)
+                 for label, seconds in self.hotspots]
+        log.info('Profile of %s (%s, %.3fs) written to %s; top hotspots:\n%s',
+                 self.name, self.mode, self.total(), self.path,
+                 '\n'.join(lines))
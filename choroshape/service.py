@@ -0,0 +1,286 @@
+'''Long-lived render service that keeps geometry warm between map requests.
+
+Requests are queued from an asyncio front end to a bounded pool of renderer
+processes. Each process parses, FIPS-fixes and simplifies the geometry once
+when it starts, so a request only pays for classification and drawing.
+
+Run it from the command line with, e.g.
+    python -m choroshape.service --geometry counties=cb_2014_us_county_500k.shp
+and send one JSON request per line; see RenderService.start_server.
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'RenderService',
+    'render_map'
+]
+
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Request keys passed on to AreaPopDataset; anything else a client sends
+# is refused
+_DATASET_KEYS = ('cat_col', 'total_col', 'title', 'footnote', 'cat_name',
+                'bins', 'num_cats', 'precision', 'percent_format',
+                'exceptions')
+
+# Per-process warm state, filled in by _init_worker
+_GEOMETRY = {}
+_STATE_GEOMETRY = {}
+_STYLES = {}
+
+
+def _load_geometry(spec, simplify_tolerance=None):
+    '''Loads, FIPS-fixes and optionally simplifies one geometry source
+    Args:
+        spec(geopandas.GeoDataFrame or str or dict): a GeoDataFrame that
+            already has a 5-digit 'FIPS' column, a StateIndex, a shapefile,
+            GeoParquet or Feather path, or a dict with the keys 'path',
+            'geoFIPS_col' (default 'COUNTYFP'), 'state_FIPS' (column name or
+            code, default 'STATEFP'), 'geometry_col' (default 'geometry')
+            and 'states' (two digit codes of the states to keep, default
+            all of them)
+        simplify_tolerance(float): tolerance passed to GeoSeries.simplify
+    Returns:
+        geodata(geopandas.GeoDataFrame): with 'FIPS' and 'geometry' columns'''
+    import geopandas as gpd
+    from .choroshape import fix_FIPS, load_geodata
+    from .columnar import is_columnar, read_geodata, table_columns
+    from .shapeindex import StateIndex
+
+    if isinstance(spec, gpd.GeoDataFrame):
+        geodata = spec
+    elif isinstance(spec, StateIndex):
+        geodata = load_geodata(spec, spec.states)
+    else:
+        if not isinstance(spec, dict):
+            spec = {'path': spec}
+        geoFIPS_col = spec.get('geoFIPS_col', 'COUNTYFP')
+        state_FIPS = spec.get('state_FIPS', 'STATEFP')
+        path = os.path.normpath(spec['path'])
+        if spec.get('states') is not None:
+            # load_geodata reads only the states' rows of a columnar file
+            geostate_col = None if ('%s' % state_FIPS).isdigit() \
+                else state_FIPS
+            geodata = load_geodata(path, spec['states'], geoFIPS_col,
+                                   spec.get('geometry_col'), geostate_col)
+        else:
+            if is_columnar(path):
+                names = table_columns(path)
+                geodata = read_geodata(path, [
+                    c for c in [geoFIPS_col, state_FIPS,
+                                spec.get('geometry_col')] if c in names])
+            else:
+                geodata = gpd.GeoDataFrame.from_file(path)
+            if spec.get('geometry_col') is not None:
+                geodata = geodata.set_geometry(spec['geometry_col'])
+            cols = [geoFIPS_col, geodata.geometry.name]
+            if state_FIPS in geodata.columns:
+                cols.append(state_FIPS)
+            geodata = fix_FIPS(geodata[cols].copy(), geoFIPS_col, state_FIPS)
+    geodata = gpd.GeoDataFrame({'FIPS': geodata['FIPS'].values},
+                               geometry=geodata.geometry.values,
+                               crs=geodata.crs)
+    if simplify_tolerance:
+        geodata['geometry'] = geodata.geometry.simplify(
+            simplify_tolerance, preserve_topology=True)
+    return geodata
+
+
+def _init_worker(geometries, simplify_tolerance):
+    '''Warms a renderer process: picks a non-GUI backend and loads every
+    geometry source once'''
+    import matplotlib
+    matplotlib.use('Agg')
+    for name, spec in geometries.items():
+        _GEOMETRY[name] = _load_geometry(spec, simplify_tolerance)
+
+
+def _get_geometry(name, two_digit_state_FIPS=None):
+    '''Returns the warm geometry, filtered to one state if asked'''
+    try:
+        geodata = _GEOMETRY[name]
+    except KeyError:
+        raise KeyError('"%s" is not a loaded geometry.' % name)
+    if two_digit_state_FIPS is None:
+        return geodata
+    state = str(two_digit_state_FIPS).zfill(2)
+    key = (name, state)
+    if key not in _STATE_GEOMETRY:
+        _STATE_GEOMETRY[key] = geodata[
+            geodata['FIPS'].str.startswith(state)].reset_index(drop=True)
+    return _STATE_GEOMETRY[key]
+
+
+def _get_style(county_colors=None, size=None):
+    '''Returns a shared ChoroplethStyle so palettes are built once'''
+    from .choroshape import ChoroplethStyle
+    key = (county_colors, size)
+    if key not in _STYLES:
+        _STYLES[key] = ChoroplethStyle(county_colors, size=size)
+    return _STYLES[key]
+
+
+def render_map(request):
+    '''Renders one map in a warm process and returns the image bytes
+    Args:
+        request(dict): with the keys
+            geometry(str): name of a loaded geometry source
+            data(pandas.DataFrame or list[dict] or dict[str, list]):
+                county data with a FIPS column
+            format(str): 'png' (default) or 'svg' or any matplotlib format
+            state_FIPS(str): optional 2-digit code to draw only one state
+            colors(str), size(str or int): ChoroplethStyle options
+            FIPS_col(str): FIPS column of the data, default 'FIPS'
+            cat_col, total_col, title, footnote, cat_name, bins, num_cats,
+            precision, percent_format, exceptions: AreaPopDataset options
+    Returns:
+        image(bytes)'''
+    import pandas as pd
+    from .choroshape import fix_FIPS, AreaPopDataset, Choropleth
+
+    request = dict(request)
+    allowed = set(_DATASET_KEYS) | set(['format', 'geometry', 'state_FIPS',
+                                        'colors', 'size', 'data', 'FIPS_col'])
+    unknown = sorted(set(request) - allowed)
+    if unknown:
+        raise ValueError('Unknown request key(s): %s. Accepted keys are %s.'
+                         % (', '.join(unknown), ', '.join(sorted(allowed))))
+    fmt = request.pop('format', 'png')
+    geodata = _get_geometry(request.pop('geometry'),
+                            request.pop('state_FIPS', None))
+    ch_style = _get_style(request.pop('colors', None),
+                          request.pop('size', None))
+    data = request.pop('data')
+    if not isinstance(data, pd.DataFrame):
+        data = pd.DataFrame(data)
+    FIPS_col = request.pop('FIPS_col', 'FIPS')
+    data = fix_FIPS(data.copy(), FIPS_col)
+
+    apd = AreaPopDataset(data, geodata, FIPS_col, 'FIPS', **request)
+    chor = Choropleth(apd, ch_style, savepdf=False)
+    chor.plot()
+    return chor.to_bytes(fmt)
+
+
+class RenderService(object):
+
+    def __init__(self, geometries, max_workers=None, max_pending=64,
+                 simplify_tolerance=None, mp_context=None):
+        '''Renders maps on demand in a pool of warm processes
+        Attributes:
+            geometries(dict{name(str): spec}): geometry sources to keep
+                loaded, see _load_geometry for the spec formats
+            max_workers(int): number of renderer processes
+            max_pending(int): requests allowed in flight at once; further
+                requests wait in the asyncio front end
+            simplify_tolerance(float): simplify every geometry once at start
+            mp_context(multiprocessing context): passed to the process pool
+            '''
+        self.geometries = geometries
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.simplify_tolerance = simplify_tolerance
+        self.mp_context = mp_context
+        self._executor = None
+        # The semaphore limiting requests in flight, and its event loop
+        self._slots = None
+        self._slots_loop = None
+
+    def start(self):
+        '''Starts the renderer processes'''
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=self.mp_context,
+                initializer=_init_worker,
+                initargs=(self.geometries, self.simplify_tolerance))
+        return self
+
+    def close(self):
+        '''Stops the renderer processes'''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        # Waiting for the workers to exit would block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def render(self, **request):
+        '''Renders a map and returns its bytes, see render_map for the
+        request keys'''
+        self.start()
+        loop = asyncio.get_running_loop()
+        # A semaphore belongs to one event loop; a service used again from
+        # another asyncio.run gets a new one
+        if self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._slots_loop = loop
+        async with self._slots:
+            return await loop.run_in_executor(self._executor, render_map,
+                                              request)
+
+    async def _handle(self, reader, writer):
+        '''Serves one connection: each line is a JSON request. Each reply is
+        a JSON header line followed by header['length'] bytes of image.'''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    image = await self.render(**json.loads(line))
+                    header = {'status': 'ok', 'length': len(image)}
+                except Exception as e:
+                    image = b''
+                    header = {'status': 'error', 'length': 0,
+                              'message': '%s: %s' % (type(e).__name__, e)}
+                writer.write(json.dumps(header).encode('utf-8') + b'\n')
+                writer.write(image)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start_server(self, host='127.0.0.1', port=8765):
+        '''Starts listening for JSON-line requests, returns the
+        asyncio.Server'''
+        self.start()
+        return await asyncio.start_server(self._handle, host, port)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Serve choropleth maps from warm renderer processes.')
+    parser.add_argument('--geometry', action='append', required=True,
+                        metavar='NAME=SHAPEFILE',
+                        help='geometry source to keep loaded')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--simplify', type=float, default=None,
+                        help='simplification tolerance in map units')
+    args = parser.parse_args(argv)
+
+    geometries = dict(g.split('=', 1) for g in args.geometry)
+    service = RenderService(geometries, max_workers=args.workers,
+                            simplify_tolerance=args.simplify)
+
+    async def run():
+        server = await service.start_server(args.host, args.port)
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(run())
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''State-partitioned index of a national shapefile.
+
+Drawing one state from a national county or tract shapefile means parsing
+every feature in it. A StateIndex reads the shapefile once, fixes the FIPS
+codes the way load_geodata does, and writes the shapes sorted by state into
+one classification-style file (see classfile.py) with the row range of each
+state. Loading a state then maps the file and decodes only that state's
+shapes. The index is rebuilt when the shapefile changes.
+
+    index = StateIndex('tl_2016_us_county.shp', geostate_col='STATEFP')
+    for state in ['06', '48']:
+        make_choropleth('data_%s.csv' % state, index, state)
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'StateIndex'
+]
+
+import os
+
+from ._lazy import LazyModule
+from .classfile import read_arrays, write_arrays
+
+gpd = LazyModule('geopandas')
+np = LazyModule('numpy')
+shapely = LazyModule('shapely')
+
+
+class StateIndex(object):
+
+    def __init__(self, shpfile, index_path=None, geoFIPS_col=None,
+                 geometry_col=None, geostate_col=None):
+        '''Opens the index of a shapefile, building it first if it is missing
+        or older than the shapefile.
+        Attributes:
+            shpfile(str): normed path name to a national shapefile
+            index_path(str): the index file, default is the shapefile's name
+                with the extension '.states'
+            geoFIPS_col, geometry_col, geostate_col(str): columns of the
+                shapefile, see load_geodata
+            states(list[str]): two digit FIPS codes of the states in the
+                shapefile
+            '''
+        self.shpfile = os.path.abspath(os.path.normpath(shpfile))
+        if index_path is None:
+            index_path = os.path.splitext(self.shpfile)[0] + '.states'
+        self.index_path = index_path
+        self.columns = [geoFIPS_col, geometry_col, geostate_col]
+        self._loaded = {}
+        if not self._is_current():
+            self.build()
+        self._arrays, self._meta = read_arrays(self.index_path)
+        self.states = sorted(self._meta['states'])
+
+    def _source(self):
+        st = os.stat(self.shpfile)
+        return {'path': self.shpfile, 'size': st.st_size,
+                'mtime': st.st_mtime, 'columns': self.columns}
+
+    def _is_current(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            meta = read_arrays(self.index_path)[1]
+        except ValueError:
+            return False
+        return meta.get('source') == self._source()
+
+    def build(self):
+        '''Reads the whole shapefile once and writes the index'''
+        from .choroshape import fix_FIPS
+        geoFIPS_col, geometry_col, geostate_col = self.columns
+        geodata = gpd.GeoDataFrame.from_file(self.shpfile)
+        crs = geodata.crs.to_wkt() if geodata.crs is not None else None
+
+        # As in load_geodata, but for every state at once. Without a state
+        # column the codes must already have 5 digits.
+        codes = geodata[[geoFIPS_col or 'COUNTYFP']].copy()
+        codes.columns = ['FIPS']
+        if geostate_col is not None:
+            codes['state_FIPS'] = geodata[geostate_col]
+        codes = fix_FIPS(codes, 'FIPS',
+                         'state_FIPS' if geostate_col is not None else None)
+        geometry = gpd.GeoSeries(geodata[geometry_col or 'geometry']).values
+        keep = (~geometry.isna()).astype(bool)
+        FIPS = codes['FIPS'].to_numpy().astype(str)[keep]
+        order = np.argsort(FIPS, kind='mergesort')
+        FIPS = FIPS[order]
+        wkb = shapely.to_wkb(geometry[keep][order])
+        sizes = np.array([len(w) for w in wkb], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+        states, starts = np.unique(FIPS.astype('U2'), return_index=True)
+        stops = np.append(starts[1:], len(FIPS))
+        meta = {'source': self._source(), 'crs': crs,
+                'states': dict((s, [int(a), int(b)])
+                               for s, a, b in zip(states, starts, stops))}
+        write_arrays(self.index_path,
+                     [('FIPS', FIPS.astype(np.bytes_)),
+                      ('offsets', offsets),
+                      ('wkb', np.frombuffer(b''.join(wkb), dtype=np.uint8))],
+                     meta)
+
+    def load(self, two_digit_state_FIPS):
+        '''The shapes of one state, like load_geodata returns them. Each
+        state is decoded once and the same GeoDataFrame returned after that,
+        so datasets made from it share one GeometryStore.
+        Args:
+            two_digit_state_FIPS(str or int): two digit state FIPS code
+        Returns:
+            geodata(geopandas.GeoDataFrame): with 'FIPS' and 'geometry'
+                columns'''
+        state = str(two_digit_state_FIPS).zfill(2)
+        if state not in self._loaded:
+            start, stop = self._meta['states'].get(state, [0, 0])
+            offsets = self._arrays['offsets']
+            blob = self._arrays['wkb']
+            wkb = [blob[offsets[i]:offsets[i + 1]].tobytes()
+                   for i in range(start, stop)]
+            self._loaded[state] = gpd.GeoDataFrame(
+                {'FIPS': self._arrays['FIPS'][start:stop].astype(str)
+                 .astype(object)},
+                geometry=shapely.from_wkb(np.array(wkb, dtype=object)),
+                crs=self._meta['crs'])
+        return self._loaded[state]
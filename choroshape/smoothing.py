@@ -0,0 +1,152 @@
+'''Rate stabilization for areas with small populations.
+
+A raw ratio like deaths / population swings wildly in a county of a few
+hundred people. Before binning, AreaPopDataset(..., smoothing=...) can
+replace the ratios with:
+    'eb': empirical Bayes estimates, shrunk towards the overall rate the
+        more the smaller the population
+    'spatial': the rate of each area pooled with its neighbors
+    'spatial_eb': empirical Bayes estimates shrunk towards the rate of each
+        area's neighborhood
+Neighborhoods come from GeometryStore.adjacency, built once per geometry.
+Every method is a few sparse matrix products, so all US tracts take
+seconds.
+
+With ACS margins of error, ratio_cv gives the coefficient of variation of
+each estimate, and AreaPopDataset(..., moe_cols=...) puts estimates less
+reliable than max_cv in an exception group of their own.
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'SMOOTHING_METHODS',
+    'empirical_bayes',
+    'neighborhood_weights',
+    'ratio_cv',
+    'smooth_rates',
+    'spatial_rate'
+]
+
+from ._lazy import LazyModule
+
+np = LazyModule('numpy')
+
+SMOOTHING_METHODS = ['eb', 'spatial', 'spatial_eb']
+
+# ACS margins of error are for a 90 percent confidence level
+ACS_Z = 1.645
+
+
+def neighborhood_weights(geometry):
+    '''Each shape's neighborhood: itself and the shapes it touches
+    Args:
+        geometry(GeometryStore)
+    Returns:
+        weights(scipy.sparse.csr_matrix): n x n matrix of ones'''
+    from scipy import sparse
+    adjacency = geometry.adjacency()
+    return (adjacency + sparse.identity(adjacency.shape[0],
+                                        format='csr')).tocsr()
+
+
+def _divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), 0.0)
+
+
+def spatial_rate(events, population, weights):
+    '''Pools each area with its neighborhood
+    Args:
+        events(numpy.ndarray): counts, e.g. of people in the category
+        population(numpy.ndarray): population at risk of each area
+        weights(scipy.sparse matrix): neighborhoods, see
+            neighborhood_weights
+    Returns:
+        rates(numpy.ndarray)'''
+    return _divide(weights.dot(events), weights.dot(population))
+
+
+def empirical_bayes(events, population, weights=None):
+    '''Marshall's empirical Bayes rates: each raw rate is weighted against a
+    reference rate by how much of its variance is more than chance
+    Args:
+        events, population(numpy.ndarray): see spatial_rate; areas with no
+            population are ignored and get the reference rate
+        weights(scipy.sparse matrix): neighborhoods to find local reference
+            rates in, None for one global rate
+    Returns:
+        rates(numpy.ndarray)'''
+    events = np.asarray(events, dtype=float)
+    population = np.asarray(population, dtype=float)
+    populated = (population > 0).astype(float)
+    rates = _divide(events, population)
+    if weights is None:
+        sum_events = events.sum()
+        sum_pop = population.sum()
+        ref = _divide(sum_events, sum_pop)
+        variance = _divide((population * (rates - ref) ** 2).sum(), sum_pop)
+        mean_pop = _divide(sum_pop, populated.sum())
+    else:
+        # The neighborhood sums of n * (r - m)**2, expanded so that each
+        # is one sparse product
+        sum_events = weights.dot(events)
+        sum_pop = weights.dot(population)
+        ref = _divide(sum_events, sum_pop)
+        variance = _divide(weights.dot(population * rates ** 2) -
+                           2 * ref * sum_events + ref ** 2 * sum_pop,
+                           sum_pop)
+        mean_pop = _divide(sum_pop, weights.dot(populated))
+    prior = np.maximum(variance - _divide(ref, mean_pop), 0)
+    shrink = np.where(population > 0,
+                      _divide(prior, prior + _divide(ref, population)), 0)
+    return shrink * rates + (1 - shrink) * ref
+
+
+def smooth_rates(events, population, method, geometry=None):
+    '''Runs one of SMOOTHING_METHODS
+    Args:
+        events, population(numpy.ndarray): see spatial_rate
+        method(str): 'eb', 'spatial' or 'spatial_eb'
+        geometry(GeometryStore): the shapes, for the spatial methods
+    Returns:
+        rates(numpy.ndarray)'''
+    if method not in SMOOTHING_METHODS:
+        raise ValueError('Smoothing must be one of %s, not %r.' % (
+            ', '.join(SMOOTHING_METHODS), method))
+    if method == 'eb':
+        return empirical_bayes(events, population)
+    try:
+        weights = neighborhood_weights(geometry)
+    except ImportError:
+        raise ImportError('Spatial smoothing requires scipy.')
+    if method == 'spatial':
+        return spatial_rate(events, population, weights)
+    return empirical_bayes(events, population, weights)
+
+
+def ratio_cv(estimate, moe, total=None, total_moe=None):
+    '''Coefficient of variation of ACS estimates, or of their ratio to a
+    total, from the margins of error (Census Bureau formulas for derived
+    proportions, falling back to the one for ratios where the former fails)
+    Args:
+        estimate, moe(numpy.ndarray): the estimates and their margins
+        total, total_moe(numpy.ndarray): the totals and their margins, None
+            for the estimates on their own. A missing total margin counts as
+            zero, as for a total that is not sampled.
+    Returns:
+        cv(numpy.ndarray): standard error over the estimate; inf for zero
+            estimates, NaN where a margin is missing'''
+    se = np.asarray(moe, dtype=float) / ACS_Z
+    estimate = np.asarray(estimate, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if total is None:
+            return se / np.abs(estimate)
+        total = np.asarray(total, dtype=float)
+        total_se = np.zeros(len(total)) if total_moe is None else \
+            np.nan_to_num(np.asarray(total_moe, dtype=float) / ACS_Z)
+        ratio = estimate / total
+        square = se ** 2 - ratio ** 2 * total_se ** 2
+        square = np.where(square < 0, se ** 2 + ratio ** 2 * total_se ** 2,
+                          square)
+        return np.sqrt(square) / total / np.abs(ratio)
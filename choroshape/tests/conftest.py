@@ -0,0 +1,84 @@
+'''Shared offline fixtures'''
+import matplotlib
+matplotlib.use('Agg')
+
+from choroshape import AreaPopDataset
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import zlib
+from shapely.geometry import Polygon, box
+
+
+def grid_geodata(n=20, ncols=5, state='48'):
+    '''GeoDataFrame of n square counties laid out in a grid'''
+    FIPS = ['%s%03d' % (state, 2*i + 1) for i in range(n)]
+    return gpd.GeoDataFrame(
+        {'FIPS': FIPS},
+        geometry=[box(i % ncols, i // ncols, i % ncols + 1, i // ncols + 1)
+                  for i in range(n)])
+
+
+def synthetic_counties(states=('48',), n=40, seed=0):
+    '''GeoDataFrame like a national TIGER county shapefile, with STATEFP,
+    COUNTYFP, NAME and geometry columns. Each state is a grid of n counties
+    with jittered corners, so neighbors share edges but shapes differ. The
+    same arguments always give the same shapes.'''
+    rng = np.random.RandomState(seed)
+    ncols = int(np.ceil(np.sqrt(n)))
+    nrows = int(np.ceil(float(n) / ncols))
+    records = []
+    for k, state in enumerate(states):
+        corners = np.stack(np.meshgrid(np.arange(ncols + 1.0),
+                                       np.arange(nrows + 1.0)), axis=-1)
+        corners += rng.uniform(-.3, .3, corners.shape)
+        corners[..., 0] += k * (ncols + 2)
+        for i in range(n):
+            r, c = divmod(i, ncols)
+            records.append({
+                'STATEFP': state, 'COUNTYFP': '%03d' % (2*i + 1),
+                'NAME': 'County %d' % (2*i + 1),
+                'geometry': Polygon([corners[r, c], corners[r, c+1],
+                                     corners[r+1, c+1], corners[r+1, c]])})
+    return gpd.GeoDataFrame(records, geometry='geometry')
+
+
+def synthetic_acs(geodf, table_code, label, suppress=0.0,
+                  markers=('S',)):
+    '''Table like the census API returns for an ACS estimate: NAME, the
+    estimate as strings, state and county. B01001_001E is the total
+    population; any other table is a share of it, fixed by its code.
+    Args:
+        geodf(geopandas.GeoDataFrame): made by synthetic_counties
+        table_code(str): ACS table code
+        label(str): name of the estimate column
+        suppress(float): share of estimates replaced by a marker
+        markers(tuple[str]): suppression markers to use'''
+    population = np.random.RandomState(0).lognormal(
+        9, 1.2, len(geodf)).astype(int) + 50
+    estimate = population
+    seed = zlib.crc32(table_code.encode('utf-8')) % 2**31
+    rng = np.random.RandomState(seed)
+    if table_code != 'B01001_001E':
+        share = rng.uniform(.02, .4)
+        estimate = rng.binomial(population, share)
+    df = pd.DataFrame({'NAME': geodf['NAME'].values,
+                       label: estimate.astype(str).astype(object),
+                       'state': geodf['STATEFP'].values,
+                       'county': geodf['COUNTYFP'].values})
+    hidden = rng.uniform(size=len(df)) < suppress
+    df.loc[hidden, label] = rng.choice(list(markers), hidden.sum())
+    return df
+
+
+@pytest.fixture
+def make_dataset():
+    '''Factory for a small AreaPopDataset on a grid of square counties'''
+    def make(title='Test map', bins=None, cat_name='test_map'):
+        geodf = grid_geodata()
+        df = pd.DataFrame({'FIPS': geodf['FIPS'],
+                           'category': np.arange(len(geodf)) * 5.0 + 2})
+        return AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='category',
+                              cat_name=cat_name, title=title, bins=bins)
+    return make
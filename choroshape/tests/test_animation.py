@@ -0,0 +1,66 @@
+'''Tests for animated time-series maps'''
+from choroshape import *
+from choroshape.choroshape import plt
+from conftest import grid_geodata
+from PIL import Image
+import matplotlib
+import matplotlib.figure
+import numpy as np
+import pandas as pd
+import pytest
+import shutil
+
+YEARS = ['2011', '2012', '2013']
+
+
+def make_years():
+    geodf = grid_geodata()
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'FIPS': geodf['FIPS']})
+    for year in YEARS:
+        df[year] = rng.uniform(-10, 10, len(df))
+    df.loc[3, '2012'] = np.nan
+    # The last year repeats the first, under the same title
+    df['2013'] = df['2011']
+    return MultiIndicatorDataset(df, geodf, 'FIPS', 'FIPS', YEARS,
+                                 titles=['Change', '2012', 'Change'],
+                                 bins=[-5, 0, 5])
+
+
+def test_frames_from_one_figure(monkeypatch):
+    anim = ChoroplethAnimation(make_years(), cat_name='change')
+    made = []
+    init = matplotlib.figure.Figure.__init__
+
+    def counting_init(self, *args, **kwargs):
+        made.append(self)
+        init(self, *args, **kwargs)
+    monkeypatch.setattr(matplotlib.figure.Figure, '__init__', counting_init)
+    plt.close('all')
+    images = list(anim.images())
+    assert len(made) == 1 and not plt.get_fignums()
+    assert len(images) == 3 and images[0].shape[2] == 3
+    assert (images[0] == images[2]).all()
+    assert (images[0] != images[1]).any()
+
+
+def test_save_gif_and_apng(tmpdir):
+    anim = ChoroplethAnimation(make_years(), out_path=str(tmpdir),
+                               cat_name='change', fps=2)
+    paths = anim.save(formats=['gif', 'apng'])
+    assert paths == {'gif': str(tmpdir.join('change.gif')),
+                     'apng': str(tmpdir.join('change.png'))}
+    for path in paths.values():
+        im = Image.open(path)
+        assert im.n_frames == 3
+        assert im.info['duration'] == 500
+
+
+@pytest.mark.skipif(
+    shutil.which(matplotlib.rcParams['animation.ffmpeg_path']) is None,
+    reason='needs ffmpeg')
+def test_save_mp4(tmpdir):
+    anim = ChoroplethAnimation(make_years(), out_path=str(tmpdir),
+                               cat_name='change')
+    assert anim.save(formats='mp4') == str(tmpdir.join('change.mp4'))
+    assert tmpdir.join('change.mp4').size() > 0
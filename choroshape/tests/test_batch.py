@@ -0,0 +1,76 @@
+'''Tests for memory budgets, spilling and worker recycling in batches'''
+from choroshape.batch import MemoryBudget, SpilledFrame, rss_mb
+from choroshape.cli import main
+from conftest import grid_geodata
+from test_cli import write_inputs
+import json
+import numpy as np
+import os
+import pandas as pd
+
+
+def test_spill_round_trip(tmpdir):
+    geodf = grid_geodata().set_crs('EPSG:3083')
+    geodf['value'] = np.arange(20) / 3.0
+    geodf.loc[2, 'value'] = np.nan
+    geodf['note'] = ['S', None] + ['%d' % i for i in range(18)]
+    geodf.index = geodf.index + 100
+    budget = MemoryBudget(spill_dir=str(tmpdir.join('spill')))
+    spilled = budget.spill(geodf, 'counties 48')
+    assert isinstance(spilled, SpilledFrame)
+    # Read back from the file alone, as a worker does
+    back = SpilledFrame(spilled.path).load()
+    assert list(back.columns) == list(geodf.columns)
+    assert back.crs == geodf.crs
+    assert (back['FIPS'] == geodf['FIPS'].values).all()
+    assert back.geometry.geom_equals(geodf.geometry.reset_index(drop=True)
+                                     ).all()
+    assert np.array_equal(back['value'], geodf['value'], equal_nan=True)
+    assert back['note'].tolist() == geodf['note'].tolist()
+    data = pd.DataFrame({'FIPS': geodf['FIPS'], 'total': 1.0})
+    assert budget.spill(data, 'data').load().equals(data.reset_index(
+        drop=True))
+    assert 'spill' in budget.stages and budget.stages['spill'][0] == 2
+    budget.cleanup()
+    assert not os.path.exists(spilled.path)
+
+
+def test_stages():
+    budget = MemoryBudget(limit_mb=rss_mb() + 1e6)
+    with budget.stage('big'):
+        block = np.ones(20 * 1024 * 1024 // 8)
+    assert budget.stages['big'][1] > 10 and not budget.over()
+    del block
+    assert MemoryBudget(limit_mb=1).over()
+    assert budget.report()[0].startswith('big')
+
+
+def test_cli_spills_and_recycles(tmpdir, capsys):
+    write_inputs(tmpdir)
+    manifest = {'defaults': {'shapefile': 'counties.shp', 'state_FIPS': 48,
+                             'out_path': '.'},
+                'maps': [{'data': 'data.csv'}, {'data': 'counts.csv'},
+                         {'data': 'data.csv', 'cat_name': 'again'}]}
+    tmpdir.join('maps.json').write(json.dumps(manifest))
+    spill_dir = tmpdir.join('spill')
+    args = [str(tmpdir.join('maps.json')), '--memory-mb', '1',
+            '--spill-dir', str(spill_dir)]
+    assert main(args + ['-j', '1']) == 0
+    err = capsys.readouterr().err
+    assert '3 maps (0 cached, 0 failed)' in err
+    assert 'Memory by stage, 3 input(s) spilled' in err
+    assert 'render' in err
+    # Spilled inputs are gone once their maps are done
+    assert spill_dir.listdir() == []
+    for name in ['data.png', 'counts.png', 'again.png']:
+        assert os.path.exists(str(tmpdir.join(name)))
+
+    assert main([str(tmpdir.join('maps.json')), '-j', '1',
+                 '--max-tasks-per-child', '1']) == 0
+    err = capsys.readouterr().err
+    assert err.count('Replacing worker processes (maps per worker)') == 2
+    assert '3 maps (0 cached, 0 failed)' in err
+    assert main([str(tmpdir.join('maps.json')), '-j', '2',
+                 '--max-worker-mb', '1']) == 0
+    assert 'Replacing worker processes (memory)' in \
+        capsys.readouterr().err
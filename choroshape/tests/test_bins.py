@@ -0,0 +1,67 @@
+'''Tests for batched custom bins and their scores'''
+from choroshape import *
+from choroshape.choroshape import bin_labels
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_batch_rows_match_get_custom_bins():
+    levels = [.4, 1, 2.05, 20]
+    difs = [.6, .1, .0002]
+    for num in [3, 5, 6, 20]:
+        for direction in [None, 'pos']:
+            for precision in [0, 1, 2]:
+                bins = get_custom_bins_batch(
+                    np.repeat(levels, len(difs)), np.tile(difs, len(levels)),
+                    num, direction, precision)
+                assert bins.shape == (len(levels) * len(difs), num + 1)
+                expected = [get_custom_bins(level, num, dif, direction,
+                                            precision)
+                            for level in levels for dif in difs]
+                assert bins.tolist() == expected
+                labels = bin_labels_batch(bins, precision, True)
+                assert labels.tolist() == [bin_labels(b, precision, True)
+                                           for b in expected]
+
+
+def test_batch_valerr():
+    with pytest.raises(ValueError) as excinfo:
+        get_custom_bins_batch([5, 0])
+    assert 'less than or equal to zero' in str(excinfo.value)
+
+
+def test_scores_match_pandas():
+    rng = np.random.RandomState(0)
+    values = np.concatenate([rng.uniform(0, 40, 200), [np.nan, 250]])
+    values[:5] = [0, 10, 12, 15, 20]  # on the cutoffs
+    bins = get_custom_bins_batch([10, 12, 15], [.25, .3, .5])
+    scores = score_bins(values, bins)
+    for i, row in enumerate(bins):
+        groups = pd.cut(pd.Series(values), row, include_lowest=True,
+                        labels=False)
+        inside = pd.Series(values)[groups.notnull()]
+        counts = groups.value_counts().reindex(range(len(row) - 1),
+                                               fill_value=0)
+        assert scores['counts'][i].tolist() == counts.tolist()
+        within = inside.groupby(groups).apply(
+            lambda g: ((g - g.mean()) ** 2).sum()).sum()
+        total = ((inside - inside.mean()) ** 2).sum()
+        assert np.isclose(scores['gvf'][i], 1 - within / total)
+        shares = counts[counts > 0] / float(counts.sum())
+        assert np.isclose(scores['balance'][i],
+                          -(shares * np.log(shares)).sum() / np.log(4))
+        assert np.isclose(scores['coverage'][i], len(inside) / 201.0)
+
+
+def test_best_custom_bins():
+    rng = np.random.RandomState(1)
+    values = np.concatenate([rng.normal(5, .5, 50), rng.normal(12, .5, 50),
+                             rng.normal(30, .5, 50)])
+    bins, scores = best_custom_bins(values, np.arange(2, 30, .5),
+                                    [.1, .3, .5, .7], num_cats=3)
+    assert 5.5 < bins[1] < 11.5 and 12.5 < bins[2] < 29.5
+    assert scores['gvf'] > .99
+    # Balance can rule out the best fit
+    with pytest.raises(ValueError):
+        best_custom_bins(values, [2], [.1], num_cats=3, min_balance=.9)
@@ -0,0 +1,62 @@
+'''Tests for the rendered-map cache'''
+from choroshape import *
+import os
+
+
+def test_render_cache_hit(tmpdir, make_dataset):
+    cache = RenderCache(str(tmpdir.join('cache')))
+    out_path = str(tmpdir)
+    chor = Choropleth(make_dataset(), out_path=out_path, cache=cache)
+    chor.plot()
+    outfile = os.path.join(out_path, 'test_map.png')
+    assert os.path.exists(outfile)
+    assert cache.misses == 1 and cache.hits == 0
+    first = open(outfile, 'rb').read()
+    os.remove(outfile)
+
+    chor = Choropleth(make_dataset(), out_path=out_path, cache=cache)
+    chor.plot()
+    assert cache.hits == 1
+    assert open(outfile, 'rb').read() == first
+
+
+def test_render_cache_evicted_after_check(tmpdir, make_dataset, monkeypatch):
+    cache = RenderCache(str(tmpdir.join('cache')))
+    Choropleth(make_dataset(), out_path=str(tmpdir), cache=cache).plot()
+    first = tmpdir.join('test_map.png').read_binary()
+    contains = cache.contains
+
+    def evicting(key, ext):
+        found = contains(key, ext)
+        cache.clear()  # e.g. by another process
+        return found
+    monkeypatch.setattr(cache, 'contains', evicting)
+    chor = Choropleth(make_dataset(), out_path=str(tmpdir), cache=cache)
+    chor.plot()
+    assert cache.hits == 0 and chor.ax is not None
+    assert tmpdir.join('test_map.png').read_binary() == first
+
+
+def test_render_cache_key(make_dataset):
+    key = Choropleth(make_dataset(), savepdf=False).cache_key()
+    assert key == Choropleth(make_dataset(), savepdf=False).cache_key()
+    assert key != Choropleth(make_dataset(title='Other'),
+                             savepdf=False).cache_key()
+    assert key != Choropleth(make_dataset(bins=[0, 20, 50, 100]),
+                             savepdf=False).cache_key()
+    assert key != Choropleth(make_dataset(), 'reds',
+                             savepdf=False).cache_key()
+
+
+def test_render_cache_eviction(tmpdir):
+    cache = RenderCache(str(tmpdir), max_bytes=250)
+    cache.put('a', 'png', b'x' * 100)
+    cache.put('b', 'png', b'x' * 100)
+    os.utime(cache.path_for('a', 'png'), (0, 0))
+    os.utime(cache.path_for('b', 'png'), (1, 1))
+    assert cache.get('a', 'png') is not None  # a is now the newest
+    cache.put('c', 'png', b'x' * 100)
+    assert cache.get('b', 'png') is None
+    assert cache.get('a', 'png') is not None
+    assert cache.get('c', 'png') is not None
+    assert cache.size() <= 250
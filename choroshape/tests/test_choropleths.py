@@ -1,6 +1,8 @@
 '''This is a testing script for choropleth_objects'''
 from choroshape import *
 from choroshape.choroshape import round_py2
+from conftest import grid_geodata, synthetic_acs, synthetic_counties
+import matplotlib
 import pandas as pd
 import numpy as np
 import geopandas as gpd
@@ -10,6 +12,7 @@ import ast
 import io
 import zipfile
 from six import string_types
+import pickle
 import pytest
 import json
 import re
@@ -23,6 +26,11 @@ except ImportError:
 #Let's start by making some datasets for global testing using the ACS API
 mytoken = ''  # Put your token here
 OUTPATH = os.path.expanduser('~/Desktop/Example_Files/Test/')
+# The census is only called when this is set; otherwise the same tables and
+# shapefiles are made up locally
+ONLINE = bool(os.environ.get('CHOROSHAPE_ONLINE_TESTS'))
+STATES = ['MA', 'MI', 'CA', 'CO', 'NY', 'MD']
+COUNTIES = synthetic_counties([us.states.lookup(s).fips for s in STATES])
 
 
 def make_url(table_code, mytoken=mytoken):
@@ -50,11 +58,17 @@ def census_call(url, table_code, label='category'):
     return df
 
 
+def acs_table(table_code, label='category'):
+    '''An ACS table for every county, from the census or made up'''
+    if ONLINE:
+        return census_call(make_url(table_code), table_code, label)
+    return synthetic_acs(COUNTIES, table_code, label)
+
+
 @pytest.fixture(scope="module")
 def create_totaldf():
     total_code = 'B01001_001E'
-    total_url = make_url(total_code)
-    return census_call(total_url, total_code, 'total_pop').iloc[:, 1:]
+    return acs_table(total_code, 'total_pop').iloc[:, 1:]
 
 
 # Creates a dict for storing the DataFrames
@@ -68,9 +82,8 @@ def create_data_dict(create_totaldf):
                   'B06008_002E': 'Never married'}
     df_dict = {}
     for key in table_dict:
-        url = make_url(key)
         label = table_dict[key]
-        df = census_call(url, key, label)
+        df = acs_table(key, label)
         # Merges with the total df
         df = pd.merge(df_total, df, how='inner', on=['state', 'county'])
         df = df[['NAME', 'state', 'county', label, 'total_pop']]
@@ -86,9 +99,13 @@ def create_data_dict(create_totaldf):
 
 # Used this bit to download shapefiles from Tiger
 @pytest.fixture(scope="module")
-def create_shape_files():
-    states = ['MA', 'MI', 'CA', 'CO', 'NY', 'MD']
+def create_shape_files(tmpdir_factory):
+    states = STATES
     shapefile_lookups = {}
+    if not ONLINE:
+        fn = str(tmpdir_factory.mktemp('shapefiles').join('counties.shp'))
+        COUNTIES.to_file(fn)
+        return dict((state, fn) for state in states)
     for state in states:
         remotezip = urllib.urlopen('http://www2.census.gov/geo/tiger/' +\
                                    'GENZ2014/shp/cb_2014_us_county_500k.zip')
@@ -289,3 +306,82 @@ def test_make_choropleth(create_data_dict, create_shape_files):
                             title=key, footnote='Made for testing',
                             cat_name=name,
                             geoFIPS_col='COUNTYFP10', geometry_col=None)
+
+
+def test_area_pop_data_shares_geometry():
+    geodf = grid_geodata()
+    df = pd.DataFrame({'FIPS': geodf['FIPS'][2:],
+                       'category': np.arange(18) + 1.0,
+                       'total': ['1,000'] * 18})
+    apd = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='category',
+                         total_col='total', percent_format=True)
+    apd2 = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='category')
+    # Both datasets refer to the same shapes, nothing is copied
+    assert apd.geometry is apd2.geometry
+    assert apd.data.geometry.values[5] is geodf.geometry.values[5]
+    assert apd.values.dtype == np.float32 and apd.groups.dtype == np.int8
+    assert (apd.groups[:2] == 0).all() and np.isnan(apd.values[:2]).all()
+    np.testing.assert_allclose(apd.values[2:], (np.arange(18) + 1.0) / 10,
+                               rtol=1e-6)
+    data = apd.data
+    assert list(data['FIPS']) == list(geodf['FIPS'])
+    assert data['group'].isnull().sum() == 2
+    assert set(data['labels'].dropna()) == set(apd.group_names)
+
+    with pytest.raises(ValueError) as excinfo:
+        AreaPopDataset(pd.concat([df, df]), geodf, 'FIPS', 'FIPS',
+                       cat_col='category')
+    assert 'duplicate' in str(excinfo.value)
+
+
+def test_classification_codes():
+    values = np.array([np.nan, 1, 2, 3, 4, 5, 6, 7, 8], dtype=np.float32)
+    cl = Classification.from_values(values, num_cats=4)
+    assert cl.codes.dtype == np.int8 and cl.codes[0] == 0
+    assert cl.codes[1:].min() == 1 and cl.codes.max() == cl.num_cats == 4
+    # Labels are formatted on first use and not pickled
+    assert cl._labels is None
+    assert len(cl.labels) == 4
+    copy = pickle.loads(pickle.dumps(cl))
+    assert copy._labels is None and copy.labels == cl.labels
+    assert (copy.codes == cl.codes).all()
+
+    rgbs = [(i / 4.0, 0, 0, 1) for i in range(4)]
+    assert cl.color_table(rgbs).shape == (5, 4)
+    colors = cl.colors(rgbs)
+    assert colors[0, 3] == 0
+    assert (colors[1:, 0] == (cl.codes[1:] - 1) / 4.0).all()
+    assert list(cl.categorical(labels=True).categories) == cl.labels
+
+
+def test_exception_groups():
+    geodf = grid_geodata()
+    df = pd.DataFrame({'FIPS': geodf['FIPS'][1:],
+                       'category': [str(i * 10) for i in range(19)],
+                       'total': ['1,000'] * 19})
+    df.loc[[2, 5], 'category'] = ' S'
+    df.loc[7, 'total'] = '0'  # the ratio can't be calculated
+    apd = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='category',
+                         total_col='total', percent_format=True,
+                         exceptions={'S': ['Suppressed', 'pink'],
+                                     'nan': ['Insufficient data']})
+    assert apd.true_exceptions == ['S', 'nan']
+    assert list(np.flatnonzero(apd.exception_masks['S'])) == [2, 5]
+    assert list(np.flatnonzero(apd.exception_masks['nan'])) == [7]
+    # The exceptions are not binned but numbered after the bins
+    assert apd.groups[0] == 0
+    assert (apd.groups[[2, 5]] == apd.num_cats + 1).all()
+    assert apd.groups[7] == apd.num_cats + 2
+    binned = apd.groups[apd.groups > 0]
+    assert np.bincount(binned)[1:apd.num_cats+1].tolist() == [4, 4, 4, 4]
+    assert apd.group_names[-2:] == ['Suppressed', 'Insufficient data']
+    assert list(apd.data['labels'].cat.categories) == apd.group_names
+
+    chor = Choropleth(apd, savepdf=False)
+    assert len(chor.rgbs) == len(apd.group_names) == apd.num_cats + 2
+    assert chor.rgbs[-2] == matplotlib.colors.to_rgba('pink')
+    colors = apd.classification.colors(chor.rgbs)
+    assert tuple(colors[7]) == matplotlib.colors.to_rgba(
+        chor.ch_style.exception_colors[1])
+    chor.plot()
+    assert chor.to_bytes().startswith(b'\x89PNG')
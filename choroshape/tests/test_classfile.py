@@ -0,0 +1,48 @@
+'''Tests for saved, memory-mapped classifications'''
+from choroshape import *
+from conftest import grid_geodata
+import numpy as np
+import pandas as pd
+
+
+def make_apd():
+    geodf = grid_geodata()
+    df = pd.DataFrame({'FIPS': geodf['FIPS'][2:],
+                       'category': np.arange(18) * 3.0 + 1,
+                       'total': ['1,000'] * 18})
+    apd = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='category',
+                         total_col='total', percent_format=True,
+                         title='Saved', labeled_cutoffs={0: '(low)'})
+    return geodf, apd
+
+
+def test_classification_roundtrip(tmpdir):
+    geodf, apd = make_apd()
+    path = str(tmpdir.join('map.cls'))
+    apd.save_classification(path)
+    loaded = AreaPopDataset.from_classification(path, geodf)
+    # Read-only views of the file, nothing is copied
+    assert not loaded.groups.flags.writeable
+    assert not loaded.values.flags.owndata
+    assert loaded.geometry is apd.geometry
+    assert loaded.classification._labels == apd.group_names
+    assert loaded.labeled_cutoffs == {0: '(low)'}
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(loaded.data.drop(columns='geometry')),
+        pd.DataFrame(apd.data.drop(columns='geometry')))
+    chor = Choropleth(loaded, savepdf=False)
+    assert chor.cache_key() == Choropleth(apd, savepdf=False).cache_key()
+    chor.plot()
+    assert chor.to_bytes().startswith(b'\x89PNG')
+
+
+def test_classification_realigned(tmpdir):
+    geodf, apd = make_apd()
+    path = str(tmpdir.join('map.cls'))
+    apd.save_classification(path)
+    shuffled = geodf.iloc[::-1].reset_index(drop=True)
+    shuffled.loc[0, 'FIPS'] = '48999'  # a county the file does not have
+    loaded = AreaPopDataset.from_classification(path, shuffled, mmap=False)
+    assert loaded.groups[0] == 0 and np.isnan(loaded.values[0])
+    np.testing.assert_array_equal(loaded.groups[1:], apd.groups[::-1][1:])
+    np.testing.assert_array_equal(loaded.counts[1:], apd.counts[::-1][1:])
@@ -0,0 +1,106 @@
+'''Tests for the manifest-driven batch command'''
+from choroshape import choroshape
+from choroshape.cli import main, read_manifest, run_batch
+from choroshape.geometry import GeometryStore
+from conftest import grid_geodata
+import json
+import numpy as np
+import os
+import pandas as pd
+
+
+def write_inputs(tmpdir):
+    geodf = grid_geodata()
+    geodf['COUNTYFP'] = geodf['FIPS'].str[2:]
+    geodf[['COUNTYFP', 'geometry']].to_file(str(tmpdir.join('counties.shp')))
+    pd.DataFrame({'FIPS': geodf['COUNTYFP'],
+                  'category': np.arange(20) * 3.0 + 1,
+                  'total': 100.0}).to_csv(str(tmpdir.join('data.csv')),
+                                          index=False)
+    pd.DataFrame({'FIPS': geodf['FIPS'],
+                  'category': np.arange(20) * 2.0}).to_csv(
+                      str(tmpdir.join('counts.csv')), index=False)
+
+
+def test_cli_json(tmpdir, capsys):
+    write_inputs(tmpdir)
+    manifest = {'defaults': {'shapefile': 'counties.shp', 'state_FIPS': 48,
+                             'out_path': 'maps'},
+                'maps': [{'data': 'data.csv', 'title': 'Ratio',
+                          'formats': ['png', 'svg']},
+                         {'data': 'counts.csv', 'cat_name': 'counts',
+                          'colors': 'reds', 'bins': [0, 10, 20, 40]}]}
+    tmpdir.mkdir('maps')
+    tmpdir.join('maps.json').write(json.dumps(manifest))
+    cache_dir = str(tmpdir.join('cache'))
+    args = [str(tmpdir.join('maps.json')), '--cache-dir', cache_dir]
+    assert main(args + ['--jobs', '2']) == 0
+    for name in ['data.png', 'data.svg', 'counts.png']:
+        assert os.path.exists(str(tmpdir.join('maps', name)))
+    err = capsys.readouterr().err
+    assert 'Loaded 1 geometries and 2 data files' in err
+    assert '2 maps (0 cached, 0 failed)' in err
+
+    assert main(args + ['--jobs', '1']) == 0
+    assert '2 maps (2 cached, 0 failed)' in capsys.readouterr().err
+
+    os.remove(str(tmpdir.join('maps', 'counts.png')))
+    assert main([str(tmpdir.join('maps.json')), '--threads']) == 0
+    assert os.path.exists(str(tmpdir.join('maps', 'counts.png')))
+    assert '2 maps (0 cached, 0 failed)' in capsys.readouterr().err
+
+
+def test_cli_csv_and_failures(tmpdir, capsys):
+    write_inputs(tmpdir)
+    tmpdir.join('maps.csv').write(
+        'data,shapefile,state_FIPS,out_path,bins,num_cats\n'
+        'data.csv,counties.shp,48,.,0;20;40;60,\n'
+        'counts.csv,counties.shp,48,.,,3\n'
+        'missing.csv,counties.shp,48,.,,\n')
+    jobs = read_manifest(str(tmpdir.join('maps.csv')))
+    assert jobs[0]['bins'] == [0.0, 20.0, 40.0, 60.0]
+    assert jobs[1]['num_cats'] == 3
+    assert jobs[2]['data'] == str(tmpdir.join('missing.csv'))
+    assert main([str(tmpdir.join('maps.csv')), '-j', '1']) == 1
+    err = capsys.readouterr().err
+    assert 'missing FAILED: FileNotFoundError' in err
+    assert '3 maps (0 cached, 1 failed)' in err
+    assert os.path.exists(str(tmpdir.join('counts.png')))
+
+
+def test_cli_geoparquet(tmpdir, capsys):
+    write_inputs(tmpdir)
+    geodf = grid_geodata()
+    other = grid_geodata(state='02')
+    nation = pd.concat([geodf, other], ignore_index=True)
+    nation['STATEFP'] = nation['FIPS'].str[:2]
+    nation['COUNTYFP'] = nation['FIPS'].str[2:]
+    nation[['STATEFP', 'COUNTYFP', 'geometry']].to_parquet(
+        str(tmpdir.join('nation.parquet')))
+    manifest = {'defaults': {'shapefile': 'nation.parquet',
+                             'geostate_col': 'STATEFP', 'out_path': '.'},
+                'maps': [{'data': 'data.csv', 'state_FIPS': 48}]}
+    tmpdir.join('maps.json').write(json.dumps(manifest))
+    assert main([str(tmpdir.join('maps.json')), '-j', '1']) == 0
+    assert '1 maps (0 cached, 0 failed)' in capsys.readouterr().err
+    assert os.path.exists(str(tmpdir.join('data.png')))
+
+
+def test_jobs_share_geometry_store(tmpdir, monkeypatch):
+    write_inputs(tmpdir)
+    tmpdir.join('maps.csv').write(
+        'data,shapefile,state_FIPS,out_path\n'
+        'data.csv,counties.shp,48,.\n'
+        'counts.csv,counties.shp,48,.\n')
+    stores = []
+    make_choropleth = choroshape.make_choropleth
+
+    def recording(data, geodata, *args, **kwargs):
+        stores.append(geodata)
+        return make_choropleth(data, geodata, *args, **kwargs)
+    monkeypatch.setattr(choroshape, 'make_choropleth', recording)
+    jobs = read_manifest(str(tmpdir.join('maps.csv')))
+    assert run_batch(jobs, n_jobs=1, out=None) == []
+    assert len(stores) == 2 and stores[0] is stores[1]
+    assert isinstance(stores[0], GeometryStore)
+    assert choroshape.load_geodata(stores[0], '48') is stores[0]
@@ -0,0 +1,85 @@
+'''Tests for GeoParquet and Feather input and output'''
+from choroshape import *
+from choroshape.columnar import read_geodata, read_table, write_table
+from choroshape.geometry import GeometryStore
+from conftest import synthetic_counties
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+STATES = ('48', '02', '15')
+
+
+def make_files(tmpdir):
+    geodf = synthetic_counties(STATES).set_crs('EPSG:4269')
+    FIPS = geodf['STATEFP'] + geodf['COUNTYFP']
+    geodf['FIPS'] = FIPS
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'FIPS': FIPS, 'category': rng.randint(0, 100, len(FIPS)),
+                       'total': 100, 'unused': 'x'})
+    geo_path = write_table(geodf, str(tmpdir.join('counties.parquet')),
+                           'STATEFP', row_group_size=40)
+    data_path = write_table(df, str(tmpdir.join('data.feather')), 'FIPS')
+    return geodf, df, geo_path, data_path
+
+
+def test_read_with_projection_and_filter(tmpdir):
+    geodf, df, geo_path, data_path = make_files(tmpdir)
+    # One row group per state, so a state is read alone
+    assert pq.ParquetFile(geo_path).metadata.num_row_groups == 3
+    shapes = read_geodata(geo_path, ['COUNTYFP'], ['02'], state_col='STATEFP')
+    assert list(shapes.columns) == ['COUNTYFP', 'geometry']
+    assert len(shapes) == 40 and shapes.crs == geodf.crs
+    expected = geodf[geodf['STATEFP'] == '02'].geometry.reset_index(drop=True)
+    assert shapes.geometry.geom_equals(expected).all()
+    data = read_table(data_path, ['FIPS', 'total'], ['15', '02'])
+    assert list(data.columns) == ['FIPS', 'total']
+    assert sorted(set(data['FIPS'].str[:2])) == ['02', '15']
+    with pytest.raises(ValueError):
+        read_table(data_path, ['FIPS', 'missing'])
+
+
+def test_geometry_store_reads_columnar(tmpdir):
+    geodf, df, geo_path, data_path = make_files(tmpdir)
+    alaska = read_geodata(geo_path, ['FIPS'], ['02'], state_col='STATEFP')
+    for ext in ['.parquet', '.feather']:
+        path = write_table(alaska, str(tmpdir.join('alaska' + ext)))
+        store = GeometryStore.get(path, 'FIPS')
+        assert GeometryStore.get(path, 'FIPS') is store
+        assert list(store.FIPS) == list(alaska['FIPS'])
+        assert store.crs == geodf.crs
+        assert (store.geometry.geom_equals(alaska.geometry.values)).all()
+
+
+def test_make_choropleth_and_export(tmpdir):
+    geodf, df, geo_path, data_path = make_files(tmpdir)
+    path = make_choropleth(data_path, geo_path, '48',
+                           geostate_col='STATEFP', cat_name='columnar',
+                           out_path=str(tmpdir))
+    assert path == str(tmpdir.join('columnar.png'))
+    with pytest.raises(ValueError):
+        load_data(data_path, '72')
+
+    apd = AreaPopDataset(data_path, geo_path, 'FIPS', 'FIPS',
+                         cat_col='category', total_col='total',
+                         cat_name='all')
+    assert len(apd.geometry) == 120 and (apd.groups > 0).all()
+    out = apd.save_table(str(tmpdir.join('classified.parquet')))
+    back = read_geodata(out)
+    assert list(back['group'].astype(int)) == list(
+        apd.data.sort_values('FIPS')['group'].astype(int))
+
+
+def test_partitioned_reads_each_state(tmpdir):
+    geodf, df, geo_path, data_path = make_files(tmpdir)
+    geodata = geodf
+    data_path = write_table(df, str(tmpdir.join('data.parquet')), 'FIPS',
+                            row_group_size=40)
+    whole = AreaPopDataset(df, geodata, 'FIPS', 'FIPS', cat_col='category',
+                           total_col='total')
+    parts = AreaPopDataset(data_path, geodata, 'FIPS', 'FIPS',
+                           cat_col='category', total_col='total',
+                           partitioned=True, n_jobs=1)
+    assert (whole.groups == parts.groups).all()
+    assert np.allclose(whole.values, parts.values)
@@ -0,0 +1,73 @@
+'''Tests for the shared geometry and what is derived from it'''
+from choroshape import *
+from choroshape import geometry
+from choroshape.geometry import GeometryStore
+from conftest import grid_geodata, synthetic_counties
+import collections
+import gc
+import numpy as np
+import pandas as pd
+import weakref
+
+
+def brute_force(geodf, kind):
+    n = len(geodf)
+    expected = np.zeros((n, n), dtype=bool)
+    shapes = list(geodf.geometry)
+    for i in range(n):
+        for j in range(n):
+            if i == j or not shapes[i].intersects(shapes[j]):
+                continue
+            shared = shapes[i].boundary.intersection(shapes[j].boundary)
+            expected[i, j] = kind == 'queen' or shared.length > 0
+    return expected
+
+
+def test_adjacency_matches_brute_force():
+    geodf = synthetic_counties(n=30, seed=3)
+    store = GeometryStore(geodf, 'COUNTYFP')
+    for kind in ['queen', 'rook']:
+        adjacency = store.adjacency(kind)
+        assert store.adjacency(kind) is adjacency
+        np.testing.assert_array_equal(adjacency.toarray() > 0,
+                                      brute_force(geodf, kind))
+
+
+def test_grid_adjacency():
+    store = GeometryStore(grid_geodata(), 'FIPS')
+    queen = np.asarray(store.adjacency('queen').sum(axis=1)).ravel()
+    rook = np.asarray(store.adjacency('rook').sum(axis=1)).ravel()
+    # Corners of the 5 x 4 grid and a square inside it
+    assert (queen[0], rook[0]) == (3, 2)
+    assert (queen[6], rook[6]) == (8, 4)
+
+
+def test_datasets_share_adjacency():
+    geodf = grid_geodata()
+    df = pd.DataFrame({'FIPS': geodf['FIPS'], 'a': np.arange(20.0),
+                       'b': np.arange(20.0)[::-1]})
+    first = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='a')
+    second = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='b')
+    wide = MultiIndicatorDataset(df, geodf, 'FIPS', 'FIPS', ['a', 'b'])
+    assert first.adjacency is second.adjacency is wide.adjacency
+
+
+def test_stores_released(tmpdir, monkeypatch):
+    geodf = grid_geodata()
+    store = weakref.ref(GeometryStore.get(geodf, 'FIPS'))
+    assert GeometryStore.get(geodf, 'FIPS') is store()
+    del geodf
+    gc.collect()
+    assert store() is None and not geometry._STORES
+
+    monkeypatch.setattr(geometry, '_MAX_FILE_STORES', 2)
+    monkeypatch.setattr(geometry, '_FILE_STORES',
+                        collections.OrderedDict())
+    paths = [str(tmpdir.join('%d.parquet' % i)) for i in range(3)]
+    for path in paths:
+        grid_geodata().to_parquet(path)
+    first = weakref.ref(GeometryStore.get(paths[0], 'FIPS'))
+    for path in paths[1:]:
+        GeometryStore.get(path, 'FIPS')
+    gc.collect()
+    assert first() is None and len(geometry._FILE_STORES) == 2
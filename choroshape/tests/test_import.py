@@ -0,0 +1,44 @@
+'''Import-time benchmark: importing choroshape must not pull in the heavy
+plotting and data libraries'''
+import choroshape
+import os
+import pytest
+import subprocess
+import sys
+
+HEAVY = ['numpy', 'pandas', 'geopandas', 'shapely', 'matplotlib',
+         'matplotlib.pyplot']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(choroshape.__file__)))
+
+SCRIPT = '''
+import sys, time
+t = time.time()
+import choroshape
+print(time.time() - t)
+print(','.join(m for m in %r if m in sys.modules))
+''' % (HEAVY,)
+
+
+def run(script, **env):
+    clean_env = dict(os.environ, **env)
+    for name in ['DISPLAY', 'WAYLAND_DISPLAY', 'MPLBACKEND']:
+        clean_env.pop(name, None)
+    out = subprocess.check_output([sys.executable, '-c', script],
+                                  cwd=ROOT, env=clean_env)
+    return out.decode('utf-8').splitlines()
+
+
+def test_import_is_lazy():
+    elapsed, loaded = run(SCRIPT)
+    assert loaded == ''
+    # Importing the heavy libraries takes over a second; choroshape alone
+    # should take a small fraction of that
+    assert float(elapsed) < 0.5
+
+
+@pytest.mark.skipif(os.name == 'nt' or sys.platform == 'darwin',
+                    reason='always has a display')
+def test_headless_backend():
+    script = ('import choroshape.choroshape as c; c.plt.figure; '
+              'import matplotlib; print(matplotlib.get_backend())')
+    assert run(script)[0].lower() == 'agg'
@@ -0,0 +1,81 @@
+'''Tests for inset maps of several regions'''
+from choroshape import *
+from choroshape.geometry import GeometryStore
+from conftest import grid_geodata
+from shapely.geometry import box
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_states():
+    '''A main state, an "Alaska" across the antimeridian, an "Hawaii" and a
+    territory no region has, in longitude and latitude'''
+    main = grid_geodata(20, 5, '48')
+    main['geometry'] = main.geometry.scale(4, 4, origin=(0, 0)).translate(
+        -110, 30)
+    alaska = gpd.GeoDataFrame(
+        {'FIPS': ['02001', '02003']},
+        geometry=[box(-170, 55, -140, 70), box(172, 51, 180, 53)])
+    hawaii = gpd.GeoDataFrame({'FIPS': ['15001']},
+                              geometry=[box(-160, 19, -155, 22)])
+    guam = gpd.GeoDataFrame({'FIPS': ['66010']},
+                            geometry=[box(144, 13, 145, 14)])
+    return pd.concat([main, alaska, hawaii, guam],
+                     ignore_index=True).set_crs('EPSG:4326')
+
+
+LAYOUT = InsetLayout([
+    Region('Main', ['48']),
+    Region('Alaska', ['02'], box=(0, 0, .3, .3)),
+    Region('Hawaii', ['15'], box=(.4, 0, .5, .1), rotate=90)])
+
+
+def test_arranged_once_in_boxes():
+    store = GeometryStore(make_states(), 'FIPS')
+    arranged = store.arrange(LAYOUT)
+    assert store.arrange(LAYOUT) is arranged
+    assert list(arranged.FIPS) == list(store.FIPS)
+    assert arranged.region.tolist() == [0] * 20 + [1, 1, 2, -1]
+    assert sorted(arranged.transforms) == [1, 2]
+    geometry = np.asarray(arranged.geometry)
+    # The main state stays put; its extent is -110..-90, 30..46
+    assert geometry[0].equals(np.asarray(store.geometry)[0])
+    # Alaska is unwrapped across the antimeridian and fits its box
+    x0, y0, x1, y1 = gpd.GeoSeries(geometry[20:22]).total_bounds
+    assert np.allclose([x0, x1], [-110, -104])
+    assert np.isclose((y0 + y1) / 2, 32.4) and y1 - y0 < 4.8
+    # Hawaii is turned on its side, so it is taller than wide
+    x0, y0, x1, y1 = geometry[22].bounds
+    assert y1 - y0 > x1 - x0
+    assert arranged.frames[0] == pytest.approx((-110, 30, -104, 34.8))
+    # Guam is in no region and is not moved
+    assert geometry[23].equals(np.asarray(store.geometry)[23])
+
+
+def test_shared_classification(tmpdir):
+    geodata = make_states()
+    df = pd.DataFrame({'FIPS': geodata['FIPS'],
+                       'value': np.arange(len(geodata), dtype=float)})
+    apd = AreaPopDataset(df, geodata, 'FIPS', 'FIPS', total_col='value',
+                         cat_name='us', bins=[0, 5, 10, 15, 25])
+    chor = Choropleth(apd, out_path=str(tmpdir), insets=LAYOUT)
+    chor.draw()
+    collection = chor.ax.collections[0]
+    # Every shape in a region, colored by the one classification
+    assert len(collection.get_paths()) == 23
+    drawn = apd.groups[:23]
+    assert np.allclose(collection.get_facecolor(),
+                       apd.classification.colors(chor.rgbs)[:23])
+    assert set(drawn) == set([1, 2, 3, 4])
+    # The frames of the two insets
+    assert len(chor.ax.patches) == 2
+    plain = Choropleth(apd, out_path=str(tmpdir))
+    assert plain.cache_key() != chor.cache_key()
+    assert chor.plot() == str(tmpdir.join('us.png'))
+
+
+def test_layout_needs_a_fixed_region():
+    with pytest.raises(ValueError):
+        InsetLayout([Region('Alaska', ['02'], box=(0, 0, 1, 1))])
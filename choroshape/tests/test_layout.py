@@ -0,0 +1,69 @@
+'''Tests for layouts shared by a batch of maps'''
+from choroshape import *
+from choroshape import layout
+import gc
+import weakref
+
+
+def test_layout_reused(make_dataset):
+    layout._LAYOUTS.clear()
+    first = Choropleth(make_dataset(title='Share of people ' * 5),
+                       savepdf=False)
+    first.plot()
+    box = first.layout.legend_box
+    # Measuring without drawing the map finds the same legend extents
+    first.ax.figure.canvas.draw()
+    leg = first.ax.get_legend()
+    bb = leg.get_window_extent().transformed(first.ax.transAxes.inverted())
+    assert abs(bb.x0 + .005 - box[0]) < 1e-9
+    assert abs(bb.y0 - .005 - box[2]) < 1e-9
+    assert '\n' in first.title
+
+    # A title on fewer lines leaves room for the map, so it is measured anew
+    short = Choropleth(make_dataset(title='A'), savepdf=False)
+    short.plot()
+    assert short.layout is not first.layout and len(layout._LAYOUTS) == 2
+    assert short.layout.key[4] == 1
+    assert first.layout.key[4] == first.title.count('\n') + 1 > 1
+
+    for title, template in [('Share of adults ' * 5, first.layout),
+                            ('B', short.layout)]:
+        second = Choropleth(make_dataset(title=title), savepdf=False)
+        second.plot()
+        assert second.layout is template and len(layout._LAYOUTS) == 2
+        reused = second.to_bytes()
+        # A freshly measured layout gives the same image
+        del layout._LAYOUTS[template.key]
+        fresh = Choropleth(make_dataset(title=title), savepdf=False)
+        fresh.plot()
+        assert fresh.layout is not template
+        assert fresh.to_bytes() == reused
+
+
+def test_layouts_bounded(make_dataset, monkeypatch):
+    monkeypatch.setattr(layout, '_MAX_LAYOUTS', 1)
+    layout._LAYOUTS.clear()
+    first = Choropleth(make_dataset(title='A'), savepdf=False)
+    first.plot()
+    template = weakref.ref(first.layout)
+    second = Choropleth(make_dataset(title='Share of people ' * 5),
+                        savepdf=False)
+    second.plot()
+    assert list(layout._LAYOUTS.values()) == [second.layout]
+    del first
+    gc.collect()
+    assert template() is None
+
+
+def test_wider_labels_measured_anew(make_dataset):
+    layout._LAYOUTS.clear()
+    narrow = Choropleth(make_dataset(bins=[0, 5, 10, 50, 100]),
+                        savepdf=False)
+    narrow.plot()
+    wide = Choropleth(make_dataset(bins=[0, 5000, 10000, 50000, 100000]),
+                      savepdf=False)
+    wide.plot()
+    assert len(wide.area_data.group_names) == \
+        len(narrow.area_data.group_names)
+    assert wide.layout is not narrow.layout
+    assert wide.layout.legend_box[1] > narrow.layout.legend_box[1]
@@ -0,0 +1,55 @@
+'''Tests for wide-table datasets with many indicators'''
+from choroshape import *
+from conftest import grid_geodata
+import numpy as np
+import pandas as pd
+
+
+def make_wide():
+    geodf = grid_geodata()
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'FIPS': geodf['FIPS'][::-1].values,
+                       'total': rng.randint(1000, 5000, 20).astype(float)})
+    for c in ['a', 'b', 'c']:
+        df[c] = (df['total'] * rng.uniform(0, .5, 20)).round()
+    df['b'] = df['b'].map('{:,.0f}'.format)  # strings with commas
+    df['c'] = df['c'].astype(object)
+    df.loc[3, 'c'] = '(X)'
+    return geodf, df
+
+
+def test_multi_indicator_ratios():
+    geodf, df = make_wide()
+    mid = MultiIndicatorDataset(df, geodf, 'FIPS', 'FIPS', ['a', 'b', 'c'],
+                                total_col='total', percent_format=True,
+                                bins={'a': [10, 20, 30, 40]}, num_cats=5)
+    assert mid.values.shape == (20, 3)
+    assert mid.groups.dtype == np.int8
+    for c in ['a', 'b']:
+        df['ratio'] = pd.to_numeric(df[c].astype(str).str.replace(',', ''),
+                                    errors='coerce') / df['total']
+        apd = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='ratio',
+                             percent_format=True, num_cats=5,
+                             bins=[10, 20, 30, 40] if c == 'a' else None)
+        view = mid.indicator(c)
+        np.testing.assert_allclose(view.values,
+                                   apd.data['ratio'].to_numpy(dtype=float))
+        assert view.group_names == apd.group_names
+        assert (view.data['group'].astype(float).fillna(0).to_numpy() ==
+                apd.data['group'].astype(float).fillna(0).to_numpy()).all()
+    # The unreadable value is left out of the groups
+    c = mid.indicator('c')
+    assert np.isnan(c.values).sum() == 1 and (c.groups == 0).sum() == 1
+    assert len(mid.indicator('b').bins) == 6
+
+
+def test_multi_indicator_render():
+    geodf, df = make_wide()
+    mid = MultiIndicatorDataset(df, geodf, 'FIPS', 'FIPS', ['a', 'b'],
+                                total_col='total', titles=['A', 'B'])
+    images = [Choropleth(view, savepdf=False) for view in mid.indicators()]
+    for chor in images:
+        chor.plot()
+        assert chor.to_bytes().startswith(b'\x89PNG')
+    assert images[0].cache_key() != images[1].cache_key()
+    assert mid.indicator(0).data.geometry.values[0] is geodf.geometry.values[0]
@@ -0,0 +1,61 @@
+'''Tests for saving maps to paths, streams and bytes'''
+from choroshape import *
+from choroshape.choroshape import plt
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+
+
+def test_save_plot_stream(make_dataset):
+    chor = Choropleth(make_dataset(), savepdf=False)
+    chor.plot()
+    buf = io.BytesIO()
+    assert chor.save_plot(buf) is buf
+    assert buf.getvalue().startswith(b'\x89PNG')
+    assert chor.to_bytes('pdf').startswith(b'%PDF')
+
+
+def test_save_plot_formats(tmpdir, make_dataset):
+    chor = Choropleth(make_dataset(), out_path=str(tmpdir))
+    saved = chor.plot(formats=['png', 'pdf', 'svg'])
+    assert sorted(saved) == ['pdf', 'png', 'svg']
+    for fmt, path in saved.items():
+        assert path == os.path.join(str(tmpdir), 'test_map.' + fmt)
+        assert os.path.exists(path)
+
+    images = chor.to_bytes(['png', 'svg'])
+    assert images['png'].startswith(b'\x89PNG')
+    assert b'<svg' in images['svg']
+
+    buf = io.BytesIO()
+    path = str(tmpdir.join('other.pdf'))
+    saved = chor.save_plot({'png': buf, 'pdf': path})
+    assert saved == {'png': buf, 'pdf': path}
+    assert open(path, 'rb').read().startswith(b'%PDF')
+
+
+def test_save_plot_cached_stream(tmpdir, make_dataset):
+    cache = RenderCache(str(tmpdir))
+    Choropleth(make_dataset(), cache=cache).plot(io.BytesIO())
+    chor = Choropleth(make_dataset(), cache=cache)
+    image = chor.plot(formats='png', target=io.BytesIO()).getvalue()
+    assert cache.hits == 1
+    assert not hasattr(chor, 'ax')  # nothing was drawn
+    assert image.startswith(b'\x89PNG')
+
+
+def test_render_in_threads(make_dataset):
+    datasets = [make_dataset(title='Map %d' % i, bins=[0, 20 + i, 50, 100])
+                for i in range(6)]
+
+    def render(dataset):
+        chor = Choropleth(dataset, savepdf=False)
+        chor.plot()
+        return chor.to_bytes()
+    one_by_one = [render(d) for d in datasets]
+    plt.close('all')
+    with ThreadPoolExecutor(4) as pool:
+        threaded = list(pool.map(render, datasets))
+    assert threaded == one_by_one
+    # Nothing went through pyplot's global figures
+    assert not plt.get_fignums()
@@ -0,0 +1,50 @@
+'''Tests for state-by-state ingestion of large datasets'''
+from choroshape import *
+from choroshape.partitioned import merge_sketches, quantile_sketch
+from conftest import grid_geodata
+import numpy as np
+import pandas as pd
+
+
+def two_states():
+    geodf = pd.concat([grid_geodata(30, state='06'), grid_geodata(20)],
+                      ignore_index=True)
+    rng = np.random.RandomState(1)
+    df = pd.DataFrame({'FIPS': geodf['FIPS'],
+                       'category': rng.randint(0, 500, 50).astype(str),
+                       'total': ['1,000'] * 50}).iloc[::-1]
+    df.loc[[3, 40], 'category'] = 'S'
+    return geodf, df
+
+
+def test_partitioned_matches_eager(tmpdir):
+    geodf, df = two_states()
+    options = dict(cat_col='category', total_col='total',
+                   percent_format=True)
+    eager = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', **options)
+    files = {}
+    for state, part in df.groupby(df['FIPS'].str[:2]):
+        files[state] = str(tmpdir.join(state + '.csv'))
+        part.to_csv(files[state], index=False)
+    for data in [df, files]:
+        part = AreaPopDataset(data, geodf, 'FIPS', 'FIPS', partitioned=True,
+                              n_jobs=2, **options)
+        np.testing.assert_array_equal(part.values, eager.values)
+        np.testing.assert_array_equal(part.counts, eager.counts)
+        np.testing.assert_array_equal(part.groups, eager.groups)
+        np.testing.assert_allclose(part.bins, eager.bins)
+        assert part.true_exceptions == eager.true_exceptions == ['S']
+        assert part.group_names == eager.group_names
+
+
+def test_merge_sketches():
+    rng = np.random.RandomState(2)
+    parts = [rng.lognormal(size=n) for n in [10, 500, 3000]]
+    values = np.concatenate(parts)
+    exact = pd.qcut(values, 5, retbins=True)[1]
+    sketches = [quantile_sketch(p) for p in parts]
+    np.testing.assert_allclose(merge_sketches(sketches, 5), exact)
+    # Approximate sketches stay within their rank error
+    small = merge_sketches([quantile_sketch(p, 64) for p in parts], 5)
+    ranks = np.searchsorted(np.sort(values), small) / float(len(values))
+    np.testing.assert_allclose(ranks, np.linspace(0, 1, 6), atol=.02)
@@ -0,0 +1,29 @@
+'''Tests for per-map profiles'''
+from choroshape import *
+import logging
+import pstats
+
+
+def test_deterministic_profile(make_dataset, tmpdir, caplog):
+    chor = Choropleth(make_dataset(cat_name='poverty rate'),
+                      out_path=str(tmpdir))
+    with caplog.at_level(logging.INFO, logger='choroshape'):
+        chor.plot(profile='deterministic')
+    path = tmpdir.join('poverty_rate.pstats')
+    assert path.check() and tmpdir.join('poverty rate.png').check()
+    funcs = [func for _, _, func in pstats.Stats(str(path)).stats]
+    assert '_draw_legend' in funcs
+    assert 'top hotspots' in caplog.text and 'poverty rate' in caplog.text
+
+
+def test_sampling_profile(make_dataset, tmpdir, caplog):
+    chor = Choropleth(make_dataset(), out_path=str(tmpdir))
+    with caplog.at_level(logging.INFO, logger='choroshape'):
+        chor.plot(profile='sampling')
+    lines = tmpdir.join('test_map.folded').read().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+    assert any('plot (choroshape.py' in line for line in lines)
+    assert 'test_map.folded' in caplog.text
@@ -0,0 +1,174 @@
+'''Property-based checks that the vectorized paths give the same results as
+straightforward row-by-row reference implementations'''
+from choroshape import *
+from choroshape.choroshape import clean_FIPS
+from choroshape.partitioned import merge_sketches, quantile_sketch
+from conftest import grid_geodata
+from hypothesis import given, settings, strategies as st
+import numpy as np
+import pandas as pd
+
+SETTINGS = settings(max_examples=60, deadline=None)
+
+
+def reference_fix_FIPS(data, county_col, state_FIPS=None):
+    '''fix_FIPS as it was written before it was vectorized'''
+    data[county_col] = data.loc[:, county_col].map(lambda x: clean_FIPS(x))
+    data[county_col] = data.loc[:, county_col].apply(
+        lambda x: x.zfill(3) if len(x) < 3 else x)
+    if (data[county_col].str.len() == 3).any():
+        if state_FIPS in data.columns:
+            state_col = state_FIPS
+        else:
+            state_FIPS = clean_FIPS(state_FIPS)
+            if len(state_FIPS) != 2:
+                raise ValueError('Data contains State FIPS not in a ' +
+                                 'readable format. Entry must be a string ' +
+                                 'column name or a 2-digit state FIPS code')
+            state_col = 'state_FIPS'
+            data[state_col] = state_FIPS
+        data[state_col] = data.loc[:, state_col].map(lambda x: clean_FIPS(x))
+        data[county_col] = data.loc[:, county_col].apply(lambda x: x[-3:])
+        data[county_col] = [s + c for s, c in zip(data[state_col],
+                                                  data[county_col])]
+    data[county_col] = data[county_col].str.zfill(5)
+    if not (data[county_col].str.len() == 5).all():
+        raise ValueError(
+            'Data contains FIPS code values that violate length ' +
+            'requirements. Entries shold be a 3-digit county code ' +
+            'or a 5-digit state and county code.')
+    return list(data[county_col])
+
+
+def outcome(f, *args):
+    '''The result of f, or the message of the ValueError it raised'''
+    try:
+        return f(*args)
+    except ValueError as e:
+        return 'ValueError: %s' % e
+
+
+county_codes = st.one_of(
+    st.integers(0, 99999),
+    st.from_regex(r'\A[0-9]{1,5}\Z'),
+    st.from_regex(r'\A[0-9]{2}[- _.][0-9]{3}\Z'),
+    st.from_regex(r'\A[0-9A-Z ]{1,4}\Z'))
+
+
+@SETTINGS
+@given(st.lists(county_codes, min_size=1, max_size=20),
+       st.one_of(st.just('state'), st.from_regex(r'\A[0-9]{1,3}\Z')),
+       st.lists(st.integers(1, 99), min_size=20, max_size=20))
+def test_fix_FIPS_matches_reference(codes, state_FIPS, states):
+    df = pd.DataFrame({'county': pd.Series(codes, dtype=object),
+                       'state': states[:len(codes)]})
+
+    def vectorized(data):
+        return list(fix_FIPS(data, 'county', state_FIPS)['FIPS'])
+    assert outcome(vectorized, df.copy()) == outcome(
+        reference_fix_FIPS, df.copy(), 'county', state_FIPS)
+
+
+def reference_dataset(df, geodf, percent_format, precision, bins, num_cats):
+    '''Row-by-row merge, ratio and binning of a category and a total
+    column, with 'S' for suppressed counts'''
+    data = pd.merge(geodf[['FIPS']], df, how='left', on='FIPS')
+
+    def to_float(x):
+        try:
+            return float(str(x).replace(',', ''))
+        except ValueError:
+            return np.nan
+    suppressed = np.array([str(c).strip() == 'S' or str(t).strip() == 'S'
+                           for c, t in zip(data['category'], data['total'])])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.array([to_float(c) / to_float(t) for c, t in
+                          zip(data['category'], data['total'])])
+    finite = np.isfinite(ratio)
+    if percent_format and (ratio[finite] < 1).all():
+        ratio = ratio * 100.0
+    ratio = np.round(ratio, precision)
+    missing = data['category'].notnull().values & ~finite & ~suppressed
+    values = pd.Series(np.where(suppressed | missing, np.nan, ratio))
+    if bins is None:
+        groups = pd.qcut(values, num_cats, labels=False, precision=precision)
+        nbins = num_cats + 1
+    else:
+        cut = np.asarray(bins, dtype=float).round(precision)
+        if cut[0] > 0:
+            cut = np.concatenate([[0.0], cut])
+        cut[-1] += 10 ** (-1*precision)
+        cut = np.unique(cut)
+        groups = pd.cut(values, cut, labels=False, include_lowest=True)
+        nbins = len(cut)
+    codes = (groups.fillna(-1).values + 1).astype(int)
+    order = [k for k in ['nan', 'S'] if {'nan': missing, 'S': suppressed}[k]
+             .any()]
+    for k, key in reversed(list(enumerate(order))):
+        codes[{'nan': missing, 'S': suppressed}[key]] = nbins + k
+    return ratio.astype(np.float32), codes
+
+
+county_rows = st.tuples(
+    st.integers(1, 10 ** 6),              # total
+    st.floats(0, 1),                      # share in the category
+    st.sampled_from(['plain', 'commas', 'float', 'S', 'S total', 'gone']))
+
+
+@SETTINGS
+@given(st.lists(county_rows, min_size=8, max_size=40), st.booleans(),
+       st.integers(0, 3),
+       st.one_of(st.none(), st.lists(st.floats(.5, 90), min_size=1,
+                                     max_size=6).map(sorted)))
+def test_dataset_matches_reference(rows, percent_format, precision, bins):
+    geodf = grid_geodata(len(rows))
+    records = []
+    for FIPS, (total, share, kind) in zip(geodf['FIPS'], rows):
+        cat = int(total * share)
+        if kind == 'gone':
+            continue
+        if kind == 'commas':
+            cat, total = '{:,}'.format(cat), '{:,}'.format(total)
+        elif kind == 'float':
+            cat, total = float(cat), float(total)
+        elif kind == 'S':
+            cat = 'S'
+        elif kind == 'S total':
+            total = ' S'
+        records.append({'FIPS': FIPS, 'category': cat, 'total': total})
+    df = pd.DataFrame(records, columns=['FIPS', 'category', 'total'])
+    df = df.astype(object)
+
+    expected = outcome(reference_dataset, df, geodf, percent_format,
+                       precision, bins, 4)
+    try:
+        apd = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='category',
+                             total_col='total', bins=bins, num_cats=4,
+                             precision=precision,
+                             percent_format=percent_format)
+    except ValueError:
+        assert isinstance(expected, str)
+        return
+    assert not isinstance(expected, str)
+    values, codes = expected
+    present = ~np.isnan(apd.values)
+    np.testing.assert_array_equal(np.isnan(values[apd.matched]),
+                                  ~present[apd.matched])
+    np.testing.assert_array_equal(apd.values[present], values[present])
+    np.testing.assert_array_equal(apd.groups, codes)
+
+
+@SETTINGS
+@given(st.lists(st.lists(st.integers(0, 500), max_size=300), min_size=1,
+                max_size=6),
+       st.integers(2, 8))
+def test_sketches_match_qcut(parts, num_cats):
+    values = np.concatenate([np.asarray(p, dtype=float) for p in parts])
+    if len(values) == 0:
+        return
+    expected = pd.qcut(values, num_cats, retbins=True,
+                       duplicates='drop')[1]
+    bins = merge_sketches([quantile_sketch(np.asarray(p, dtype=float))
+                           for p in parts], num_cats)
+    if len(expected) == num_cats + 1:
+        np.testing.assert_allclose(bins, expected)
@@ -0,0 +1,79 @@
+'''Tests for diverging and bivariate color schemes'''
+from choroshape import *
+from conftest import grid_geodata
+import matplotlib
+import matplotlib.colors as mcolors
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_sequential_colors_unchanged():
+    style = ChoroplethStyle('greens')
+    assert style.scheme == 'sequential'
+    expected = [style.cmap(i) for i in np.linspace(0, 1, 5)]
+    np.testing.assert_allclose(style.get_colors(5), expected)
+    # No colormap is registered with matplotlib
+    assert 'greens_cmap' not in matplotlib.colormaps
+
+
+def test_diverging_colors():
+    bins = get_custom_bins(20, num_cats=4)
+    style = ChoroplethStyle('red_blues')
+    rgbs = np.array(style.get_colors(4, bins))
+    low, high = [mcolors.to_rgba(c) for c in ['darkred', 'darkblue']]
+    np.testing.assert_allclose(rgbs[0], low)
+    np.testing.assert_allclose(rgbs[-1], high)
+    # Both sides step away from the level the same way
+    np.testing.assert_allclose(rgbs[1], style.cmap(.25))
+    np.testing.assert_allclose(rgbs[2], style.cmap(.75))
+    # A bin holding the center is white
+    centered = ChoroplethStyle('red_blues', center=bins[2] + .5)
+    rgbs = centered.get_colors(4, bins)
+    np.testing.assert_allclose(rgbs[2], mcolors.to_rgba('white'), atol=.01)
+    np.testing.assert_allclose(rgbs[0], low)
+    np.testing.assert_allclose(rgbs[1], centered.cmap(.25))
+
+
+def make_pair():
+    geodf = grid_geodata(18)
+    rng = np.random.RandomState(1)
+    df = pd.DataFrame({'FIPS': geodf['FIPS'],
+                       'rate': rng.uniform(0, 50, 18).round(1),
+                       'count': rng.randint(0, 500, 18)}).astype(object)
+    df.loc[4, 'count'] = 'S'
+    rate = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='rate',
+                          cat_name='rate', num_cats=3)
+    count = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', cat_col='count',
+                           cat_name='count', num_cats=3)
+    return rate, count
+
+
+def test_bivariate_dataset():
+    rate, count = make_pair()
+    bd = BivariateDataset(rate, count, title='Rate and count')
+    codes = bd.classification.codes
+    x, y = rate.classification.codes, count.classification.codes
+    for i in range(len(codes)):
+        if i == 4:
+            assert codes[i] == 10  # suppressed count
+        else:
+            assert codes[i] == (x[i] - 1) * 3 + y[i]
+    assert bd.num_cats == 9 and bd.cat_name == 'rate_count'
+    assert len(bd.group_names) == 10
+    assert bd.group_names[-1] == 'Insufficient data'
+    assert bd.group_names[1] == '%s, %s' % (rate.group_names[0],
+                                            count.group_names[1])
+
+
+def test_bivariate_choropleth():
+    rate, count = make_pair()
+    chor = Choropleth(BivariateDataset(rate, count),
+                      ChoroplethStyle('pink_blues'), savepdf=False)
+    corners = ChoroplethStyle('pink_blues').bivariate_dict['pink_blues']
+    for k, c in zip([0, 6, 2, 8], corners):
+        np.testing.assert_allclose(chor.rgbs[k], mcolors.to_rgba(c))
+    assert len(chor.rgbs) == 10
+    chor.plot()
+    with pytest.raises(ValueError):
+        ChoroplethStyle('pink_blues').get_colors(6)
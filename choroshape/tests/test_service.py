@@ -0,0 +1,86 @@
+'''Tests for the warm render service'''
+from choroshape.service import RenderService, _load_geometry, render_map
+from conftest import grid_geodata
+import asyncio
+import json
+import numpy as np
+import pytest
+import pandas as pd
+
+GEODF = grid_geodata()
+DATA = {'FIPS': list(GEODF['FIPS']),
+        'category': list(np.arange(len(GEODF)) * 5.0 + 2)}
+
+
+def test_render_service_formats():
+    async def run():
+        async with RenderService({'counties': GEODF}, max_workers=1) as rs:
+            return await asyncio.gather(
+                rs.render(geometry='counties', data=DATA,
+                          cat_col='category', title='PNG map'),
+                rs.render(geometry='counties', data=DATA, format='svg',
+                          cat_col='category', title='SVG map',
+                          state_FIPS='48'))
+    png, svg = asyncio.run(run())
+    assert png.startswith(b'\x89PNG')
+    assert b'<svg' in svg
+
+
+def test_render_service_server():
+    async def run():
+        rs = RenderService({'counties': GEODF}, max_workers=1)
+        server = await rs.start_server(port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        replies = []
+        for request in [{'geometry': 'counties', 'data': DATA,
+                         'cat_col': 'category'},
+                        {'geometry': 'missing', 'data': DATA}]:
+            writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            header = json.loads((await reader.readline()).decode('utf-8'))
+            replies.append(
+                (header, await reader.readexactly(header['length'])))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        rs.close()
+        return replies
+    (ok, png), (err, empty) = asyncio.run(run())
+    assert ok['status'] == 'ok' and png.startswith(b'\x89PNG')
+    assert err['status'] == 'error' and 'missing' in err['message']
+    assert empty == b''
+
+
+def test_render_service_geoparquet(tmpdir):
+    nation = pd.concat([grid_geodata(), grid_geodata(state='02')],
+                       ignore_index=True)
+    nation['STATEFP'] = nation['FIPS'].str[:2]
+    nation['COUNTYFP'] = nation['FIPS'].str[2:]
+    path = str(tmpdir.join('nation.parquet'))
+    nation[['STATEFP', 'COUNTYFP', 'geometry']].to_parquet(path)
+    whole = _load_geometry(path)
+    assert len(whole) == 40 and whole['FIPS'].iloc[-1] == '02039'
+    texas = _load_geometry({'path': path, 'states': ['48']})
+    assert list(texas['FIPS']) == list(GEODF['FIPS'])
+
+
+def test_render_service_refuses_unknown_keys():
+    with pytest.raises(ValueError, match='partitioned'):
+        render_map({'geometry': 'counties', 'data': DATA,
+                    'cat_col': 'category', 'partitioned': True})
+
+
+def test_render_service_reused_across_loops():
+    rs = RenderService({'counties': GEODF}, max_workers=1, max_pending=1)
+
+    async def run():
+        # The second request waits on the semaphore
+        return await asyncio.gather(*[
+            rs.render(geometry='counties', data=DATA, cat_col='category')
+            for _ in range(2)])
+    try:
+        for _ in range(2):
+            images = asyncio.run(run())
+            assert all(png.startswith(b'\x89PNG') for png in images)
+    finally:
+        rs.close()
@@ -0,0 +1,48 @@
+'''Tests for the per-state index of national shapefiles'''
+from choroshape import *
+from conftest import grid_geodata
+import numpy as np
+import os
+import pandas as pd
+
+
+def write_national(tmpdir):
+    geodf = pd.concat([grid_geodata(20), grid_geodata(12, state='06')],
+                      ignore_index=True).iloc[::-1]
+    geodf['STATEFP'] = geodf['FIPS'].str[:2].astype(int)
+    geodf['COUNTYFP'] = geodf['FIPS'].str[2:]
+    path = str(tmpdir.join('us.shp'))
+    geodf[['STATEFP', 'COUNTYFP', 'geometry']].to_file(path)
+    return path
+
+
+def test_state_index(tmpdir):
+    path = write_national(tmpdir)
+    index = StateIndex(path, geostate_col='STATEFP')
+    assert index.states == ['06', '48'] and os.path.exists(index.index_path)
+    for state in index.states:
+        direct = load_geodata(path, state, geostate_col='STATEFP')
+        direct = direct.sort_values('FIPS').reset_index(drop=True)
+        indexed = load_geodata(index, int(state))
+        assert list(indexed['FIPS']) == list(direct['FIPS'])
+        assert indexed.geometry.geom_equals(direct.geometry).all()
+    assert index.load('06') is index.load(6)
+    assert len(index.load('01')) == 0
+
+    # Opening it again reuses the file until the shapefile changes
+    built = os.path.getmtime(index.index_path)
+    assert StateIndex(path, geostate_col='STATEFP').states == index.states
+    assert os.path.getmtime(index.index_path) == built
+    os.utime(path, (built + 10, built + 10))
+    StateIndex(path, geostate_col='STATEFP')
+    assert os.path.getmtime(index.index_path) != built
+
+
+def test_state_index_choropleth(tmpdir):
+    index = StateIndex(write_national(tmpdir), geostate_col='STATEFP')
+    data = pd.DataFrame({'FIPS': index.load('06')['FIPS'],
+                         'category': np.arange(12) + 1.0,
+                         'total': 20.0})
+    saved = make_choropleth(data, index, '06', cat_name='ca',
+                            out_path=str(tmpdir))
+    assert os.path.exists(saved)
@@ -0,0 +1,90 @@
+'''Tests for rate smoothing and reliability flags'''
+from choroshape import *
+from choroshape.geometry import GeometryStore
+from conftest import grid_geodata
+import numpy as np
+import pandas as pd
+
+
+def make_counts(n=20, seed=2):
+    rng = np.random.RandomState(seed)
+    population = rng.randint(50, 20000, n).astype(float)
+    population[3] = 0
+    events = rng.binomial(population.astype(int),
+                          rng.uniform(.02, .3, n)).astype(float)
+    return events, population
+
+
+def test_adjacency_cached():
+    store = GeometryStore(grid_geodata(), 'FIPS')
+    adjacency = store.adjacency()
+    assert store.adjacency() is adjacency
+    assert (adjacency != adjacency.T).nnz == 0
+    # Corners of the 5 x 4 grid touch 3 squares, inner squares 8
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    assert degree[0] == 3 and degree[6] == 8
+
+
+def test_global_empirical_bayes():
+    events, population = make_counts()
+    smoothed = empirical_bayes(events, population)
+    # Written out area by area
+    used = population > 0
+    rates = events[used] / population[used]
+    ref = events.sum() / population.sum()
+    variance = (population[used] * (rates - ref) ** 2).sum() / \
+        population.sum()
+    prior = max(variance - ref / population[used].mean(), 0)
+    for i in range(len(events)):
+        if population[i] == 0:
+            assert smoothed[i] == ref
+            continue
+        w = prior / (prior + ref / population[i])
+        expected = w * events[i] / population[i] + (1 - w) * ref
+        assert abs(smoothed[i] - expected) < 1e-12
+
+
+def test_spatial_methods():
+    geodf = grid_geodata()
+    store = GeometryStore(geodf, 'FIPS')
+    events, population = make_counts()
+    pooled = smooth_rates(events, population, 'spatial', store)
+    local = smooth_rates(events, population, 'spatial_eb', store)
+    for i, shape in enumerate(geodf.geometry):
+        hood = [j for j, other in enumerate(geodf.geometry)
+                if shape.intersects(other)]
+        ref = events[hood].sum() / population[hood].sum()
+        assert abs(pooled[i] - ref) < 1e-12
+        if population[i] == 0:
+            assert abs(local[i] - ref) < 1e-12
+
+
+def test_dataset_smoothing_and_cv():
+    geodf = grid_geodata()
+    events, population = make_counts()
+    df = pd.DataFrame({'FIPS': geodf['FIPS'], 'category': events,
+                       'total': population,
+                       'category_moe': np.sqrt(events) * 3,
+                       'total_moe': 5.0}).astype(object)
+    df.loc[7, 'category'] = 'S'
+    options = dict(cat_col='category', total_col='total', precision=3)
+    raw = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', **options)
+    eb = AreaPopDataset(df, geodf, 'FIPS', 'FIPS', smoothing='eb', **options)
+    used = np.isfinite(raw.values)
+    ref = np.nansum(raw.counts[used, 0]) / np.nansum(raw.counts[used, 1])
+    # Shrunk towards the overall rate, never past it
+    assert (np.abs(eb.values[used] - ref) <=
+            np.abs(raw.values[used] - ref) + .001).all()
+    assert eb.true_exceptions == raw.true_exceptions
+
+    flagged = AreaPopDataset(df, geodf, 'FIPS', 'FIPS',
+                             moe_cols=['category_moe', 'total_moe'],
+                             max_cv=.1, **options)
+    cv = ratio_cv(raw.counts[:, 0], df['category_moe'].astype(float),
+                  raw.counts[:, 1], np.full(20, 5.0))
+    unreliable = flagged.exception_masks['cv']
+    assert unreliable.any() and not unreliable[7]
+    np.testing.assert_array_equal(unreliable[used], ~(cv[used] <= .1))
+    assert flagged.group_names[-1] == 'Unreliable estimate'
+    assert (flagged.groups[unreliable] == flagged.num_cats + 1 +
+            flagged.true_exceptions.index('cv')).all()
@@ -0,0 +1,104 @@
+'''Tests for map tile pyramids'''
+from choroshape import *
+from conftest import grid_geodata
+from PIL import Image
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import sqlite3
+
+
+def make_tile_dataset(values=None):
+    '''A grid of 20 counties, 4 degrees across each, in longitude and
+    latitude'''
+    geodata = grid_geodata().set_crs('EPSG:4326')
+    geodata['geometry'] = geodata.geometry.scale(4, 4, origin=(0, 0)).translate(
+        1, 1)
+    if values is None:
+        values = np.arange(len(geodata), dtype=float)
+        values[0] = -1
+    df = pd.DataFrame({'FIPS': geodata['FIPS'], 'value': values})
+    return AreaPopDataset(df, geodata, 'FIPS', 'FIPS', total_col='value',
+                          cat_name='grid', bins=[0, 5, 10, 15, 20])
+
+
+def test_directory_tiles(tmpdir):
+    pyramid = TilePyramid(make_tile_dataset(), max_zoom=5)
+    assert [len(pyramid.tiles(z)) for z in range(3)] == [1, 1, 1]
+    # County 0 is below the first bin and is not drawn
+    assert all(0 not in indices for z in range(6)
+               for _, _, indices in pyramid.tiles(z))
+    path = str(tmpdir.join('tiles'))
+    counts = pyramid.render(path, n_jobs=1)
+    total = sum(len(pyramid.tiles(z)) for z in range(6))
+    assert counts['rendered'] + counts['empty'] == total
+    assert counts['rendered'] > 0 and counts['unchanged'] == 0
+    with open_tile_store(path) as store:
+        x, y, _ = pyramid.tiles(5)[0]
+        image = Image.open(io.BytesIO(store.get(5, x, y)))
+        assert image.size == (256, 256) and image.mode == 'RGBA'
+        assert tmpdir.join('tiles', '5', str(x), '%d.png' % y).check()
+    assert pyramid.render(path, n_jobs=1) == {
+        'rendered': 0, 'unchanged': total, 'empty': 0, 'removed': 0}
+
+
+def test_mbtiles_redraws_changed_tiles(tmpdir):
+    path = str(tmpdir.join('grid.mbtiles'))
+    first = TilePyramid(make_tile_dataset(), max_zoom=6).render(path, n_jobs=2)
+    values = np.arange(20, dtype=float)
+    values[0] = -1
+    values[19] = 3  # the top right county moves to the first group
+    pyramid = TilePyramid(make_tile_dataset(values), max_zoom=6)
+    counts = pyramid.render(path, n_jobs=2)
+    changed = sum(19 in indices for z in range(7)
+                  for _, _, indices in pyramid.tiles(z))
+    assert 0 < counts['rendered'] == changed < first['rendered']
+    db = sqlite3.connect(path)
+    metadata = dict(db.execute('SELECT name, value FROM metadata'))
+    assert metadata['format'] == 'png' and metadata['maxzoom'] == '6'
+    assert [float(b) for b in metadata['bounds'].split(',')] == \
+        pytest.approx([1, 1, 21, 17])
+    # Rows are counted from the bottom
+    stored = set(db.execute('SELECT tile_column, tile_row FROM tiles '
+                            'WHERE zoom_level = 6'))
+    assert stored == set((x, 2 ** 6 - 1 - y)
+                         for x, y, _ in pyramid.tiles(6))
+    assert db.execute('SELECT COUNT(*) FROM tiles').fetchone() == \
+        db.execute('SELECT COUNT(*) FROM tile_keys').fetchone()
+
+
+def test_empty_tiles_removed(tmpdir):
+    path = str(tmpdir.join('tiles'))
+    TilePyramid(make_tile_dataset(), max_zoom=4).render(path, n_jobs=1)
+    # Nothing falls in a group now
+    counts = TilePyramid(make_tile_dataset(np.full(20, -1.0)), max_zoom=4).render(
+        path, n_jobs=1)
+    assert counts['rendered'] == 0 and counts['removed'] > 0
+    with open_tile_store(path) as store:
+        assert all(not store.tiles(z) for z in range(5))
+
+
+def test_needs_crs():
+    geodata = grid_geodata()
+    df = pd.DataFrame({'FIPS': geodata['FIPS'], 'value': np.ones(20)})
+    apd = AreaPopDataset(df, geodata, 'FIPS', 'FIPS', total_col='value',
+                         bins=[0, 5, 10])
+    with pytest.raises(ValueError):
+        TilePyramid(apd)
+
+
+def test_borders_in_points(tmpdir):
+    data = make_tile_dataset()
+    widths = []
+    for size in ['small', 'large']:
+        style = ChoroplethStyle(border_color='#ff0000', size=size)
+        pyramid = TilePyramid(data, style, min_zoom=4, max_zoom=4)
+        path = str(tmpdir.join(size))
+        pyramid.render(path, n_jobs=1)
+        with open_tile_store(path) as store:
+            x, y, _ = pyramid.tiles(4)[0]
+            image = np.asarray(Image.open(io.BytesIO(store.get(4, x, y))))
+        widths.append(((image[..., 0] > 200) & (image[..., 1] < 100)).sum())
+    # Twice the resolution, twice the border
+    assert 1.6 < widths[1] / float(widths[0]) < 2.4
@@ -0,0 +1,462 @@
+'''Slippy-map tiles of a classified dataset, for interactive viewers.
+
+A TilePyramid projects the shapes to web mercator once and simplifies them
+once per zoom level, to half a pixel by default, so each zoom draws only
+the detail it can show. Each 256 pixel tile clips its shapes out of its
+zoom level and colors them from the dataset's classification with the
+style's palette, the same colors as the static map. Tiles are rendered in
+parallel worker processes and written to a directory of {z}/{x}/{y}.png
+files or to an MBTiles (SQLite) file.
+
+Tiles without shapes are not written. Every tile also has a key hashing
+what it shows: the geometry, the zoom, the shapes in the tile and their
+colors, and the style. A tile whose key is already in the store is neither
+drawn nor written again, so after the data changes only the tiles of the
+shapes whose group changed are redrawn.
+
+    pyramid = TilePyramid(dataset, 'oranges', max_zoom=10)
+    pyramid.render('poverty.mbtiles')
+'''
+
+from __future__ import unicode_literals
+
+__all__ = [
+    'DirectoryTileStore',
+    'MBTilesStore',
+    'TilePyramid',
+    'open_tile_store'
+]
+
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from six import string_types
+
+from ._lazy import LazyModule
+from .cache import style_fingerprint
+
+np = LazyModule('numpy')
+shapely = LazyModule('shapely')
+mfigure = LazyModule('matplotlib.figure')
+mpath = LazyModule('matplotlib.path')
+mcollections = LazyModule('matplotlib.collections')
+mcolors = LazyModule('matplotlib.colors')
+backend_agg = LazyModule('matplotlib.backends.backend_agg')
+Image = LazyModule('PIL.Image')
+
+# Bump when tiles drawn from the same inputs would come out differently
+TILE_VERSION = 2
+WEB_MERCATOR = 'EPSG:3857'
+# Half the width of the web mercator world, in meters
+_EXTENT = 20037508.342789244
+# Tiles sent to a worker at a time
+_CHUNK = 64
+
+
+def _tile_bounds(z, x, y):
+    '''Web mercator bounds of tile x, y (counted from the top left) at zoom
+    z'''
+    size = 2 * _EXTENT / 2 ** z
+    return (-_EXTENT + x * size, _EXTENT - (y + 1) * size,
+            -_EXTENT + (x + 1) * size, _EXTENT - y * size)
+
+
+class TilePyramid(object):
+
+    def __init__(self, area_data, ch_style=None, min_zoom=0, max_zoom=8,
+                 tile_size=256, tolerance=.5):
+        '''Tiles of a classified dataset from min_zoom to max_zoom
+        Attributes:
+            area_data(AreaPopDataset object): or any other dataset with a
+                classification, e.g. an IndicatorView. Its shapes need a
+                coordinate reference system.
+            ch_style(ChoroplethStyle object or str): palette and borders
+            min_zoom, max_zoom(int): zoom levels to make tiles for
+            tile_size(int): tile width and height in pixels
+            tolerance(float): how far simplified shapes may stray from the
+                real ones, in pixels of each zoom level
+            rgbs(list[tuple]): color of each group, exception groups
+                included
+            '''
+        from .choroshape import ChoroplethStyle
+        if isinstance(ch_style, string_types) or ch_style is None:
+            ch_style = ChoroplethStyle(ch_style)
+        self.area_data = area_data
+        self.ch_style = ch_style
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.tile_size = tile_size
+        self.tolerance = tolerance
+        self.geometry = area_data.geometry.to_crs(WEB_MERCATOR)
+        classification = area_data.classification
+        self.rgbs = (ch_style.get_colors(area_data.num_cats, area_data.bins) +
+                     ch_style.get_exception_colors(classification.exceptions))
+
+    def pixel_size(self, zoom):
+        '''Meters per pixel at a zoom level'''
+        return 2 * _EXTENT / (self.tile_size * 2 ** zoom)
+
+    def shapes(self, zoom):
+        '''The shapes simplified for a zoom level, see
+        GeometryStore.simplified'''
+        return self.geometry.simplified(self.tolerance * self.pixel_size(zoom))
+
+    def tiles(self, zoom):
+        '''The tiles at a zoom level with shapes to draw
+        Returns:
+            list[tuple(int, int, numpy.ndarray)]: x, y and the indices of
+                the shapes that touch each tile'''
+        drawn = np.flatnonzero(self.area_data.classification.codes > 0)
+        if not len(drawn):
+            return []
+        shapes = self.shapes(zoom)[drawn]
+        n = 2 ** zoom
+        size = 2 * _EXTENT / n
+        minx, miny, maxx, maxy = shapely.total_bounds(shapes)
+        xs = np.arange(max(0, int((minx + _EXTENT) // size)),
+                       min(n - 1, int((maxx + _EXTENT) // size)) + 1)
+        ys = np.arange(max(0, int((_EXTENT - maxy) // size)),
+                       min(n - 1, int((_EXTENT - miny) // size)) + 1)
+        x, y = [a.ravel() for a in np.meshgrid(xs, ys, indexing='ij')]
+        boxes = shapely.box(-_EXTENT + x * size, _EXTENT - (y + 1) * size,
+                            -_EXTENT + (x + 1) * size, _EXTENT - y * size)
+        # Every tile against every shape at once
+        tile, shape = shapely.STRtree(shapes).query(boxes,
+                                                    predicate='intersects')
+        order = np.lexsort((shape, tile))
+        tile, shape = tile[order], drawn[shape[order]]
+        starts = np.flatnonzero(np.r_[True, tile[1:] != tile[:-1]])
+        return [(int(x[tile[s]]), int(y[tile[s]]), part)
+                for s, part in zip(starts, np.split(shape, starts[1:]))]
+
+    def _base_key(self):
+        return '\x1f'.join([
+            str(TILE_VERSION), self.area_data.geometry_fingerprint(),
+            repr((self.tile_size, self.tolerance)),
+            style_fingerprint(self.ch_style)])
+
+    def tile_key(self, zoom, x, y, indices, colors):
+        '''Hash of everything a tile shows
+        Args:
+            indices(numpy.ndarray): the shapes in the tile
+            colors(numpy.ndarray): the rgba color of every shape'''
+        sha = hashlib.sha1(self._base_key().encode('utf-8'))
+        sha.update(np.array([zoom, x, y], dtype=np.int64).tobytes())
+        sha.update(np.ascontiguousarray(indices, dtype=np.int64).tobytes())
+        sha.update(np.ascontiguousarray(colors[indices]).tobytes())
+        return sha.hexdigest()
+
+    def render(self, store, n_jobs=None):
+        '''Draws the tiles that are missing or changed and writes them
+        Args:
+            store(str or DirectoryTileStore or MBTilesStore): where the
+                tiles go; a path ending in .mbtiles is an MBTiles file, any
+                other a directory
+            n_jobs(int): worker processes, default is the number of CPUs;
+                1 draws everything in this process
+        Returns:
+            counts(dict{str: int}): tiles 'rendered', 'unchanged' (key
+                already in the store), 'empty' (nothing drawn after
+                clipping) and 'removed' (stored, but empty now)'''
+        if isinstance(store, string_types):
+            with open_tile_store(store) as opened:
+                return self.render(opened, n_jobs)
+        colors = self.area_data.classification.colors(self.rgbs)
+        # border_width is in points; tiles are drawn at the style's
+        # resolution, so borders weigh as much as on the static maps
+        border = (mcolors.to_rgba(self.ch_style.border_color),
+                  self.ch_style.border_width * self.ch_style.resolution / 72.0)
+        counts = {'rendered': 0, 'unchanged': 0, 'empty': 0, 'removed': 0}
+        jobs = []
+        for zoom in range(self.min_zoom, self.max_zoom + 1):
+            shapes = self.shapes(zoom)
+            specs = []
+            seen = set()
+            for x, y, indices in self.tiles(zoom):
+                key = self.tile_key(zoom, x, y, indices, colors)
+                seen.add((x, y))
+                if store.get_key(zoom, x, y) == key:
+                    counts['unchanged'] += 1
+                    continue
+                specs.append((zoom, x, y, key, indices))
+            # Tiles stored before that have nothing to draw now
+            for x, y in store.tiles(zoom):
+                if (x, y) not in seen:
+                    store.delete(zoom, x, y)
+                    counts['removed'] += 1
+            for i in range(0, len(specs), _CHUNK):
+                chunk = specs[i:i + _CHUNK]
+                used = np.unique(np.concatenate([s[4] for s in chunk]))
+                jobs.append(([(z, x, y, key, np.searchsorted(used, ind))
+                              for z, x, y, key, ind in chunk],
+                             shapes[used], colors[used], self.tile_size,
+                             border))
+
+        if n_jobs == 1 or len(jobs) < 2:
+            results = (_render_chunk(*job) for job in jobs)
+            pool = None
+        else:
+            fork = 'fork' in multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if fork else None)
+            pool = ProcessPoolExecutor(n_jobs, mp_context=context)
+            results = pool.map(_render_chunk, *zip(*jobs))
+        try:
+            for result in results:
+                for z, x, y, key, data in result:
+                    if data is None:
+                        counts['empty'] += 1
+                        if store.get_key(z, x, y) is not None:
+                            store.delete(z, x, y)
+                            counts['removed'] += 1
+                        continue
+                    store.put(z, x, y, data, key)
+                    counts['rendered'] += 1
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        store.set_metadata(self.metadata())
+        return counts
+
+    def metadata(self):
+        '''MBTiles metadata: name, format, zoom levels, bounds and center'''
+        lonlat = self.area_data.geometry.to_crs('EPSG:4326').bounds()
+        return {'name': self.area_data.cat_name, 'format': 'png',
+                'type': 'overlay', 'minzoom': self.min_zoom,
+                'maxzoom': self.max_zoom,
+                'bounds': ','.join('%.6f' % b for b in lonlat),
+                'center': '%.6f,%.6f,%d' % ((lonlat[0] + lonlat[2]) / 2,
+                                            (lonlat[1] + lonlat[3]) / 2,
+                                            self.min_zoom)}
+
+
+# The figure each worker draws its tiles on, made once per tile size
+_CANVASES = {}
+
+
+def _canvas(tile_size):
+    if tile_size not in _CANVASES:
+        fig = mfigure.Figure(figsize=(1, 1), dpi=tile_size)
+        fig.patch.set_alpha(0)
+        canvas = backend_agg.FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        _CANVASES[tile_size] = (canvas, ax)
+    return _CANVASES[tile_size]
+
+
+def _path(geometry):
+    '''A matplotlib path of the polygons in a clipped shape, holes included'''
+    vertices = []
+    codes = []
+    for part in shapely.get_parts(geometry):
+        if part.geom_type != 'Polygon':
+            continue  # lines and points left on the tile's edge
+        for ring in [part.exterior] + list(part.interiors):
+            xy = np.asarray(ring.coords)
+            ring_codes = np.full(len(xy), mpath.Path.LINETO, dtype=np.uint8)
+            ring_codes[0] = mpath.Path.MOVETO
+            ring_codes[-1] = mpath.Path.CLOSEPOLY
+            vertices.append(xy)
+            codes.append(ring_codes)
+    if not vertices:
+        return None
+    return mpath.Path(np.concatenate(vertices), np.concatenate(codes))
+
+
+def _render_chunk(specs, shapes, colors, tile_size, border):
+    '''Draws some tiles in a worker
+    Args:
+        specs(list[tuple]): zoom, x, y, key and the positions of its shapes
+            in shapes
+        shapes(numpy.ndarray[shapely geometry]): simplified shapes
+        colors(numpy.ndarray): rgba color of each shape
+        tile_size(int): pixels
+        border(tuple): rgba color and width in pixels of the borders
+    Returns:
+        list[tuple]: zoom, x, y, key and the PNG bytes of each tile, None
+            for tiles that came out empty'''
+    canvas, ax = _canvas(tile_size)
+    results = []
+    for z, x, y, key, positions in specs:
+        x0, y0, x1, y1 = _tile_bounds(z, x, y)
+        # A few pixels more, so borders on the edge run on to the next tile
+        pad = (4 + border[1]) * (x1 - x0) / tile_size
+        clipped = shapely.clip_by_rect(shapes[positions], x0 - pad, y0 - pad,
+                                       x1 + pad, y1 + pad)
+        paths = [_path(g) for g in clipped]
+        keep = [i for i, p in enumerate(paths) if p is not None]
+        data = None
+        if keep:
+            collection = mcollections.PathCollection(
+                [paths[i] for i in keep],
+                facecolors=colors[positions][keep], edgecolors=[border[0]],
+                # The figure is one inch of tile_size pixels
+                linewidths=border[1] * 72.0 / tile_size,
+                transform=ax.transData)
+            ax.add_collection(collection, autolim=False)
+            ax.set_xlim(x0, x1)
+            ax.set_ylim(y0, y1)
+            canvas.draw()
+            collection.remove()
+            image = np.asarray(canvas.buffer_rgba())
+            if image[..., 3].any():
+                buf = io.BytesIO()
+                Image.fromarray(image.copy()).save(buf, format='PNG')
+                data = buf.getvalue()
+        results.append((z, x, y, key, data))
+    return results
+
+
+class DirectoryTileStore(object):
+
+    def __init__(self, path):
+        '''Tiles as {z}/{x}/{y}.png files in a directory, with their keys in
+        keys.json
+        Attributes:
+            path(str): the directory, made if missing
+            '''
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._keys_path = os.path.join(path, 'keys.json')
+        self._keys = {}
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path) as f:
+                self._keys = json.load(f)
+        self.metadata = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _tile_path(self, z, x, y):
+        return os.path.join(self.path, str(z), str(x), '%d.png' % y)
+
+    def get_key(self, z, x, y):
+        '''The key of a stored tile, None if there is none'''
+        return self._keys.get('%d/%d/%d' % (z, x, y))
+
+    def tiles(self, z):
+        '''x, y of the stored tiles at zoom z'''
+        return [tuple(int(v) for v in name.split('/')[1:])
+                for name in self._keys if name.split('/')[0] == str(z)]
+
+    def put(self, z, x, y, data, key):
+        path = self._tile_path(z, x, y)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._keys['%d/%d/%d' % (z, x, y)] = key
+
+    def get(self, z, x, y):
+        '''The PNG bytes of a tile, None if there is none'''
+        if self.get_key(z, x, y) is None:
+            return None
+        with open(self._tile_path(z, x, y), 'rb') as f:
+            return f.read()
+
+    def delete(self, z, x, y):
+        self._keys.pop('%d/%d/%d' % (z, x, y), None)
+        path = self._tile_path(z, x, y)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def set_metadata(self, metadata):
+        self.metadata.update(metadata)
+
+    def close(self):
+        '''Writes the keys and the metadata'''
+        with open(self._keys_path, 'w') as f:
+            json.dump(self._keys, f, sort_keys=True)
+        with open(os.path.join(self.path, 'metadata.json'), 'w') as f:
+            json.dump(self.metadata, f, sort_keys=True)
+
+
+class MBTilesStore(object):
+
+    def __init__(self, path):
+        '''Tiles in an MBTiles file, a SQLite database, with their keys in
+        an extra table. Rows are counted from the bottom as MBTiles
+        requires; the methods take them from the top like directory tiles.
+        Attributes:
+            path(str): the file, made if missing
+            '''
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT,
+                UNIQUE (name));
+            CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER,
+                tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+                UNIQUE (zoom_level, tile_column, tile_row));
+            CREATE TABLE IF NOT EXISTS tile_keys (zoom_level INTEGER,
+                tile_column INTEGER, tile_row INTEGER, key TEXT,
+                UNIQUE (zoom_level, tile_column, tile_row));''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @staticmethod
+    def _row(z, y):
+        return 2 ** z - 1 - y
+
+    def get_key(self, z, x, y):
+        row = self.db.execute(
+            'SELECT key FROM tile_keys WHERE zoom_level = ? AND '
+            'tile_column = ? AND tile_row = ?',
+            (z, x, self._row(z, y))).fetchone()
+        return row[0] if row is not None else None
+
+    def tiles(self, z):
+        return [(x, self._row(z, row)) for x, row in self.db.execute(
+            'SELECT tile_column, tile_row FROM tile_keys WHERE '
+            'zoom_level = ?', (z,))]
+
+    def put(self, z, x, y, data, key):
+        args = (z, x, self._row(z, y))
+        self.db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                        args + (sqlite3.Binary(data),))
+        self.db.execute('INSERT OR REPLACE INTO tile_keys VALUES '
+                        '(?, ?, ?, ?)', args + (key,))
+
+    def get(self, z, x, y):
+        row = self.db.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+            'tile_column = ? AND tile_row = ?',
+            (z, x, self._row(z, y))).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def delete(self, z, x, y):
+        for table in ('tiles', 'tile_keys'):
+            self.db.execute('DELETE FROM %s WHERE zoom_level = ? AND '
+                            'tile_column = ? AND tile_row = ?' % table,
+                            (z, x, self._row(z, y)))
+
+    def set_metadata(self, metadata):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+            [(k, '%s' % v) for k, v in sorted(metadata.items())])
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def open_tile_store(path):
+    '''An MBTilesStore for a path ending in .mbtiles, otherwise a
+    DirectoryTileStore'''
+    if os.path.splitext(path)[1].lower() == '.mbtiles':
+        return MBTilesStore(path)
+    return DirectoryTileStore(path)
@@ -6,7 +6,7 @@ __version__ = '0.0.1a'
 if len(set(('test', 'easy_install')).intersection(sys.argv)) > 0:
     import setuptools
 
-tests_require = ['pytest']
+tests_require = ['pytest', 'hypothesis']
 
 extra_setuptools_args = {}
 
@@ -20,6 +20,7 @@ setup(
     packages=find_packages(exclude=['choroshape/tests']),
     install_requires=['six', 'geopandas', 'pandas', 'numpy', 'matplotlib'],
     tests_require=tests_require,
+    entry_points={'console_scripts': ['choroshape=choroshape.cli:main']},
     license='MIT',
     download_url='https://github.com/rasquith/choroshape/archive/%s.tar.gz' % __version__,
     **extra_setuptools_args